@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.db.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -86,12 +87,20 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 DATABASES = {
     'default': {
-        "ENGINE": "django.db.backends.postgresql",
+        # PostgreSQL with pooled connections (see utils/db/backends/postgresql_pool/base.py)
+        "ENGINE": "utils.db.backends.postgresql_pool",
         "NAME": "social_db",
         "USER": "admin",
         "PASSWORD": "12345",
         "HOST": "172.19.0.2",
         "PORT": "5432",
+        "POOL": {
+            "MIN_SIZE": 2,
+            "MAX_SIZE": 20,
+            "TIMEOUT": 5,  # seconds to wait for a free connection
+            "MAX_AGE": 1800,  # seconds before a connection is replaced
+            "CHECK_AFTER": 30,  # seconds idle before a connection is pinged on checkout
+        },
     }
 }
 
@@ -142,7 +151,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",  # JWT Authentication
+        "users.authentication.CachedJWTAuthentication",  # JWT Authentication, users read through the cache
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
@@ -165,4 +174,58 @@ SPECTACULAR_SETTINGS = {
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=4),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
-}
\ No newline at end of file
+}
+
+# Friends adjacency cache (see friends/cache.py). The LocMem backend is per process: other workers may serve a
+# user's old friend ids for up to "timeout" seconds after a change. Use friends.cache.DjangoCacheBackend over a cache
+# shared by the workers to avoid that.
+FRIENDS_ADJACENCY_CACHE = {
+    "BACKEND": "friends.cache.LocMemLRUBackend",
+    "OPTIONS": {"max_entries": 10000, "timeout": 5},
+}
+
+# Run independent queries of the async friends views concurrently, in a pool of threads that each hold one
+# database connection, or check one out of the POOL above for each query (see friends/async_views.py)
+FRIENDS_ASYNC_PARALLEL_QUERIES = True
+FRIENDS_ASYNC_QUERY_THREADS = 10
+
+# Friendship events are delivered to the outbox handlers by the run_outbox_worker command (see friends/outbox.py).
+# Failed deliveries are retried after FRIENDS_OUTBOX_RETRY_DELAY seconds, doubling every attempt.
+FRIENDS_OUTBOX_MAX_ATTEMPTS = 8
+FRIENDS_OUTBOX_RETRY_DELAY = 5
+
+# Broker of the friend request event streams (see friends/notifications.py). LocalBroker only reaches streams served
+# by the same process; use friends.notifications.PostgresBroker when running several workers.
+FRIENDS_NOTIFICATIONS = {
+    "BACKEND": "friends.notifications.LocalBroker",
+    "OPTIONS": {"max_queued": 100},
+}
+
+# Users resolved by users.authentication.CachedJWTAuthentication are cached for USER_AUTH_CACHE_TIMEOUT seconds
+USER_AUTH_CACHE_ALIAS = "default"
+USER_AUTH_CACHE_TIMEOUT = 60
+
+# Reads of HTTP requests go to the DATABASE_REPLICAS aliases lagging at most REPLICA_MAX_LAG seconds behind the
+# primary, measured every REPLICA_LAG_CHECK_INTERVAL seconds. A user's reads stay on the primary for
+# REPLICA_STICKY_SECONDS after their last write (see utils/db/replicas.py). That pin is kept in the default cache,
+# which must be shared between the workers (configure CACHES) for it to hold when a user's next request lands on
+# another process; otherwise only the cookie carries it.
+DATABASE_ROUTERS = ["utils.db.routers.ReplicaRouter"]
+DATABASE_REPLICAS = []
+REPLICA_MAX_LAG = 2
+REPLICA_LAG_CHECK_INTERVAL = 1
+REPLICA_STICKY_SECONDS = 5
+
+# "directed" stores every friendship as two Friend rows, "canonical" as one (lower id, higher id) row that the
+# friends_friend_edges view reads from both sides (see friends/storage.py). Switch with the convert_friend_storage
+# command.
+FRIENDS_STORAGE = "directed"
+
+# The degrees-of-separation search looks for paths of at most FRIENDS_PATH_MAX_DEPTH friendships and gives up when
+# a level of the search reaches more than FRIENDS_PATH_MAX_FRONTIER users (see friends/paths.py)
+FRIENDS_PATH_MAX_DEPTH = 6
+FRIENDS_PATH_MAX_FRONTIER = 10000
+
+# Snapshot of the friend graph written by the build_friend_snapshot command and memory-mapped by every worker when
+# FRIENDS_ADJACENCY_CACHE uses the friends.snapshot.SnapshotBackend backend (see friends/snapshot.py)
+FRIENDS_SNAPSHOT_PATH = BASE_DIR / "friend_graph.csr"
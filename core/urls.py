@@ -8,6 +8,8 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from utils.views import DatabasePoolStatsView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     re_path(
@@ -16,6 +18,7 @@ urlpatterns = [
     re_path(
         "api/v1/friends/", include(("friends.urls", "friends"))
     ),
+    path("api/v1/db-pool-stats/", DatabasePoolStatsView.as_view(), name="db-pool-stats"),
     path("api/v1/schema/", SpectacularAPIView.as_view(api_version="v1"), name="schema"),
     path(
         "api/v1/schema/swagger-ui/", SpectacularSwaggerView.as_view(), name="swagger-ui"
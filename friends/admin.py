@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Friend, FriendshipRequest
+from .models import Friend, FriendshipRequest, FriendSuggestion, OutboxEvent
 
 
 # Register your models here.
@@ -12,3 +12,14 @@ class FriendAdmin(admin.ModelAdmin):
 @admin.register(FriendshipRequest)
 class FriendAdmin(admin.ModelAdmin):
     list_display = ['from_user', 'to_user']
+
+
+@admin.register(FriendSuggestion)
+class FriendSuggestionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'suggested_user', 'mutual_count']
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['event', 'created_at', 'attempts', 'available_at', 'failed_at']
+    list_filter = ['event']
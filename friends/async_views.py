@@ -0,0 +1,323 @@
+"""
+Async versions of the read-only friends endpoints, for the ASGI entry point.
+
+Responses are identical to the views in ``friends.views``. Queries that don't
+depend on each other, such as loading both users of a friendship status or
+the request and friendship halves of a batch status lookup, run concurrently:
+``gather_queries`` runs each one in a thread of a small pool, on that thread's
+own database connection, so one ASGI worker keeps serving other requests while
+the database answers. With the pooled backend of ``utils.db.backends`` that
+connection is checked out of the pool for each query only. The pool is ``FRIENDS_ASYNC_QUERY_THREADS`` threads wide;
+set ``FRIENDS_ASYNC_PARALLEL_QUERIES = False`` to run the queries one after
+another on the request's connection instead.
+"""
+import asyncio
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.views import View
+from rest_framework import exceptions, permissions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from users.models import UserModel
+from .models import Friend, FriendSuggestion
+from .mutual import intersect_sorted, mutual_friends
+from .notifications import get_broker, unread_count_events
+from .pagination import KeysetPagination
+from .projections import FriendProjection, FriendSuggestionProjection, UserSummaryProjection
+
+
+_query_executor = None
+_query_executor_lock = threading.Lock()
+# Connections opened by the query threads, closed by shutdown_query_executor()
+_query_connections = set()
+
+
+def get_query_executor():
+    """ The thread pool running the concurrent queries, `FRIENDS_ASYNC_QUERY_THREADS` threads wide """
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "FRIENDS_ASYNC_QUERY_THREADS", 10), thread_name_prefix="friends-query"
+            )
+        return _query_executor
+
+
+def shutdown_query_executor():
+    """ Stop the query threads, which closes the database connections they hold """
+    global _query_executor
+    with _query_executor_lock:
+        executor, _query_executor = _query_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    with _query_executor_lock:
+        opened = list(_query_connections)
+        _query_connections.clear()
+    for conn in opened:
+        # The thread that owned the connection is gone, so closing it from here is safe.
+        conn.inc_thread_sharing()
+        try:
+            conn.close()
+        finally:
+            conn.dec_thread_sharing()
+
+
+def _in_query_thread(function):
+    # Query threads keep their connection open between calls, like persistent connections, so there are at most
+    # FRIENDS_ASYNC_QUERY_THREADS of them. A connection is only dropped once it's broken. Connections of a pooled
+    # backend go back to the pool after every call instead, so idle query threads don't hold pool slots.
+    def run():
+        try:
+            return function()
+        finally:
+            for conn in connections.all(initialized_only=True):
+                if getattr(conn, "pool", None) is not None:
+                    conn.close()
+                    continue
+                _query_connections.add(conn)
+                if conn.errors_occurred:
+                    if conn.connection is not None and conn.is_usable():
+                        conn.errors_occurred = False
+                    else:
+                        conn.close()
+    return run
+
+
+async def gather_queries(*functions):
+    """ Run blocking ORM callables concurrently and return their results in order """
+    if not getattr(settings, "FRIENDS_ASYNC_PARALLEL_QUERIES", True):
+        return [await sync_to_async(function)() for function in functions]
+    executor = get_query_executor()
+    return await asyncio.gather(
+        *(sync_to_async(_in_query_thread(function), thread_sensitive=False, executor=executor)()
+          for function in functions)
+    )
+
+
+@receiver(setting_changed)
+def _reset_query_executor(setting, **kwargs):
+    if setting == "FRIENDS_ASYNC_QUERY_THREADS":
+        shutdown_query_executor()
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's `APIView` for read-only JSON endpoints.
+
+    Authentication and permissions use the DRF defaults, API exceptions are rendered the way DRF renders them and
+    handlers return `(data, status)` pairs rendered with `JSONRenderer`, or a response of their own.
+    """
+    http_method_names = ["get"]
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in self.http_method_names:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        handler = getattr(self, request.method.lower())
+
+        request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        self.request = request
+        try:
+            await sync_to_async(self.check_permissions)(request)
+            result = await handler(request, *args, **kwargs)
+            if isinstance(result, HttpResponseBase):
+                return result
+            data, status_code = result
+        except exceptions.APIException as exc:
+            data, status_code = {"detail": exc.detail}, exc.status_code
+        return HttpResponse(JSONRenderer().render(data), status=status_code, content_type="application/json")
+
+    def check_permissions(self, request):
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, "message", None))
+
+    @staticmethod
+    async def get_user(username):
+        try:
+            return await UserModel.objects.aget(username=username)
+        except UserModel.DoesNotExist:
+            return None
+
+
+class AsyncKeysetListView(AsyncAPIView):
+    """ A keyset-paginated list rendered through a projection, like `ProjectionListMixin` views """
+    projection_class = None
+    ordering = None
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get_page(self, request, projection, queryset):
+        paginator = KeysetPagination()
+        lookups = projection.lookups() + [field.lstrip("-") for field in paginator.get_ordering(self)]
+        rows = paginator.paginate_queryset(queryset.values(*dict.fromkeys(lookups)), request, self)
+        return paginator, projection.render(rows)
+
+    async def get(self, request, *args, **kwargs):
+        paginator, results = await sync_to_async(self.get_page)(request, self.projection_class(), self.get_queryset())
+        return paginator.get_paginated_response(results).data, status.HTTP_200_OK
+
+
+class FriendListView(AsyncKeysetListView):
+    """ Async version of `friends.views.FriendListView` """
+    projection_class = FriendProjection
+
+    def get_queryset(self):
+        return Friend.objects.friendships(self.request.user)
+
+
+class FriendRequestsListView(AsyncKeysetListView):
+    """ Async version of `friends.views.FriendRequestsListView` """
+    projection_class = FriendProjection
+
+    def get_queryset(self):
+        return Friend.objects.requests(self.request.user)
+
+
+class FriendsOfFriendListView(AsyncKeysetListView):
+    """ Async version of `friends.views.FriendsOfFriendListView` """
+    projection_class = FriendSuggestionProjection
+    ordering = ("-mutual_count", "suggested_user_id")
+
+    def get_queryset(self):
+        return FriendSuggestion.objects.filter(user=self.request.user)
+
+
+class MutualFriendListView(AsyncAPIView):
+    """ Async version of `friends.views.MutualFriendListView`; the page and the total are read concurrently """
+
+    async def get(self, request, username=None, *args, **kwargs):
+        other_user = await self.get_user(username)
+        if other_user is None:
+            return {'detail': 'User not found'}, status.HTTP_400_BAD_REQUEST
+
+        projection = UserSummaryProjection("from_user__")
+        paginator = KeysetPagination()
+        queryset = mutual_friends.queryset(request.user, other_user).values(*projection.lookups(), "created_at", "id")
+        rows, paginator.count = await gather_queries(
+            lambda: paginator.paginate_queryset(queryset, request, self),
+            lambda: mutual_friends.count(request.user, other_user),
+        )
+        return paginator.get_paginated_response(projection.render(rows)).data, status.HTTP_200_OK
+
+
+class FriendshipStatusListView(AsyncAPIView):
+    """
+    Async version of `friends.views.FriendshipStatusListView`.
+
+    Both users are looked up concurrently, then both friend sets are loaded concurrently through the adjacency cache
+    and intersected in Python.
+    """
+    permission_classes = [permissions.AllowAny]
+    mutual_friends_limit = 100
+
+    async def get(self, request, username1=None, username2=None, *args, **kwargs):
+        user1, user2 = await gather_queries(
+            lambda: UserModel.objects.filter(username=username1).first(),
+            lambda: UserModel.objects.filter(username=username2).first(),
+        )
+        if user1 is None or user2 is None:
+            return {'detail': 'User not found'}, status.HTTP_400_BAD_REQUEST
+
+        friend_ids1, friend_ids2 = await gather_queries(
+            lambda: Friend.objects.friend_ids(user1),
+            lambda: Friend.objects.friend_ids(user2),
+        )
+        index = bisect_left(friend_ids1, user2.pk)
+        if index < len(friend_ids1) and friend_ids1[index] == user2.pk:
+            friends = await sync_to_async(UserSummaryProjection().project)(
+                Friend.objects.friends(user1)[:self.mutual_friends_limit]
+            )
+            return {"friendship_status": "Friends", "friends_or_mutual": friends}, status.HTTP_200_OK
+
+        ids = intersect_sorted(friend_ids1, friend_ids2)[:self.mutual_friends_limit]
+        users = await sync_to_async(UserSummaryProjection().project)(
+            UserModel.objects.filter(pk__in=ids).order_by("id")
+        )
+        return {"friendship_status": "Not Friends", "friends_or_mutual": users}, status.HTTP_200_OK
+
+
+class FriendshipStatusBatchView(AsyncAPIView):
+    """ Async version of `friends.views.FriendshipStatusBatchView`; requests and friendships are read concurrently """
+    max_usernames = 100
+
+    async def get(self, request, *args, **kwargs):
+        usernames = [
+            username.strip()
+            for value in request.query_params.getlist('usernames')
+            for username in value.split(',')
+            if username.strip()
+        ]
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            return {'detail': 'Please provide at least one username.'}, status.HTTP_400_BAD_REQUEST
+        if len(usernames) > self.max_usernames:
+            return {'detail': f'At most {self.max_usernames} usernames are allowed.'}, status.HTTP_400_BAD_REQUEST
+
+        users = UserModel.objects.filter(username__in=usernames).values_list('username', 'id')
+        user_ids = {username: user_id async for username, user_id in users}
+        requests, friend_ids = Friend.objects.relationship_querysets(request.user, user_ids.values())
+        requests, friend_ids = await gather_queries(lambda: list(requests), lambda: list(friend_ids))
+        statuses = Friend.objects.merge_relationship_statuses(request.user, user_ids.values(), requests, friend_ids)
+        results = [
+            {'username': username, 'status': statuses[user_ids[username]] if username in user_ids else 'not_found'}
+            for username in usernames
+        ]
+        return {'results': results}, status.HTTP_200_OK
+
+
+class FriendEventStreamView(AsyncAPIView):
+    """
+    Server-sent events of the authenticated user: new and accepted requests and the unread request count.
+
+    The stream opens with the current unread count. An idle stream waits on its queue without querying and sends a
+    comment every `heartbeat_interval` seconds, which keeps proxies from closing it and ends it once the client has
+    gone away.
+    """
+    heartbeat_interval = 15
+    retry_ms = 5000
+
+    async def get(self, request, *args, **kwargs):
+        # Subscribe before reading the count, so a change in between isn't missed.
+        subscription = get_broker().subscribe(request.user.pk)
+        try:
+            [(_, snapshot)] = await sync_to_async(unread_count_events)([request.user.pk])
+        except BaseException:
+            subscription.close()
+            raise
+        response = StreamingHttpResponse(self.stream(subscription, snapshot), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, subscription, snapshot):
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            yield self.format_event(snapshot)
+            while True:
+                try:
+                    event = await subscription.get(self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield self.format_event(event)
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def format_event(event):
+        return f"event: {event['event']}\ndata: {JSONRenderer().render(event['data']).decode()}\n\n"
@@ -0,0 +1,388 @@
+"""
+Benchmarks for the ``FriendshipManager`` methods and the friends API views.
+
+``run_suite`` times every benchmark against whatever graph is in the database
+and reports, per benchmark, the number of queries of one call, p50/p99
+latency over ``repeat`` calls and the peak Python memory allocated by one call.
+``run_throughput`` compares requests per second of the sync friendship status
+endpoint, one request at a time as in a WSGI worker, with its async version
+serving many requests at once as in an ASGI worker. ``run_connection_latency``
+compares the latency of requests that each open a new database connection
+with requests served from the connection pool.
+The ``benchmark_friends`` management command builds graphs of several sizes
+in a throwaway test database, runs the suite on each and writes the results
+as JSON so runs from different commits can be compared.
+"""
+import asyncio
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from importlib import import_module
+
+from asgiref.sync import async_to_sync
+from django.db import connection, connections, reset_queries
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from friends.async_views import shutdown_query_executor
+from friends.cache import get_friend_id_cache
+from friends.models import Friend
+from friends.storage import friend_edges
+from friends.projections import UserSummaryProjection
+from friends.serializers import UserModelSerializer
+from users.models import UserModel
+from utils.db.pool import close_pools
+
+
+class Benchmark:
+    """
+    A timed operation; ``setup`` runs untimed before every call and returns the call's arguments.
+    ``rows`` is the number of rows one call handles, if the per-row cost is of interest.
+    """
+
+    def __init__(self, name, run, setup=None, rows=None):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: ())
+        self.rows = rows
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(benchmark, repeat):
+    """ Return query count, latency percentiles (ms) and peak memory (KiB) of a benchmark """
+    args = benchmark.setup()
+    # The debug query log is bounded, so it is emptied before every capture.
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        benchmark.run(*args)
+
+    timings = []
+    for _ in range(repeat):
+        args = benchmark.setup()
+        reset_queries()
+        start = time.perf_counter()
+        benchmark.run(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    args = benchmark.setup()
+    tracemalloc.start()
+    try:
+        benchmark.run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "name": benchmark.name,
+        "queries": len(queries),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "peak_kib": round(peak / 1024, 1),
+        "iterations": repeat,
+    }
+    if benchmark.rows:
+        result["rows"] = benchmark.rows
+        result["per_row_us"] = round(result["p50_ms"] * 1000 / benchmark.rows, 2)
+    return result
+
+
+class GraphFixture:
+    """ Users picked from the current graph to drive the benchmarks """
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.user_ids = list(UserModel.objects.order_by("id").values_list("id", flat=True))
+        self.hub = UserModel.objects.get(pk=self.busiest_user_id())
+        friend_ids = friend_edges().objects.filter(to_user=self.hub).values_list("from_user_id", flat=True)
+        self.hub_friend = UserModel.objects.filter(pk__in=friend_ids[:1]).first() or self.random_user()
+
+    def busiest_user_id(self):
+        profile_user_ids = (
+            UserModel.objects.order_by("-profile__friend_count", "id").values_list("id", flat=True)
+        )
+        return profile_user_ids.first()
+
+    def random_user(self):
+        return UserModel.objects.get(pk=self.rng.choice(self.user_ids))
+
+    def random_users(self, count):
+        return list(UserModel.objects.filter(pk__in=self.rng.sample(self.user_ids, min(count, len(self.user_ids)))))
+
+    def stranger_pair(self):
+        """ Two random users who aren't related yet """
+        while True:
+            user1, user2 = self.random_users(2)
+            if Friend.objects.relationship_statuses(user1, [user2.pk])[user2.pk] == "none":
+                return user1, user2
+
+    def pending_request(self):
+        user1, user2 = self.stranger_pair()
+        return Friend.objects.add_friend(user1, user2)
+
+    def friendship(self):
+        request = self.pending_request()
+        request.accept()
+        return request.from_user, request.to_user
+
+    def bulk_targets(self, count=20):
+        """ A random user and the usernames of `count` other random users """
+        user = self.random_user()
+        return user, [target.username for target in self.random_users(count) if target.pk != user.pk]
+
+    def received_requests(self, count=20):
+        """ A random user who was just sent requests by up to `count` users, and their usernames """
+        user, usernames = self.bulk_targets(count)
+        for sender in UserModel.objects.filter(username__in=usernames):
+            Friend.objects.add_friends(sender, [user.username])
+        return user, usernames
+
+
+def manager_benchmarks(fixture):
+    hub, other = fixture.hub, fixture.hub_friend
+    manager = Friend.objects
+
+    def cold_cache():
+        get_friend_id_cache().clear()
+        return ()
+
+    benchmarks = [
+        Benchmark(f"manager.{name}", lambda method=getattr(manager, name): list(method(hub)))
+        for name in (
+            "friends", "friendships", "requests", "sent_requests", "got_friend_requests", "unread_requests",
+            "read_requests", "rejected_requests", "unrejected_requests",
+        )
+    ]
+    benchmarks += [
+        Benchmark(f"manager.{name}", lambda method=getattr(manager, name): method(hub))
+        for name in ("unread_request_count", "unrejected_request_count", "friend_count")
+    ]
+    benchmarks += [
+        Benchmark("manager.friend_ids[cold]", lambda: manager.friend_ids(hub), setup=cold_cache),
+        Benchmark("manager.friend_ids[warm]", lambda: manager.friend_ids(hub)),
+        Benchmark("manager.are_friends", lambda: manager.are_friends(hub, other)),
+        Benchmark(
+            "manager.relationship_statuses",
+            lambda users: manager.relationship_statuses(hub, [user.pk for user in users]),
+            setup=lambda: (fixture.random_users(100),),
+        ),
+        Benchmark("manager.add_friend", manager.add_friend, setup=fixture.stranger_pair),
+        Benchmark("request.accept", lambda request: request.accept(), setup=lambda: (fixture.pending_request(),)),
+        Benchmark("manager.remove_friend", manager.remove_friend, setup=fixture.friendship),
+        Benchmark("manager.add_friends", manager.add_friends, setup=fixture.bulk_targets),
+        Benchmark("manager.accept_requests", manager.accept_requests, setup=fixture.received_requests),
+        Benchmark("manager.reject_requests", manager.reject_requests, setup=fixture.received_requests),
+    ]
+    return benchmarks
+
+
+def view_benchmarks(fixture):
+    hub, other = fixture.hub, fixture.hub_friend
+    client = APIClient()
+    prefix = "/api/v1/friends"
+
+    def get(path, user=hub):
+        client.force_authenticate(user)
+        response = client.get(f"{prefix}/{path}")
+        assert response.status_code == 200, (path, response.status_code)
+
+    def post(path, user, data=None):
+        client.force_authenticate(user)
+        response = client.post(f"{prefix}/{path}", data, format="json")
+        assert response.status_code in (200, 201), (path, response.status_code)
+
+    def accept_setup():
+        request = fixture.pending_request()
+        return request.to_user, request.from_user.username
+
+    sample = ",".join(user.username for user in fixture.random_users(100))
+    distant = fixture.random_user()
+    return [
+        Benchmark("view.friends-list", lambda: get("friends-list")),
+        Benchmark("view.friends-requests", lambda: get("friends-requests")),
+        Benchmark("view.friends-of-friends", lambda: get("friends-of-friends")),
+        Benchmark("view.mutual-friends", lambda: get(f"mutual-friends/{other.username}")),
+        Benchmark("view.friend-ship-status", lambda: get(f"friend-ship-status/{hub.username}/{other.username}")),
+        Benchmark("view.friend-ship-statuses", lambda: get(f"friend-ship-statuses?usernames={sample}")),
+        Benchmark(
+            "view.degrees-of-separation", lambda: get(f"degrees-of-separation/{hub.username}/{distant.username}")
+        ),
+        Benchmark(
+            "view.send-friends-requests",
+            lambda user1, user2: post(f"send-friends-requests/{user2.username}", user1),
+            setup=fixture.stranger_pair,
+        ),
+        Benchmark(
+            "view.accept-friends-requests",
+            lambda user, username: post(f"accept-friends-requests/{username}", user),
+            setup=accept_setup,
+        ),
+        Benchmark(
+            "view.bulk-send-friends-requests",
+            lambda user, usernames: post("bulk-send-friends-requests", user, {"usernames": usernames}),
+            setup=fixture.bulk_targets,
+        ),
+        Benchmark(
+            "view.bulk-accept-friends-requests",
+            lambda user, usernames: post("bulk-accept-friends-requests", user, {"usernames": usernames}),
+            setup=fixture.received_requests,
+        ),
+        Benchmark(
+            "view.bulk-reject-friends-requests",
+            lambda user, usernames: post("bulk-reject-friends-requests", user, {"usernames": usernames}),
+            setup=fixture.received_requests,
+        ),
+    ]
+
+
+def serialization_benchmarks(fixture, rows=500):
+    """ The user summary of `rows` users through ``UserModelSerializer`` and through its projection """
+    users = UserModel.objects.order_by("id")[:rows]
+    count = users.count()
+    return [
+        Benchmark(
+            "serialize.users[serializer]",
+            lambda: UserModelSerializer(users.select_related("profile"), many=True).data,
+            rows=count,
+        ),
+        Benchmark("serialize.users[projection]", lambda: UserSummaryProjection().project(users), rows=count),
+    ]
+
+
+def run_suite(repeat=30, seed=0, only=None):
+    """ Measure every benchmark against the graph currently in the database """
+    fixture = GraphFixture(seed)
+    benchmarks = manager_benchmarks(fixture) + view_benchmarks(fixture) + serialization_benchmarks(fixture)
+    if only:
+        benchmarks = [benchmark for benchmark in benchmarks if any(name in benchmark.name for name in only)]
+    get_friend_id_cache().clear()
+    return [measure(benchmark, repeat) for benchmark in benchmarks]
+
+
+@contextmanager
+def simulated_db_latency(milliseconds):
+    """ Delay every query on every connection, as with a distant or busy database server """
+    if not milliseconds:
+        yield
+        return
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(milliseconds / 1000)
+        return execute(sql, params, many, context)
+
+    wrapped = []
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delay)
+        wrapped.append(connection)
+
+    connection_created.connect(install)
+    for conn in connections.all():
+        install(None, conn)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+        for conn in wrapped:
+            if delay in conn.execute_wrappers:
+                conn.execute_wrappers.remove(delay)
+
+
+def run_throughput(requests=100, concurrency=20, db_latency_ms=0, seed=0):
+    """ Requests per second of the friendship status endpoint through the sync and the async views """
+    fixture = GraphFixture(seed)
+    headers = {"Authorization": f"Bearer {AccessToken.for_user(fixture.hub)}"}
+    paths = []
+    for _ in range(requests):
+        user1, user2 = fixture.random_users(2)
+        paths.append(f"friend-ship-status/{user1.username}/{user2.username}")
+    prefix = "/api/v1/friends"
+
+    def wsgi():
+        client = APIClient()
+        for path in paths:
+            response = client.get(f"{prefix}/{path}", headers=headers)
+            assert response.status_code == 200, (path, response.status_code)
+
+    async def asgi():
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get(path):
+            async with slots:
+                response = await client.get(f"{prefix}/async/{path}", headers=headers)
+            assert response.status_code == 200, (path, response.status_code)
+
+        await asyncio.gather(*(get(path) for path in paths))
+
+    results = []
+    with simulated_db_latency(db_latency_ms), override_settings(FRIENDS_ASYNC_QUERY_THREADS=concurrency):
+        for name, run in (("wsgi", wsgi), ("asgi", async_to_sync(asgi))):
+            get_friend_id_cache().clear()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            results.append({
+                "name": f"throughput.friend-ship-status[{name}]",
+                "requests": requests,
+                "concurrency": 1 if name == "wsgi" else concurrency,
+                "db_latency_ms": db_latency_ms,
+                "requests_per_second": round(requests / elapsed, 1),
+            })
+        shutdown_query_executor()
+    return results
+
+
+@contextmanager
+def database_engine(engine, alias="default"):
+    """ Serve `alias` through the backend `engine` with the same settings """
+    original = connections[alias]
+    original.close()
+    backend = import_module(f"{engine}.base")
+    connections[alias] = backend.DatabaseWrapper({**original.settings_dict, "ENGINE": engine}, alias)
+    try:
+        yield
+    finally:
+        connections[alias].close()
+        connections[alias] = original
+
+
+def run_connection_latency(requests=200, seed=0):
+    """ Latency of the friendship status endpoint with a new database connection per request and with the pool """
+    fixture = GraphFixture(seed)
+    paths = []
+    for _ in range(requests):
+        user1, user2 = fixture.random_users(2)
+        paths.append(f"/api/v1/friends/friend-ship-status/{user1.username}/{user2.username}")
+    client = APIClient()
+
+    results = []
+    for name, engine in (
+        ("direct", "django.db.backends.postgresql"),
+        ("pooled", "utils.db.backends.postgresql_pool"),
+    ):
+        with database_engine(engine):
+            get_friend_id_cache().clear()
+            timings = []
+            for path in paths:
+                start = time.perf_counter()
+                response = client.get(path)
+                # The test client keeps the connection open; a server closes it when the request finishes.
+                connection.close()
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, (path, response.status_code)
+        results.append({
+            "name": f"connections.friend-ship-status[{name}]",
+            "requests": requests,
+            "p50_ms": round(percentile(timings, 0.5), 3),
+            "p99_ms": round(percentile(timings, 0.99), 3),
+        })
+    close_pools()
+    return results
@@ -0,0 +1,177 @@
+"""
+Friend-id adjacency cache.
+
+Each user's friend ids are stored as a sorted tuple in a pluggable backend so
+that the graph read paths (friends-of-friends, mutual friends, friendship
+status) don't hit the ``Friend`` table for users whose friendships haven't
+changed. Entries are dropped by the receivers in ``friends.receivers`` whenever
+a friendship is created or removed.
+
+The backend is configured through the ``FRIENDS_ADJACENCY_CACHE`` setting:
+
+    FRIENDS_ADJACENCY_CACHE = {
+        "BACKEND": "friends.cache.LocMemLRUBackend",
+        "OPTIONS": {"max_entries": 10000, "timeout": 5},
+    }
+
+``LocMemLRUBackend`` is local to each process, so an invalidation only reaches
+the process that made the change: other workers may serve a user's old friend
+ids for up to ``timeout`` seconds. Deployments with several workers that can't
+accept that window should use ``DjangoCacheBackend`` over a cache shared by all
+of them (Memcached, Redis).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from utils.db.replicas import primary
+
+DEFAULT_ADJACENCY_CACHE = {
+    "BACKEND": "friends.cache.LocMemLRUBackend",
+    "OPTIONS": {"max_entries": 10000, "timeout": 5},
+}
+
+
+class LocMemLRUBackend:
+    """ Process-local store that evicts the least recently used entries and those older than `timeout` seconds """
+
+    def __init__(self, max_entries=10000, timeout=5):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key not in self._data:
+                    continue
+                expires_at, value = self._data[key]
+                if expires_at is not None and expires_at <= now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        expires_at = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """ Store backed by one of the caches configured in ``CACHES`` """
+
+    def __init__(self, alias="default", timeout=300, key_prefix="friends:adj:"):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.cache.get_many([self._key(key) for key in keys])
+        return {key: found[self._key(key)] for key in keys if self._key(key) in found}
+
+    def set_many(self, mapping):
+        self.cache.set_many({self._key(key): value for key, value in mapping.items()}, self.timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many([self._key(key) for key in keys])
+
+    def clear(self):
+        self.cache.clear()
+
+
+class FriendIdCache:
+    """ Read-through cache of ``user id -> sorted tuple of friend ids`` """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, user_id):
+        """ Return the sorted friend ids of a user, loading them on a miss """
+        return self.get_many([user_id])[user_id]
+
+    def get_many(self, user_ids):
+        """ Return friend ids for several users, loading all misses in one query """
+        user_ids = set(user_ids)
+        found = self.backend.get_many(user_ids)
+        missing = user_ids.difference(found)
+        if missing:
+            loaded = self._load(missing)
+            self.backend.set_many(loaded)
+            found.update(loaded)
+        return found
+
+    def peek(self, user_id):
+        """ Return the cached friend ids of a user or None, never querying """
+        return self.backend.get_many([user_id]).get(user_id)
+
+    def invalidate(self, *user_ids):
+        """ Drop the cached entries now and again once the transaction commits """
+        self.backend.delete_many(user_ids)
+        transaction.on_commit(lambda: self.backend.delete_many(user_ids))
+
+    def clear(self):
+        self.backend.clear()
+
+    def _load(self, user_ids):
+        from friends.storage import friend_edges
+
+        adjacency = {user_id: [] for user_id in user_ids}
+        # Entries outlive the request, so they are never loaded from a replica that may lag behind an invalidation
+        with primary():
+            rows = list(
+                friend_edges().objects.filter(to_user_id__in=user_ids)
+                .order_by("to_user_id", "from_user_id")
+                .values_list("to_user_id", "from_user_id")
+            )
+        for to_user_id, from_user_id in rows:
+            adjacency[to_user_id].append(from_user_id)
+        return {user_id: tuple(ids) for user_id, ids in adjacency.items()}
+
+
+_friend_id_cache = None
+
+
+def get_friend_id_cache():
+    """ Return the process-wide cache built from ``FRIENDS_ADJACENCY_CACHE`` """
+    global _friend_id_cache
+    if _friend_id_cache is None:
+        config = getattr(settings, "FRIENDS_ADJACENCY_CACHE", DEFAULT_ADJACENCY_CACHE)
+        backend_class = import_string(config["BACKEND"])
+        _friend_id_cache = FriendIdCache(backend_class(**config.get("OPTIONS", {})))
+    return _friend_id_cache
+
+
+@receiver(setting_changed)
+def reset_friend_id_cache(setting, **kwargs):
+    global _friend_id_cache
+    if setting == "FRIENDS_ADJACENCY_CACHE":
+        _friend_id_cache = None
@@ -0,0 +1,137 @@
+"""
+Denormalized friendship counters on ``ProfileModel``.
+
+``friend_count``, ``pending_request_count`` (incoming requests that haven't
+been rejected) and ``unread_request_count`` (incoming requests that haven't
+been viewed) are adjusted with ``F()`` expressions by the receivers in
+``friends.receivers``, in the same transaction as the friendship change.
+Drift, e.g. from rows written straight through the ORM, is repaired by the
+``reconcile_friend_counters`` management command.
+
+``graph_version`` goes up by one with every change to a user's friendships,
+requests or suggestions, and ``graph_changed_at`` records when; together they
+identify a version of everything the friends endpoints return about the user
+(see ``friends.versions``).
+"""
+from collections import defaultdict
+
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Now
+
+from friends.models import FriendshipRequest
+from friends.storage import friend_edges
+from users.models import ProfileModel
+
+COUNTER_FIELDS = ("friend_count", "pending_request_count", "unread_request_count")
+
+
+def apply_deltas(deltas):
+    """ Apply ``(user_id, field, delta)`` triples in a single UPDATE """
+    totals = defaultdict(lambda: defaultdict(int))
+    for user_id, field, delta in deltas:
+        totals[field][user_id] += delta
+
+    updates = {}
+    user_ids = set()
+    bumped = [user_id for user_id, delta in totals.pop("graph_version", {}).items() if delta]
+    if bumped:
+        user_ids.update(bumped)
+        updates.update(graph_versions_update(bumped))
+    for field, per_user in totals.items():
+        per_user = {user_id: delta for user_id, delta in per_user.items() if delta}
+        if not per_user:
+            continue
+        user_ids.update(per_user)
+        updates[field] = F(field) + Case(
+            *[When(user_id=user_id, then=Value(delta)) for user_id, delta in per_user.items()],
+            default=Value(0),
+        )
+    if updates:
+        ProfileModel.objects.filter(user_id__in=user_ids).update(**updates)
+
+
+def graph_versions_update(user_ids):
+    """ The UPDATE expressions bumping the graph version of the given users among the updated rows """
+    bumped = Q(user_id__in=user_ids)
+    return {
+        "graph_version": F("graph_version") + Case(When(bumped, then=Value(1)), default=Value(0)),
+        "graph_changed_at": Case(When(bumped, then=Now()), default=F("graph_changed_at")),
+    }
+
+
+def bump_graph_versions(user_ids):
+    """ Bump the graph version of the given users """
+    user_ids = set(user_ids)
+    if user_ids:
+        ProfileModel.objects.filter(user_id__in=user_ids).update(**graph_versions_update(user_ids))
+
+
+def graph_deltas(*user_ids):
+    """ Deltas for `apply_deltas` bumping the graph version of the given users once """
+    return [(user_id, "graph_version", 1) for user_id in set(user_ids)]
+
+
+def request_deltas(request, sign):
+    """ Counter deltas for an incoming request appearing (+1) or going away (-1) """
+    deltas = []
+    if request.rejected is None:
+        deltas.append((request.to_user_id, "pending_request_count", sign))
+    if request.viewed is None:
+        deltas.append((request.to_user_id, "unread_request_count", sign))
+    return deltas
+
+
+def actual_counts(user_ids):
+    """ Count friendships and incoming requests of the given users from the source tables """
+    counts = {user_id: dict.fromkeys(COUNTER_FIELDS, 0) for user_id in user_ids}
+    friends = (
+        friend_edges().objects.filter(to_user_id__in=user_ids)
+        .values("to_user_id")
+        .annotate(total=Count("id"))
+        .values_list("to_user_id", "total")
+    )
+    for user_id, total in friends:
+        counts[user_id]["friend_count"] = total
+    requests = (
+        FriendshipRequest.objects.filter(to_user_id__in=user_ids)
+        .values("to_user_id")
+        .annotate(
+            pending=Count("id", filter=Q(rejected__isnull=True)),
+            unread=Count("id", filter=Q(viewed__isnull=True)),
+        )
+        .values_list("to_user_id", "pending", "unread")
+    )
+    for user_id, pending, unread in requests:
+        counts[user_id]["pending_request_count"] = pending
+        counts[user_id]["unread_request_count"] = unread
+    return counts
+
+
+def reconcile(profiles):
+    """ Rewrite the counters of the given profiles that drifted, returning how many were fixed """
+    counts = actual_counts([profile.user_id for profile in profiles])
+    drifted = []
+    for profile in profiles:
+        actual = counts[profile.user_id]
+        if any(getattr(profile, field) != actual[field] for field in COUNTER_FIELDS):
+            for field in COUNTER_FIELDS:
+                setattr(profile, field, actual[field])
+            drifted.append(profile)
+    ProfileModel.objects.bulk_update(drifted, COUNTER_FIELDS)
+    return len(drifted)
+
+
+def recount(user_ids):
+    """ Recompute the counters of the given users from the source tables in a single UPDATE """
+    def total(queryset):
+        return Coalesce(
+            Subquery(queryset.filter(to_user_id=OuterRef("user_id")).order_by().values("to_user_id")
+                     .annotate(total=Count("id")).values("total")),
+            Value(0),
+        )
+
+    return ProfileModel.objects.filter(user_id__in=user_ids).update(
+        friend_count=total(friend_edges().objects.all()),
+        pending_request_count=total(FriendshipRequest.objects.filter(rejected__isnull=True)),
+        unread_request_count=total(FriendshipRequest.objects.filter(viewed__isnull=True)),
+    )
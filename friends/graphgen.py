@@ -0,0 +1,109 @@
+"""
+Synthetic social graph generator.
+
+Friendships follow preferential attachment (Barabási–Albert): every new user
+befriends existing users with a probability proportional to their degree, which
+yields the power-law degree distribution of real social graphs. A share of
+additional pairs become pending friendship requests. Everything is written with
+batched ``bulk_create`` calls and the profile counters are filled in directly.
+"""
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from friends.models import Friend, FriendshipRequest
+from friends.storage import friendship_pairs
+from users.models import ProfileModel, UserModel
+
+
+def preferential_attachment(user_count, edge_count, rng):
+    """ Return a set of undirected ``(a, b)`` index pairs with a power-law degree distribution """
+    per_user = max(1, edge_count // max(user_count, 1))
+    edges = set()
+    # Every endpoint is appended once per edge, so sampling it is sampling by degree.
+    endpoints = []
+    for user in range(user_count):
+        if user == 0:
+            continue
+        targets = set()
+        attempts = 0
+        while len(targets) < min(per_user, user) and attempts < per_user * 10:
+            attempts += 1
+            if endpoints and rng.random() > 0.1:
+                target = endpoints[rng.randrange(len(endpoints))]
+            else:
+                target = rng.randrange(user)
+            targets.add(target)
+        for target in targets:
+            edges.add((target, user))
+            endpoints += [target, user]
+        if len(edges) >= edge_count:
+            break
+    return edges
+
+
+def generate_graph(users=1000, edges=10000, pending_ratio=0.1, seed=0, batch_size=5000, prefix="graph"):
+    """ Create users, friendships and pending requests and return a summary dict """
+    rng = random.Random(seed)
+    password = make_password(None)
+
+    with transaction.atomic():
+        created = []
+        for start in range(0, users, batch_size):
+            created += UserModel.objects.bulk_create([
+                UserModel(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password=password)
+                for i in range(start, min(start + batch_size, users))
+            ])
+        ids = [user.pk for user in created]
+
+        pairs = preferential_attachment(users, edges, rng)
+        pending = set()
+        wanted = int(len(pairs) * pending_ratio)
+        while len(pending) < wanted and users > 1:
+            a, b = rng.sample(range(users), 2)
+            if (min(a, b), max(a, b)) not in pairs and (b, a) not in pending:
+                pending.add((a, b))
+
+        friend_count = [0] * users
+        for a, b in pairs:
+            friend_count[a] += 1
+            friend_count[b] += 1
+        request_count = [0] * users
+        for _, b in pending:
+            request_count[b] += 1
+
+        ProfileModel.objects.bulk_create([
+            ProfileModel(
+                user_id=ids[i],
+                friend_count=friend_count[i],
+                pending_request_count=request_count[i],
+                unread_request_count=request_count[i],
+            )
+            for i in range(users)
+        ], batch_size=batch_size)
+
+        def friend_rows():
+            for a, b in pairs:
+                for to_user_id, from_user_id in friendship_pairs(ids[a], ids[b]):
+                    yield Friend(to_user_id=to_user_id, from_user_id=from_user_id)
+
+        _bulk_insert(Friend, friend_rows(), batch_size)
+        _bulk_insert(
+            FriendshipRequest,
+            (FriendshipRequest(from_user_id=ids[a], to_user_id=ids[b]) for a, b in pending),
+            batch_size,
+        )
+
+    return {"users": users, "friendships": len(pairs), "pending_requests": len(pending), "user_ids": ids}
+
+
+def _bulk_insert(model, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
@@ -0,0 +1,361 @@
+"""
+Streaming import and export of the friendship graph.
+
+Friendships are exchanged as one record per pair (``to_user_id``, ``from_user_id``, ``created_at``); importing a
+record writes the ``Friend`` rows of the pair (see ``friends.storage``) and drops any request between the two
+users. Requests are exchanged as (``from_user_id``, ``to_user_id``, ``message``, ``created_at``, ``rejected``,
+``viewed``). Records are CSV with a header row or JSON lines, and both directions stream them in constant memory.
+
+On PostgreSQL, imports COPY the records into a temporary staging table and then validate and insert them with a
+few set-based statements, and CSV exports use ``COPY ... TO STDOUT``. Other backends fall back to chunked
+``bulk_create`` calls and server-side cursors via ``iterator()``. Self-friendships, records naming unknown users,
+duplicate pairs and pairs that are already related are skipped and counted. Afterwards the profile counters of
+the affected users are recomputed, their suggestions are queued for a refresh and the adjacency cache is cleared.
+"""
+import csv
+import datetime
+import io
+import json
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from friends.cache import get_friend_id_cache
+from friends.counters import bump_graph_versions, recount
+from friends.models import Friend, FriendshipRequest
+from friends.storage import canonical_storage, friendship_pairs
+from friends.suggestions import mark_stale
+from users.models import UserModel
+
+DEFAULT_CHUNK_SIZE = 5000
+FORMATS = ("csv", "jsonl")
+KINDS = {
+    "friends": (Friend, ("to_user_id", "from_user_id", "created_at")),
+    "requests": (FriendshipRequest, ("from_user_id", "to_user_id", "message", "created_at", "rejected", "viewed")),
+}
+DATETIME_COLUMNS = ("created_at", "rejected", "viewed")
+# Columns staged for COPY besides the two user ids, with their PostgreSQL types.
+STAGED_COLUMNS = {
+    "friends": (("created_at", "timestamptz"),),
+    "requests": (
+        ("message", "text"), ("created_at", "timestamptz"), ("rejected", "timestamptz"), ("viewed", "timestamptz"),
+    ),
+}
+SUMMARY_FIELDS = ("records", "inserted", "self", "unknown_users", "duplicates", "existing")
+
+
+def read_records(stream, fmt, columns):
+    """ Yield the records of a CSV or JSON lines stream as tuples ordered like `columns` """
+    lines = csv.DictReader(stream) if fmt == "csv" else (line for line in stream if line.strip())
+    for number, record in enumerate(lines, start=1):
+        try:
+            if fmt == "jsonl":
+                record = json.loads(record)
+            values = tuple(_parse(column, record.get(column)) for column in columns)
+        except (AttributeError, TypeError, ValueError) as error:
+            raise ValueError(f"Record {number}: {error}") from None
+        yield values
+
+
+def write_records(stream, fmt, columns, rows):
+    """ Write tuples ordered like `columns` as CSV with a header row or as JSON lines; return how many """
+    count = 0
+    writer = csv.writer(stream) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    for row in rows:
+        row = _format(row)
+        if writer:
+            writer.writerow(row)
+        else:
+            stream.write(json.dumps(dict(zip(columns, row))) + "\n")
+        count += 1
+    return count
+
+
+def _format(row):
+    return [value.isoformat() if isinstance(value, datetime.datetime) else value for value in row]
+
+
+def _parse(column, value):
+    if column == "message":
+        return value or ""
+    if value is None or value == "":
+        if column in DATETIME_COLUMNS:
+            return None
+        raise ValueError(f"missing {column}")
+    if column in DATETIME_COLUMNS:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"invalid {column} {value!r}")
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, datetime.timezone.utc)
+    return int(value)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_graph(kind, stream, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE, use_copy=None):
+    """ Write every friendship or request to `stream` and return the number of records """
+    model, columns = KINDS[kind]
+    queryset = model.objects.order_by()
+    if kind == "friends":
+        # One record per friendship, the mirrored row is implied.
+        queryset = queryset.filter(to_user_id__lt=F("from_user_id"))
+    queryset = queryset.values_list(*columns)
+    connection = connections[queryset.db]
+    if use_copy is None:
+        use_copy = connection.vendor == "postgresql" and fmt == "csv"
+
+    if not use_copy:
+        return write_records(stream, fmt, columns, queryset.iterator(chunk_size=chunk_size))
+    if fmt != "csv":
+        raise ValueError("COPY exports are CSV only")
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        query = cursor.mogrify(sql, params).decode()
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", stream)
+        return cursor.rowcount
+
+
+def import_graph(kind, stream, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE, use_copy=None):
+    """ Import friendships or requests from `stream`; return counts of the inserted and skipped records """
+    model, columns = KINDS[kind]
+    connection = connections[router.db_for_write(model)]
+    if use_copy is None:
+        use_copy = connection.vendor == "postgresql"
+    records = read_records(stream, fmt, columns)
+    summary = dict.fromkeys(SUMMARY_FIELDS, 0)
+
+    if use_copy:
+        _copy_import(kind, connection, records, chunk_size, summary)
+    else:
+        for chunk in _chunks(records, chunk_size):
+            with transaction.atomic(using=connection.alias):
+                _import_chunk(kind, chunk, summary)
+    get_friend_id_cache().clear()
+    return summary
+
+
+def _refresh_users(user_ids):
+    """ Recompute the counters and queue the suggestions of users whose relationships were imported """
+    recount(user_ids)
+    bump_graph_versions(user_ids)
+    mark_stale(user_ids)
+
+
+# Chunked fallback
+
+def _import_chunk(kind, chunk, summary):
+    pairs = _screen(chunk, summary)
+    existing = _existing_pairs(Friend, pairs)
+    if kind == "requests":
+        existing |= _existing_pairs(FriendshipRequest, pairs)
+    new = {pair: record for pair, record in pairs.items() if pair not in existing}
+    summary["existing"] += len(pairs) - len(new)
+    if not new:
+        return
+
+    now = timezone.now()
+    if kind == "friends":
+        Friend.objects.bulk_create([
+            Friend(to_user_id=user1, from_user_id=user2, created_at=created_at or now, updated_at=created_at or now)
+            for to_user_id, from_user_id, created_at in new.values()
+            for user1, user2 in friendship_pairs(to_user_id, from_user_id)
+        ], ignore_conflicts=True)
+        user_ids = {user_id for pair in new for user_id in pair}
+        requests = FriendshipRequest.objects.filter(from_user_id__in=user_ids, to_user_id__in=user_ids)
+        FriendshipRequest.objects.filter(pk__in=[
+            pk for pk, from_user_id, to_user_id in requests.values_list("pk", "from_user_id", "to_user_id")
+            if _pair(from_user_id, to_user_id) in new
+        ]).delete()
+    else:
+        FriendshipRequest.objects.bulk_create([
+            FriendshipRequest(
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                message=message,
+                created_at=created_at or now,
+                updated_at=created_at or now,
+                rejected=rejected,
+                viewed=viewed,
+            )
+            for from_user_id, to_user_id, message, created_at, rejected, viewed in new.values()
+        ], ignore_conflicts=True)
+    summary["inserted"] += len(new)
+    _refresh_users({user_id for pair in new for user_id in pair})
+
+
+def _pair(user1_id, user2_id):
+    return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+
+def _screen(chunk, summary):
+    """ Count and drop self-pairs, unknown users and duplicates; return the remaining records by pair """
+    summary["records"] += len(chunk)
+    user_ids = {user_id for record in chunk for user_id in record[:2]}
+    known = set(UserModel.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+    pairs = {}
+    for record in chunk:
+        user1_id, user2_id = record[:2]
+        if user1_id == user2_id:
+            summary["self"] += 1
+        elif user1_id not in known or user2_id not in known:
+            summary["unknown_users"] += 1
+        elif _pair(user1_id, user2_id) in pairs:
+            summary["duplicates"] += 1
+        else:
+            pairs[_pair(user1_id, user2_id)] = record
+    return pairs
+
+
+def _existing_pairs(model, pairs):
+    """ The given pairs that already have a row of `model` in either direction """
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    rows = model.objects.filter(from_user_id__in=user_ids, to_user_id__in=user_ids)
+    return {_pair(*row) for row in rows.values_list("from_user_id", "to_user_id")} & pairs.keys()
+
+
+# PostgreSQL COPY
+
+class _ChunkStream(io.TextIOBase):
+    """ Read-only text stream over an iterator of strings, for COPY ... FROM STDIN """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        # The driver reports exceptions raised in read() as a failed COPY, this keeps the original one.
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+            except Exception as error:
+                self.error = error
+                raise
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _csv_chunks(records, chunk_size):
+    for chunk in _chunks(records, chunk_size):
+        buffer = io.StringIO()
+        # Empty unquoted fields are NULL to COPY, hence the COALESCE on `message` when inserting.
+        csv.writer(buffer).writerows(_format(record) for record in chunk)
+        yield buffer.getvalue()
+
+
+def _copy_import(kind, connection, records, chunk_size, summary):
+    qn = connection.ops.quote_name
+    friends, requests, users = (qn(model._meta.db_table) for model in (Friend, FriendshipRequest, UserModel))
+    user_pk = qn(UserModel._meta.pk.column)
+    extra = ", ".join(name for name, _ in STAGED_COLUMNS[kind])
+    known = " AND ".join(
+        f"EXISTS (SELECT 1 FROM {users} u WHERE u.{user_pk} = {column})" for column in ("user1", "user2")
+    )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        # Stage the records as they are, `line` keeps the input order for picking the first of duplicates.
+        cursor.execute(
+            "CREATE TEMPORARY TABLE friends_import (line bigserial, user1 bigint NOT NULL, user2 bigint NOT NULL, "
+            f"{', '.join(f'{name} {type_}' for name, type_ in STAGED_COLUMNS[kind])}) ON COMMIT DROP"
+        )
+        stream = _ChunkStream(_csv_chunks(records, chunk_size))
+        try:
+            cursor.copy_expert(f"COPY friends_import (user1, user2, {extra}) FROM STDIN WITH (FORMAT csv)", stream)
+        except Exception:
+            if stream.error is not None:
+                raise stream.error from None
+            raise
+        cursor.execute(
+            "SELECT count(*), count(*) FILTER (WHERE user1 = user2), "
+            f"count(*) FILTER (WHERE user1 <> user2 AND NOT ({known})) FROM friends_import"
+        )
+        summary["records"], summary["self"], summary["unknown_users"] = cursor.fetchone()
+
+        # Friendships are stored as (smaller id, larger id), requests keep their direction.
+        user1, user2 = ("LEAST(user1, user2)", "GREATEST(user1, user2)") if kind == "friends" else ("user1", "user2")
+        cursor.execute(
+            "CREATE TEMPORARY TABLE friends_import_pairs ON COMMIT DROP AS "
+            f"SELECT DISTINCT ON (LEAST(user1, user2), GREATEST(user1, user2)) "
+            f"{user1} AS user1, {user2} AS user2, {extra} FROM friends_import "
+            f"WHERE user1 <> user2 AND {known} ORDER BY LEAST(user1, user2), GREATEST(user1, user2), line"
+        )
+        summary["duplicates"] = summary["records"] - summary["self"] - summary["unknown_users"] - cursor.rowcount
+
+        # A canonical row is (smaller id, larger id) whichever way a request goes
+        friend1, friend2 = (
+            ("LEAST(p.user1, p.user2)", "GREATEST(p.user1, p.user2)") if canonical_storage() else ("p.user1", "p.user2")
+        )
+        cursor.execute(
+            f"DELETE FROM friends_import_pairs p USING {friends} f "
+            f"WHERE f.to_user_id = {friend1} AND f.from_user_id = {friend2}"
+        )
+        summary["existing"] = cursor.rowcount
+        if kind == "friends":
+            # The pairs are (smaller id, larger id) already, which is the canonical row
+            mirrored = (
+                "" if canonical_storage() else
+                "UNION ALL SELECT user2, user1, COALESCE(created_at, now()), COALESCE(created_at, now()) "
+                "FROM friends_import_pairs "
+            )
+            cursor.execute(
+                f"INSERT INTO {friends} (to_user_id, from_user_id, created_at, updated_at) "
+                "SELECT user1, user2, COALESCE(created_at, now()), COALESCE(created_at, now()) "
+                f"FROM friends_import_pairs {mirrored}ON CONFLICT DO NOTHING"
+            )
+            summary["inserted"] = cursor.rowcount // (1 if canonical_storage() else 2)
+            cursor.execute(
+                f"DELETE FROM {requests} r USING friends_import_pairs p "
+                "WHERE LEAST(r.from_user_id, r.to_user_id) = p.user1 "
+                "AND GREATEST(r.from_user_id, r.to_user_id) = p.user2"
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM friends_import_pairs p USING {requests} r "
+                "WHERE LEAST(r.from_user_id, r.to_user_id) = LEAST(p.user1, p.user2) "
+                "AND GREATEST(r.from_user_id, r.to_user_id) = GREATEST(p.user1, p.user2)"
+            )
+            summary["existing"] += cursor.rowcount
+            cursor.execute(
+                f"INSERT INTO {requests} (from_user_id, to_user_id, message, created_at, updated_at, rejected, viewed) "
+                "SELECT user1, user2, COALESCE(message, ''), COALESCE(created_at, now()), COALESCE(created_at, now()), "
+                "rejected, viewed FROM friends_import_pairs ON CONFLICT DO NOTHING"
+            )
+            summary["inserted"] = cursor.rowcount
+
+        cursor.execute(
+            "CREATE TEMPORARY TABLE friends_import_users (user_id bigint PRIMARY KEY) ON COMMIT DROP; "
+            "INSERT INTO friends_import_users SELECT user1 FROM friends_import_pairs "
+            "UNION SELECT user2 FROM friends_import_pairs"
+        )
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT user_id FROM friends_import_users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                [last_id, chunk_size],
+            )
+            user_ids = [row[0] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+            _refresh_users(user_ids)
+            last_id = user_ids[-1]
+        # Dropped explicitly as well, in case the import runs inside a longer transaction.
+        cursor.execute("DROP TABLE friends_import, friends_import_pairs, friends_import_users")
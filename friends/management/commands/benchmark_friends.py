@@ -0,0 +1,130 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from friends.benchmarks import run_connection_latency, run_suite, run_throughput
+from friends.graphgen import generate_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the friends manager methods and views on synthetic graphs of several sizes. "
+        "Runs in a throwaway test database and writes the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000", help="Comma separated numbers of users.")
+        parser.add_argument("--degree", type=int, default=20, help="Average number of friends per user.")
+        parser.add_argument("--pending-ratio", type=float, default=0.1,
+                            help="Pending requests as a fraction of friendships.")
+        parser.add_argument("--repeat", type=int, default=30, help="Timed calls per benchmark.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--only", action="append", help="Only run benchmarks whose name contains this text.")
+        parser.add_argument("--output", default="bench_output.json", help="Where to write the JSON results.")
+        parser.add_argument("--compare", help="A previous JSON output to compare p50 latencies against.")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs.")
+        parser.add_argument("--throughput", action="store_true",
+                            help="Also compare requests per second of the sync and async friendship status views.")
+        parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight on the async path.")
+        parser.add_argument("--db-latency-ms", type=float, default=0,
+                            help="Latency added to every query in the throughput comparison.")
+        parser.add_argument("--connections", action="store_true",
+                            help="Also compare request latency with a new database connection per request and with "
+                                 "the connection pool.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        runs = []
+        try:
+            for size in sizes:
+                call_command("flush", interactive=False, verbosity=0)
+                generate_graph(
+                    users=size,
+                    edges=size * options["degree"] // 2,
+                    pending_ratio=options["pending_ratio"],
+                    seed=options["seed"],
+                    prefix="bench",
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                results = run_suite(repeat=options["repeat"], seed=options["seed"], only=options["only"])
+                run = {"users": size, "degree": options["degree"], "results": results}
+                self.report(size, results)
+                if options["throughput"]:
+                    run["throughput"] = run_throughput(
+                        requests=options["repeat"] * 5,
+                        concurrency=options["concurrency"],
+                        db_latency_ms=options["db_latency_ms"],
+                        seed=options["seed"],
+                    )
+                    for result in run["throughput"]:
+                        self.stdout.write(f"{result['name']:<40}{result['requests_per_second']:>10} req/s")
+                if options["connections"]:
+                    run["connections"] = run_connection_latency(requests=options["repeat"] * 5, seed=options["seed"])
+                    for result in run["connections"]:
+                        self.stdout.write(
+                            f"{result['name']:<40}{result['p50_ms']:>10} ms p50{result['p99_ms']:>10} ms p99"
+                        )
+                runs.append(run)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+        output = {"meta": self.metadata(), "runs": runs}
+        with open(options["output"], "w") as fp:
+            json.dump(output, fp, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options["compare"]:
+            with open(options["compare"]) as fp:
+                self.compare(json.load(fp), output)
+
+    def metadata(self):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+        }
+
+    def report(self, size, results):
+        self.stdout.write(f"\n{size} users")
+        self.stdout.write(
+            f"{'benchmark':<40}{'queries':>8}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}{'us/row':>10}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['name']:<40}{result['queries']:>8}{result['p50_ms']:>10}"
+                f"{result['p99_ms']:>10}{result['peak_kib']:>10}{result.get('per_row_us', ''):>10}"
+            )
+
+    def compare(self, previous, current):
+        before = {
+            (run["users"], result["name"]): result
+            for run in previous["runs"] for result in run["results"]
+        }
+        self.stdout.write(f"\nCompared with {previous['meta'].get('commit')}")
+        for run in current["runs"]:
+            for result in run["results"]:
+                old = before.get((run["users"], result["name"]))
+                if old is None or not old["p50_ms"]:
+                    continue
+                change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+                queries = result["queries"] - old["queries"]
+                self.stdout.write(
+                    f"{run['users']:>8} {result['name']:<40}{change:>+8.1f}% p50{queries:>+6} queries"
+                )
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from friends.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the friend graph to the memory-mapped snapshot read by friends.snapshot.SnapshotBackend, replacing "
+        "the previous one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", help="File to write, FRIENDS_SNAPSHOT_PATH by default.")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Rows fetched per batch.")
+
+    def handle(self, *args, **options):
+        path = options["path"] or settings.FRIENDS_SNAPSHOT_PATH
+        users, friend_ids = write_snapshot(path, options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {friend_ids} friend ids of {users} user ids to {path}."))
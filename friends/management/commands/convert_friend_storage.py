@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from friends.storage import CANONICAL, STORAGE_MODES, collapse_friendships, expand_friendships, storage_mode
+
+
+class Command(BaseCommand):
+    help = "Convert the stored friendships to one row per friendship (canonical) or two (directed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("mode", choices=STORAGE_MODES, help="Storage mode to convert to.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows converted per statement.")
+
+    def handle(self, *args, **options):
+        if options["mode"] != storage_mode():
+            self.stderr.write(self.style.WARNING(
+                f"FRIENDS_STORAGE is {storage_mode()!r}; set it to {options['mode']!r} along with this conversion."
+            ))
+        if options["mode"] == CANONICAL:
+            changed = collapse_friendships(connection, options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Done, {changed} rows deleted or flipped."))
+        else:
+            changed = expand_friendships(connection, options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Done, {changed} mirrored rows added."))
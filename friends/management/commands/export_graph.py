@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from friends.graphio import DEFAULT_CHUNK_SIZE, FORMATS, KINDS, export_graph
+from friends.management.commands.import_graph import guess_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Export friendships (one record per pair) or friendship requests as CSV with a header row or as JSON lines, "
+        "in the format read by import_graph."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(KINDS), help="What to export.")
+        parser.add_argument("path", help='File to write, or "-" for standard output.')
+        parser.add_argument("--format", choices=FORMATS, help="File format, guessed from the extension by default.")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per batch.")
+        parser.add_argument("--no-copy", action="store_false", dest="use_copy", default=None,
+                            help="Stream through a server-side cursor even on PostgreSQL instead of COPY.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+        if path == "-":
+            # Records are written in chunks, so the output wrapper must not append line endings.
+            self.stdout.ending = ""
+            export_graph(options["kind"], self.stdout, fmt, options["chunk_size"], options["use_copy"])
+            return
+        with open(path, "w", newline="", encoding="utf-8") as stream:
+            count = export_graph(options["kind"], stream, fmt, options["chunk_size"], options["use_copy"])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} {options['kind']} records to {path}."))
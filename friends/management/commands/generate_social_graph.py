@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from friends.graphgen import generate_graph
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic power-law friendship graph for load testing and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Number of users to create.")
+        parser.add_argument("--edges", type=int, default=10000, help="Number of friendships to create.")
+        parser.add_argument("--pending-ratio", type=float, default=0.1,
+                            help="Pending friendship requests, as a fraction of the number of friendships.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for reproducible graphs.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per INSERT.")
+        parser.add_argument("--prefix", default="graph", help="Username prefix of the generated users.")
+
+    def handle(self, *args, **options):
+        summary = generate_graph(
+            users=options["users"],
+            edges=options["edges"],
+            pending_ratio=options["pending_ratio"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            prefix=options["prefix"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['users']} users, {summary['friendships']} friendships "
+            f"and {summary['pending_requests']} pending requests."
+        ))
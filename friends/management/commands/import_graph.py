@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from friends.graphio import DEFAULT_CHUNK_SIZE, FORMATS, KINDS, import_graph
+
+
+def guess_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+class Command(BaseCommand):
+    help = (
+        "Import friendships or friendship requests from a CSV (with a header row) or JSON lines file. "
+        "Users are referenced by id; invalid, duplicate and already related pairs are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(KINDS), help="What the file contains.")
+        parser.add_argument("path", help='File to read, or "-" for standard input.')
+        parser.add_argument("--format", choices=FORMATS, help="File format, guessed from the extension by default.")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Records per batch.")
+        parser.add_argument("--no-copy", action="store_false", dest="use_copy", default=None,
+                            help="Use chunked inserts even on PostgreSQL instead of COPY.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            summary = import_graph(options["kind"], stream, fmt, options["chunk_size"], options["use_copy"])
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        skipped = ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in summary.items()
+                            if name not in ("records", "inserted"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {summary['records']} records, imported {summary['inserted']} (skipped {skipped})."
+        ))
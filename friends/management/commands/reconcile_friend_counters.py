@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from friends.counters import reconcile
+from users.models import ProfileModel
+
+
+class Command(BaseCommand):
+    help = "Recompute the friend and request counters on user profiles and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Profiles checked per transaction.")
+
+    def handle(self, *args, **options):
+        last_id, checked, fixed = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                profiles = list(
+                    ProfileModel.objects.select_for_update()
+                    .filter(id__gt=last_id)
+                    .order_by("id")
+                    .only("id", "user_id", "friend_count", "pending_request_count", "unread_request_count")
+                    [:options["batch_size"]]
+                )
+                if not profiles:
+                    break
+                fixed += reconcile(profiles)
+            checked += len(profiles)
+            last_id = profiles[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} profiles, repaired {fixed}."))
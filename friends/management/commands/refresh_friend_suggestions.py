@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from friends.storage import friend_edges
+from friends.suggestions import DEFAULT_SUGGESTION_LIMIT, mark_stale, refresh_stale
+
+
+class Command(BaseCommand):
+    help = "Recompute \"people you may know\" suggestions for users whose friend graph changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Users refreshed per transaction.")
+        parser.add_argument("--limit", type=int, default=DEFAULT_SUGGESTION_LIMIT,
+                            help="Suggestions stored per user.")
+        parser.add_argument("--all", action="store_true", help="Queue every user with friends before refreshing.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the queue instead of exiting.")
+        parser.add_argument("--sleep", type=float, default=5.0, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            user_ids = (
+                friend_edges().objects.values_list("to_user_id", flat=True).distinct().iterator(chunk_size=10000)
+            )
+            batch = []
+            for user_id in user_ids:
+                batch.append(user_id)
+                if len(batch) >= 10000:
+                    mark_stale(batch)
+                    batch = []
+            mark_stale(batch)
+
+        total = 0
+        while True:
+            processed = refresh_stale(options["batch_size"], options["limit"])
+            total += processed
+            if processed:
+                self.stdout.write(f"Refreshed suggestions for {processed} users")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {total} users refreshed."))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from friends.outbox import deliver_pending, requeue_failed
+
+
+class Command(BaseCommand):
+    help = "Deliver the recorded friendship events to the outbox handlers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Events delivered per transaction.")
+        parser.add_argument("--max-attempts", type=int, default=None,
+                            help="Attempts before an event is set aside as failed (FRIENDS_OUTBOX_MAX_ATTEMPTS).")
+        parser.add_argument("--requeue-failed", action="store_true",
+                            help="Retry the events set aside as failed before delivering.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the outbox instead of exiting.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when no event is due.")
+
+    def handle(self, *args, **options):
+        if options["requeue_failed"]:
+            self.stdout.write(f"Requeued {requeue_failed()} failed events")
+
+        total_delivered = total_failed = 0
+        while True:
+            delivered, failed = deliver_pending(options["batch_size"], options["max_attempts"])
+            total_delivered += delivered
+            total_failed += failed
+            if delivered or failed:
+                self.stdout.write(f"Delivered {delivered} events, {failed} failed")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {total_delivered} events delivered, {total_failed} failed."))
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profilemodel_created_at_profilemodel_updated_at_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friends', '0003_alter_friendshiprequest_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestionRefresh',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Queued at')),
+            ],
+            options={
+                'verbose_name': 'Suggestion Refresh',
+                'verbose_name_plural': 'Suggestion Refreshes',
+            },
+        ),
+        migrations.CreateModel(
+            name='FriendSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Updated at')),
+                ('mutual_count', models.PositiveIntegerField(default=0, verbose_name='Mutual friends')),
+                ('suggested_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_suggestions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Friend Suggestion',
+                'verbose_name_plural': 'Friend Suggestions',
+                'indexes': [models.Index(fields=['user', '-mutual_count', 'suggested_user'], name='friends_suggestion_rank_idx')],
+                'unique_together': {('user', 'suggested_user')},
+            },
+        ),
+    ]
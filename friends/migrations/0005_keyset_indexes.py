@@ -0,0 +1,21 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0004_friendsuggestion_suggestionrefresh'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friend',
+            index=models.Index(fields=['to_user', 'created_at', 'id'], name='friend_to_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendshiprequest',
+            index=models.Index(fields=['to_user', 'created_at', 'id'], name='request_to_user_created_idx'),
+        ),
+    ]
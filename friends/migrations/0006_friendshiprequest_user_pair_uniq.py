@@ -0,0 +1,78 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:11
+
+import logging
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef
+import django.db.models.functions.comparison
+
+logger = logging.getLogger(__name__)
+
+
+def accept_mutual_requests(apps, schema_editor):
+    """
+    Users who requested each other both asked for the friendship: make them friends and delete both requests, so the
+    pair constraint can be added. The counters are adjusted and the deleted request ids are logged.
+    """
+    FriendshipRequest = apps.get_model("friends", "FriendshipRequest")
+    Friend = apps.get_model("friends", "Friend")
+    ProfileModel = apps.get_model("users", "ProfileModel")
+
+    mutual = list(
+        FriendshipRequest.objects.filter(
+            Exists(FriendshipRequest.objects.filter(from_user=OuterRef("to_user"), to_user=OuterRef("from_user")))
+        )
+        .order_by("id")
+        .values_list("id", "from_user_id", "to_user_id", "viewed", "rejected")
+    )
+    if not mutual:
+        return
+
+    deltas = defaultdict(Counter)
+    pairs = set()
+    for _, from_user_id, to_user_id, viewed, rejected in mutual:
+        pairs.add((min(from_user_id, to_user_id), max(from_user_id, to_user_id)))
+        if rejected is None:
+            deltas[to_user_id]["pending_request_count"] -= 1
+        if viewed is None:
+            deltas[to_user_id]["unread_request_count"] -= 1
+
+    friendships = []
+    for user1_id, user2_id in sorted(pairs):
+        if not Friend.objects.filter(to_user_id=user1_id, from_user_id=user2_id).exists():
+            friendships += [
+                Friend(to_user_id=user1_id, from_user_id=user2_id),
+                Friend(to_user_id=user2_id, from_user_id=user1_id),
+            ]
+            deltas[user1_id]["friend_count"] += 1
+            deltas[user2_id]["friend_count"] += 1
+    Friend.objects.bulk_create(friendships, ignore_conflicts=True)
+
+    request_ids = [row[0] for row in mutual]
+    FriendshipRequest.objects.filter(id__in=request_ids).delete()
+    for user_id, fields in deltas.items():
+        ProfileModel.objects.filter(user_id=user_id).update(
+            **{field: F(field) + delta for field, delta in fields.items() if delta}
+        )
+
+    logger.info(
+        "Accepted the friendship of %d pairs of users who requested each other (%d new), deleting requests %s",
+        len(pairs), len(friendships) // 2, ", ".join(map(str, request_ids)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0005_keyset_indexes'),
+        ('users', '0003_profilemodel_friend_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(accept_mutual_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='friendshiprequest',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('from_user', 'to_user'), django.db.models.functions.comparison.Greatest('from_user', 'to_user'), name='request_user_pair_uniq'),
+        ),
+    ]
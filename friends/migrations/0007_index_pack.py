@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:14
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently so writes to the friends tables aren't blocked during the deploy.
+    atomic = False
+
+    dependencies = [
+        ('friends', '0006_friendshiprequest_user_pair_uniq'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='friend',
+            index=models.Index(fields=['to_user', 'from_user'], name='friend_to_user_from_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprequest',
+            index=models.Index(fields=['from_user', 'created_at', 'id'], name='request_from_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprequest',
+            index=models.Index(condition=models.Q(('viewed__isnull', True)), fields=['to_user', 'created_at', 'id'], name='request_unread_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprequest',
+            index=models.Index(condition=models.Q(('rejected__isnull', True)), fields=['to_user', 'created_at', 'id'], name='request_unrejected_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0007_index_pack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=64, verbose_name='Event')),
+                ('payload', models.JSONField(default=dict, verbose_name='Payload')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Available at')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('failed_at', models.DateTimeField(blank=True, null=True, verbose_name='Failed at')),
+            ],
+            options={
+                'verbose_name': 'Outbox Event',
+                'verbose_name_plural': 'Outbox Events',
+                'indexes': [models.Index(condition=models.Q(('failed_at__isnull', True)), fields=['available_at', 'id'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
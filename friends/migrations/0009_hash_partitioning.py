@@ -0,0 +1,45 @@
+from django.db import migrations
+
+from friends.partitioning import (
+    DROP_REQUEST_PAIR_TRIGGER, PARTITION_KEY, REQUEST_PAIR_INDEX, REQUEST_PAIR_TRIGGER, rebuild_table,
+)
+
+PARTITIONS = 16
+BATCH_SIZE = 5000
+
+
+def partition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    rebuild_table(connection, "friends_friend", PARTITION_KEY, PARTITIONS, BATCH_SIZE)
+    rebuild_table(
+        connection, "friends_friendshiprequest", PARTITION_KEY, PARTITIONS, BATCH_SIZE,
+        drop_indexes=["request_user_pair_uniq"], swap_sql=REQUEST_PAIR_TRIGGER,
+    )
+
+
+def unpartition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    rebuild_table(connection, "friends_friend", PARTITION_KEY, 0, BATCH_SIZE)
+    rebuild_table(
+        connection, "friends_friendshiprequest", PARTITION_KEY, 0, BATCH_SIZE,
+        swap_sql=DROP_REQUEST_PAIR_TRIGGER + REQUEST_PAIR_INDEX,
+    )
+
+
+class Migration(migrations.Migration):
+    # The rows are copied in batches that commit on their own, so the tables stay writable during the deploy.
+    atomic = False
+
+    dependencies = [
+        ('friends', '0008_outboxevent'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(partition_tables, unpartition_tables)],
+            state_operations=[
+                # Enforced by the friends_request_pair_check trigger from now on
+                migrations.RemoveConstraint(model_name='friendshiprequest', name='request_user_pair_uniq'),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from friends.storage import DROP_EDGES_VIEW, EDGES_VIEW, canonical_storage, collapse_friendships, expand_friendships
+
+BATCH_SIZE = 5000
+
+
+def collapse_pairs(apps, schema_editor):
+    """ Keep one row per friendship when FRIENDS_STORAGE is "canonical" """
+    if canonical_storage():
+        collapse_friendships(schema_editor.connection, BATCH_SIZE)
+
+
+def expand_pairs(apps, schema_editor):
+    if canonical_storage():
+        expand_friendships(schema_editor.connection, BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+    # Pairs are collapsed in batches that commit on their own.
+    atomic = False
+
+    dependencies = [
+        ('friends', '0009_hash_partitioning'),
+    ]
+
+    operations = [
+        migrations.RunSQL(EDGES_VIEW, DROP_EDGES_VIEW),
+        migrations.CreateModel(
+            name='FriendEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Friend Edge',
+                'verbose_name_plural': 'Friend Edges',
+                'db_table': 'friends_friend_edges',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(collapse_pairs, expand_pairs),
+    ]
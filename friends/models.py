@@ -1,164 +1,357 @@
+from bisect import bisect_left
+
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 
+from friends.batching import batch_side_effects, defer
+from friends.cache import get_friend_id_cache
 from friends.exceptions import AlreadyFriendsError, AlreadyExistsError
+from friends.partitioning import PartitionKeyMixin
+from friends.storage import canonical_storage, friend_edges, friendship_pairs
 from friends.signals import friendship_request_created, friendship_removed, friendship_request_viewed, \
-    friendship_request_canceled, friendship_request_accepted
+    friendship_request_canceled, friendship_request_accepted, friendship_request_rejected
 
-from users.models import UserModel
+from users.models import ProfileModel, UserModel
 from utils.models import BaseModel
 
 
+class RelationshipStatus(models.TextChoices):
+    """ Relationship between a viewer and another user """
+    FRIENDS = "friends", _("Friends")
+    REQUEST_SENT = "request_sent", _("Request sent")
+    REQUEST_RECEIVED = "request_received", _("Request received")
+    REJECTED = "rejected", _("Rejected")
+    NONE = "none", _("None")
+
+
 class FriendshipManager(models.Manager):
     """ Friendship manager """
 
     def friends(self, user):
-        """ Return a list of all friends """
-        qs = (
-            Friend.objects.select_related("from_user", "to_user")
+        """ Return a queryset of all friends """
+        edge = "friend_edge" if canonical_storage() else "friend"
+        return (
+            UserModel.objects.select_related("profile")
+            .filter(**{f"{edge}__to_user": user})
+            .order_by(f"-{edge}__created_at", f"-{edge}__id")
+        )
+
+    def friendships(self, user):
+        """ Return a queryset of the user's friendship rows, `from_user` being the friend, newest first """
+        return (
+            friend_edges().objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        friends = [u.from_user for u in qs]
 
-        return friends
+    def friend_ids(self, user):
+        """ Return the sorted ids of all friends, served from the adjacency cache """
+        return get_friend_id_cache().get(user.pk)
 
     def requests(self, user):
-        """ Return a list of friendship requests """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        """ Return a queryset of friendship requests """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        requests = list(qs)
-
-        return requests
 
     def sent_requests(self, user):
-        """ Return a list of friendship requests from user """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        """ Return a queryset of friendship requests from user, which probes every partition's from_user index """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(from_user=user)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        requests = list(qs)
-
-        return requests
 
     def got_friend_requests(self, user):
-        """ Return a list of friendship requests user got """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user__profile", "to_user")
+        """ Return a queryset of friendship requests user got """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        unread_requests = list(qs)
-        return unread_requests
 
     def unread_requests(self, user):
-        """ Return a list of unread friendship requests """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        """ Return a queryset of unread friendship requests """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user, viewed__isnull=True)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        unread_requests = list(qs)
-
-        return unread_requests
 
     def unread_request_count(self, user):
-        """ Return a count of unread friendship requests """
-        count = FriendshipRequest.objects.select_related("from_user", "to_user").filter(to_user=user,
-                                                                                        viewed__isnull=True).count()
-        return count
+        """ Return a count of unread friendship requests, read from the profile counters """
+        return self._profile_counter(user, "unread_request_count")
 
     def read_requests(self, user):
-        """ Return a list of read friendship requests """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        """ Return a queryset of read friendship requests """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user, viewed__isnull=False)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        read_requests = list(qs)
-
-        return read_requests
 
     def rejected_requests(self, user):
-        """ Return a list of rejected friendship requests """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        """ Return a queryset of rejected friendship requests """
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user, rejected__isnull=False)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        rejected_requests = list(qs)
-
-        return rejected_requests
 
     def unrejected_requests(self, user):
         """ All requests that haven't been rejected """
-        qs = (
-            FriendshipRequest.objects.select_related("from_user", "to_user")
+        return (
+            FriendshipRequest.objects.select_related("from_user__profile", "to_user__profile")
             .filter(to_user=user, rejected__isnull=True)
-            .all()
+            .order_by("-created_at", "-id")
         )
-        unrejected_requests = list(qs)
-
-        return unrejected_requests
 
     def unrejected_request_count(self, user):
-        """ Return a count of unrejected friendship requests """
-        count = FriendshipRequest.objects.select_related("from_user", "to_user").filter(to_user=user,
-                                                                                        rejected__isnull=True).count()
-        return count
+        """ Return a count of unrejected friendship requests, read from the profile counters """
+        return self._profile_counter(user, "pending_request_count")
+
+    def friend_count(self, user):
+        """ Return a count of friends, read from the profile counters """
+        return self._profile_counter(user, "friend_count")
+
+    def _profile_counter(self, user, field):
+        return ProfileModel.objects.filter(user=user).values_list(field, flat=True).first() or 0
 
     def add_friend(self, from_user, to_user, message=None):
-        """ Create a friendship request """
+        """
+        Create a friendship request
+
+        The duplicate, reverse-request and friendship checks run inside the INSERT itself and races are settled by
+        the unique constraint and the `request_user_pair_check` trigger, so a successful request costs a single
+        statement.
+        """
         if from_user == to_user:
             raise ValidationError("Users cannot be friends with themselves")
 
-        if self.are_friends(from_user, to_user):
-            raise AlreadyFriendsError("Users are already friends")
+        if message is None:
+            message = ""
 
-        if FriendshipRequest.objects.filter(from_user=from_user, to_user=to_user).exists():
-            raise AlreadyExistsError("You already requested friendship from this user.")
+        now = timezone.now()
+        request = FriendshipRequest(
+            from_user=from_user, to_user=to_user, message=message, created_at=now, updated_at=now
+        )
+        try:
+            with transaction.atomic(), batch_side_effects():
+                inserted = request.insert_unless_related()
+                if inserted:
+                    friendship_request_created.send(sender=request)
+        except IntegrityError:
+            # The other user sent their request concurrently
+            inserted = False
+
+        if not inserted:
+            [(stored_to_id, stored_from_id), *_] = friendship_pairs(from_user.pk, to_user.pk)
+            if Friend.objects.filter(to_user_id=stored_to_id, from_user_id=stored_from_id).exists():
+                raise AlreadyFriendsError("Users are already friends")
+
+            if FriendshipRequest.objects.filter(from_user=from_user, to_user=to_user).exists():
+                raise AlreadyExistsError("You already requested friendship from this user.")
 
-        if FriendshipRequest.objects.filter(from_user=to_user, to_user=from_user).exists():
             raise AlreadyExistsError("This user already requested friendship from you.")
 
-        if message is None:
-            message = ""
+        return request
 
-        request, created = FriendshipRequest.objects.get_or_create(
-            from_user=from_user, to_user=to_user
-        )
+    def add_friends(self, from_user, usernames, message=""):
+        """
+        Send friendship requests to many users at once.
 
-        if created is False:
-            raise AlreadyExistsError("Friendship already requested")
+        Returns a list of `{"username", "status"}` dicts in input order, where status is one of "sent",
+        "not_found", "self", "already_friends", "already_requested" or "request_received".
+        """
+        usernames = list(dict.fromkeys(usernames))
+        users = {user.username: user for user in UserModel.objects.filter(username__in=usernames)}
+        user_ids = [user.pk for user in users.values()]
 
-        if message:
-            request.message = message
-            request.save()
+        friend_ids = set(
+            friend_edges().objects.filter(to_user=from_user, from_user_id__in=user_ids)
+            .values_list("from_user_id", flat=True)
+        )
+        sent_ids, received_ids = set(), set()
+        pending = FriendshipRequest.objects.filter(
+            Q(from_user=from_user, to_user_id__in=user_ids) | Q(to_user=from_user, from_user_id__in=user_ids)
+        ).values_list("from_user_id", "to_user_id")
+        for request_from_id, request_to_id in pending:
+            if request_from_id == from_user.pk:
+                sent_ids.add(request_to_id)
+            else:
+                received_ids.add(request_from_id)
+
+        results, new_requests, sent_results = [], [], []
+        for username in usernames:
+            user = users.get(username)
+            if user is None:
+                item_status = "not_found"
+            elif user.pk == from_user.pk:
+                item_status = "self"
+            elif user.pk in friend_ids:
+                item_status = "already_friends"
+            elif user.pk in sent_ids:
+                item_status = "already_requested"
+            elif user.pk in received_ids:
+                item_status = "request_received"
+            else:
+                item_status = "sent"
+                new_requests.append(FriendshipRequest(from_user=from_user, to_user=user, message=message or ""))
+            results.append({"username": username, "status": item_status})
+            if item_status == "sent":
+                sent_results.append(results[-1])
 
-        friendship_request_created.send(sender=request)
+        try:
+            with transaction.atomic(), batch_side_effects():
+                FriendshipRequest.objects.bulk_create(new_requests)
+                for request in new_requests:
+                    friendship_request_created.send(sender=request)
+        except IntegrityError:
+            # One of the users sent a request concurrently; settle the requests one at a time
+            for result, request in zip(sent_results, new_requests):
+                result["status"] = self._add_friend_status(from_user, request.to_user, message)
+
+        return results
+
+    def _add_friend_status(self, from_user, to_user, message):
+        """ Send one request through `add_friend` and return its `add_friends` status """
+        try:
+            self.add_friend(from_user, to_user, message or "")
+        except AlreadyFriendsError:
+            return "already_friends"
+        except AlreadyExistsError:
+            if FriendshipRequest.objects.filter(from_user=from_user, to_user=to_user).exists():
+                return "already_requested"
+            return "request_received"
+        return "sent"
+
+    def accept_requests(self, user, usernames):
+        """
+        Accept the friendship requests user got from many users at once.
+
+        Returns a list of `{"username", "status"}` dicts in input order, where status is one of "accepted",
+        "not_found", "no_request" or "already_friends". The requests of users who are already friends are deleted.
+        """
+        from friends.counters import apply_deltas, graph_deltas, request_deltas
+
+        usernames = list(dict.fromkeys(usernames))
+        users = {friend.username: friend for friend in UserModel.objects.filter(username__in=usernames)}
+        requests = {
+            request.from_user_id: request
+            for request in FriendshipRequest.objects.select_related("from_user").filter(
+                to_user=user, from_user_id__in=[friend.pk for friend in users.values()]
+            )
+        }
+        friend_ids = set(
+            friend_edges().objects.filter(to_user=user, from_user_id__in=list(requests))
+            .values_list("from_user_id", flat=True)
+        )
 
-        return request
+        results, accepted = [], []
+        for username in usernames:
+            friend = users.get(username)
+            if friend is None:
+                item_status = "not_found"
+            elif friend.pk not in requests:
+                item_status = "no_request"
+            else:
+                item_status = "already_friends" if friend.pk in friend_ids else "accepted"
+                accepted.append(requests[friend.pk])
+            results.append({"username": username, "status": item_status})
+
+        if accepted:
+            from_user_ids = [request.from_user_id for request in accepted]
+            rows = [
+                Friend(to_user_id=to_user_id, from_user_id=from_user_id)
+                for friend_id in from_user_ids if friend_id not in friend_ids
+                for to_user_id, from_user_id in friendship_pairs(user.pk, friend_id)
+            ]
+            with transaction.atomic(), batch_side_effects():
+                Friend.objects.bulk_create(rows, ignore_conflicts=True)
+                deleted = FriendshipRequest.delete_returning(
+                    Q(to_user=user, from_user_id__in=from_user_ids) | Q(from_user=user, to_user_id__in=from_user_ids)
+                )
+                # The accepted requests are counted by the receivers, the reverse ones and those between friends here
+                deltas = [
+                    delta for request in deleted
+                    if request.from_user_id == user.pk or request.from_user_id in friend_ids
+                    for delta in request_deltas(request, -1)
+                ]
+                if friend_ids:
+                    deltas += graph_deltas(user.pk, *friend_ids)
+                if deltas:
+                    defer(apply_deltas, *deltas)
+                for request in accepted:
+                    if request.from_user_id not in friend_ids:
+                        friendship_request_accepted.send(
+                            sender=request, from_user=request.from_user, to_user=user
+                        )
+
+        return results
+
+    def reject_requests(self, user, usernames):
+        """
+        Reject the friendship requests user got from many users at once.
+
+        Returns a list of `{"username", "status"}` dicts in input order, where status is one of "rejected",
+        "not_found", "no_request" or "already_rejected".
+        """
+        usernames = list(dict.fromkeys(usernames))
+        requests = {
+            request.from_user.username: request
+            for request in FriendshipRequest.objects.select_related("from_user").filter(
+                to_user=user, from_user__username__in=usernames
+            )
+        }
+        known = set(UserModel.objects.filter(username__in=usernames).values_list("username", flat=True))
+
+        results, rejected = [], []
+        for username in usernames:
+            request = requests.get(username)
+            if username not in known:
+                item_status = "not_found"
+            elif request is None:
+                item_status = "no_request"
+            elif request.rejected is not None:
+                item_status = "already_rejected"
+            else:
+                item_status = "rejected"
+                rejected.append(request)
+            results.append({"username": username, "status": item_status})
+
+        if rejected:
+            now = timezone.now()
+            with transaction.atomic(), batch_side_effects():
+                FriendshipRequest.objects.filter(to_user=user, id__in=[request.pk for request in rejected]).update(
+                    rejected=now, updated_at=now
+                )
+                for request in rejected:
+                    request.rejected = request.updated_at = now
+                    friendship_request_rejected.send(sender=request)
+
+        return results
 
     def remove_friend(self, from_user, to_user):
         """ Destroy a friendship relationship """
         try:
-            qs = Friend.objects.filter(
-                Q(to_user=to_user, from_user=from_user) | Q(to_user=from_user, from_user=to_user))
+            condition = Q()
+            for to_user_id, from_user_id in friendship_pairs(from_user.pk, to_user.pk):
+                condition |= Q(to_user_id=to_user_id, from_user_id=from_user_id)
+            qs = Friend.objects.filter(condition)
             distinct_qs = qs.distinct().all()
 
             if distinct_qs:
-                friendship_removed.send(
-                    sender=distinct_qs[0], from_user=from_user, to_user=to_user
-                )
-                qs.delete()
+                with transaction.atomic(), batch_side_effects():
+                    friendship = distinct_qs[0]
+                    qs.delete()
+                    # After the delete, so invalidated entries can't be reloaded with the removed rows
+                    friendship_removed.send(sender=friendship, from_user=from_user, to_user=to_user)
                 return True
             else:
                 return False
@@ -167,14 +360,49 @@ class FriendshipManager(models.Manager):
 
     def are_friends(self, user1, user2):
         """ Are these two users friends? """
-        try:
-            Friend.objects.get(to_user=user1, from_user=user2)
-            return True
-        except Friend.DoesNotExist:
-            return False
+        friend_ids = self.friend_ids(user1)
+        index = bisect_left(friend_ids, user2.pk)
+        return index < len(friend_ids) and friend_ids[index] == user2.pk
+
+    def relationship_statuses(self, viewer, user_ids):
+        """
+        Return a `{user_id: RelationshipStatus}` dict describing how viewer relates to each user.
+
+        Runs two queries however many users are asked for: one over `Friend` and one over `FriendshipRequest` in both
+        directions. A rejected request in either direction reports "rejected".
+        """
+        user_ids = set(user_ids)
+        requests, friends = self.relationship_querysets(viewer, user_ids)
+        return self.merge_relationship_statuses(viewer, user_ids, requests, friends)
+
+    def relationship_querysets(self, viewer, user_ids):
+        """ The two independent queries behind `relationship_statuses`, as (requests, friend ids) querysets """
+        requests = FriendshipRequest.objects.filter(
+            Q(from_user=viewer, to_user_id__in=user_ids) | Q(to_user=viewer, from_user_id__in=user_ids)
+        ).values_list("from_user_id", "to_user_id", "rejected")
+        friend_ids = friend_edges().objects.filter(to_user=viewer, from_user_id__in=user_ids).values_list(
+            "from_user_id", flat=True
+        )
+        return requests, friend_ids
+
+    def merge_relationship_statuses(self, viewer, user_ids, requests, friend_ids):
+        """ Combine the rows of `relationship_querysets` into a `{user_id: RelationshipStatus}` dict """
+        statuses = dict.fromkeys(user_ids, RelationshipStatus.NONE)
+        for from_user_id, to_user_id, rejected in requests:
+            if rejected is not None:
+                statuses[to_user_id if from_user_id == viewer.pk else from_user_id] = RelationshipStatus.REJECTED
+            elif from_user_id == viewer.pk:
+                statuses[to_user_id] = RelationshipStatus.REQUEST_SENT
+            else:
+                statuses[from_user_id] = RelationshipStatus.REQUEST_RECEIVED
 
+        for friend_id in friend_ids:
+            statuses[friend_id] = RelationshipStatus.FRIENDS
 
-class FriendshipRequest(BaseModel):
+        return statuses
+
+
+class FriendshipRequest(PartitionKeyMixin, BaseModel):
     """ Model to represent friendship requests """
 
     from_user = models.ForeignKey(
@@ -196,47 +424,130 @@ class FriendshipRequest(BaseModel):
         verbose_name = _("Friendship Request")
         verbose_name_plural = _("Friendship Requests")
         unique_together = ("from_user", "to_user")
+        indexes = [
+            models.Index(fields=["to_user", "created_at", "id"], name="request_to_user_created_idx"),
+            models.Index(fields=["from_user", "created_at", "id"], name="request_from_user_created_idx"),
+            models.Index(fields=["to_user", "created_at", "id"], condition=Q(viewed__isnull=True),
+                         name="request_unread_idx"),
+            models.Index(fields=["to_user", "created_at", "id"], condition=Q(rejected__isnull=True),
+                         name="request_unrejected_idx"),
+        ]
+        # The table is hash partitioned by to_user_id (see friends/partitioning.py). One request per pair of users,
+        # whichever direction it was sent in, is enforced by the request_user_pair_check trigger.
 
     def __str__(self):
         return f"User #{self.from_user_id} friendship requested #{self.to_user_id}"
 
+    def insert_unless_related(self):
+        """
+        Insert this request unless the users are friends or a request exists in either direction.
+
+        Returns True if the row was inserted. Uses a single INSERT ... SELECT ... WHERE NOT EXISTS ... ON CONFLICT DO
+        NOTHING statement. A request sent in the other direction concurrently makes the `request_user_pair_check`
+        trigger raise an `IntegrityError`.
+        """
+        using = router.db_for_write(FriendshipRequest)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        columns = ["from_user_id", "to_user_id", "message", "created_at", "updated_at"]
+        params = [
+            self.from_user_id,
+            self.to_user_id,
+            self.message,
+            self._meta.get_field("created_at").get_db_prep_save(self.created_at, connection),
+            self._meta.get_field("updated_at").get_db_prep_save(self.updated_at, connection),
+        ]
+        sql = (
+            f"INSERT INTO {qn(self._meta.db_table)} ({', '.join(qn(column) for column in columns)}) "
+            f"SELECT {', '.join(['%s'] * len(columns))} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {qn(Friend._meta.db_table)} "
+            f"WHERE {qn('to_user_id')} = %s AND {qn('from_user_id')} = %s) "
+            f"AND NOT EXISTS (SELECT 1 FROM {qn(self._meta.db_table)} "
+            f"WHERE {qn('to_user_id')} = %s AND {qn('from_user_id')} = %s) "
+            f"ON CONFLICT DO NOTHING RETURNING {qn('id')}"
+        )
+        with connection.cursor() as cursor:
+            [friendship, *_] = friendship_pairs(self.from_user_id, self.to_user_id)
+            cursor.execute(sql, params + [*friendship, self.from_user_id, self.to_user_id])
+            row = cursor.fetchone()
+        if row is None:
+            return False
+
+        self.pk = row[0]
+        self._state.adding = False
+        self._state.db = using
+        return True
+
+    @classmethod
+    def delete_returning(cls, condition):
+        """
+        Delete the requests matching `condition` with a single DELETE ... RETURNING statement and return them, e.g. to
+        adjust the counters of the deleted rows.
+        """
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        query = cls.objects.filter(condition).query
+        where, params = query.get_compiler(using).compile(query.where)
+        columns = ["id", "from_user_id", "to_user_id", "viewed", "rejected"]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(cls._meta.db_table)} WHERE {where} "
+                f"RETURNING {', '.join(qn(column) for column in columns)}",
+                params,
+            )
+            return [cls(**dict(zip(columns, row))) for row in cursor.fetchall()]
+
     def accept(self):
         """ Accept this friendship request """
-        Friend.objects.create(from_user=self.from_user, to_user=self.to_user)
-        Friend.objects.create(from_user=self.to_user, to_user=self.from_user)
-        friendship_request_accepted.send(
-            sender=self, from_user=self.from_user, to_user=self.to_user
-        )
+        from friends.counters import apply_deltas, request_deltas
+
+        with transaction.atomic(), batch_side_effects():
+            for to_user_id, from_user_id in friendship_pairs(self.to_user_id, self.from_user_id):
+                Friend.objects.create(to_user_id=to_user_id, from_user_id=from_user_id)
+            friendship_request_accepted.send(
+                sender=self, from_user=self.from_user, to_user=self.to_user
+            )
 
-        self.delete()
+            self.delete()
 
-        # Delete any reverse requests
-        FriendshipRequest.objects.filter(
-            from_user=self.to_user, to_user=self.from_user
-        ).delete()
+            # Delete any reverse requests, and their counts along with the accepted one's
+            reverse = FriendshipRequest.delete_returning(Q(from_user=self.to_user_id, to_user=self.from_user_id))
+            deltas = [delta for request in reverse for delta in request_deltas(request, -1)]
+            if deltas:
+                defer(apply_deltas, *deltas)
 
         return True
 
     def reject(self):
         """ reject this friendship request """
+        already_rejected = self.rejected is not None
         self.rejected = timezone.now()
-        self.save()
+        with transaction.atomic(), batch_side_effects():
+            self.save()
+            if not already_rejected:
+                friendship_request_rejected.send(sender=self)
         return True
 
     def cancel(self):
         """ cancel this friendship request """
-        self.delete()
-        friendship_request_canceled.send(sender=self)
+        with transaction.atomic(), batch_side_effects():
+            # Sent before the delete: receivers need the primary key to identify the request.
+            friendship_request_canceled.send(sender=self)
+            self.delete()
         return True
 
     def mark_viewed(self):
+        already_viewed = self.viewed is not None
         self.viewed = timezone.now()
-        friendship_request_viewed.send(sender=self)
-        self.save()
+        with transaction.atomic(), batch_side_effects():
+            if not already_viewed:
+                friendship_request_viewed.send(sender=self)
+            self.save()
         return True
 
 
-class Friend(BaseModel):
+class Friend(PartitionKeyMixin, BaseModel):
     to_user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name='friends')
     from_user = models.ForeignKey(UserModel, on_delete=models.CASCADE)
 
@@ -246,12 +557,96 @@ class Friend(BaseModel):
         verbose_name = _("Friend")
         verbose_name_plural = _("Friends")
         unique_together = ("from_user", "to_user")
+        # Hash partitioned by to_user_id (see friends/partitioning.py)
+        indexes = [
+            models.Index(fields=["to_user", "created_at", "id"], name="friend_to_user_created_idx"),
+            models.Index(fields=["to_user", "from_user"], name="friend_to_user_from_user_idx"),
+        ]
 
     def __str__(self):
         return f"User #{self.to_user_id} is friends with #{self.from_user_id}"
 
     def save(self, *args, **kwargs):
         # Ensure users can't be friends with themselves
-        if self.to_user == self.from_user:
+        if self.to_user_id == self.from_user_id:
             raise ValidationError("Users cannot be friends with themselves.")
         super().save(*args, **kwargs)
+
+
+class FriendEdge(BaseModel):
+    """
+    A friendship seen from `to_user`, whose friend is `from_user`, whichever way it is stored.
+
+    Reads the `friends_friend_edges` view, which returns every `Friend` row from both sides; it is what directed reads
+    query under canonical storage (see friends/storage.py).
+    """
+    to_user = models.ForeignKey(UserModel, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    from_user = models.ForeignKey(
+        UserModel, on_delete=models.DO_NOTHING, db_constraint=False, related_name="friend_edges",
+        related_query_name="friend_edge",
+    )
+
+    class Meta:
+        managed = False
+        db_table = "friends_friend_edges"
+        verbose_name = _("Friend Edge")
+        verbose_name_plural = _("Friend Edges")
+
+    def __str__(self):
+        return f"User #{self.to_user_id} is friends with #{self.from_user_id}"
+
+
+class FriendSuggestion(BaseModel):
+    """ Precomputed "people you may know" entry, ranked by mutual friend count """
+
+    user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name="friend_suggestions")
+    suggested_user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name="+")
+    mutual_count = models.PositiveIntegerField(_("Mutual friends"), default=0)
+
+    class Meta:
+        verbose_name = _("Friend Suggestion")
+        verbose_name_plural = _("Friend Suggestions")
+        unique_together = ("user", "suggested_user")
+        indexes = [
+            models.Index(fields=["user", "-mutual_count", "suggested_user"], name="friends_suggestion_rank_idx"),
+        ]
+
+    def __str__(self):
+        return f"User #{self.suggested_user_id} suggested to #{self.user_id}"
+
+
+class SuggestionRefresh(models.Model):
+    """ Users whose suggestions are stale and must be recomputed """
+
+    user = models.OneToOneField(UserModel, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    queued_at = models.DateTimeField(_("Queued at"), default=timezone.now)
+
+    class Meta:
+        verbose_name = _("Suggestion Refresh")
+        verbose_name_plural = _("Suggestion Refreshes")
+
+
+class OutboxEvent(models.Model):
+    """
+    A friendship signal recorded in the transaction that sent it, delivered later to the handlers registered in
+    `friends.outbox`. Delivered events are deleted; events that keep failing are kept with `failed_at` set.
+    """
+
+    event = models.CharField(_("Event"), max_length=64)
+    payload = models.JSONField(_("Payload"), default=dict)
+    created_at = models.DateTimeField(_("Created at"), default=timezone.now)
+    available_at = models.DateTimeField(_("Available at"), default=timezone.now)
+    attempts = models.PositiveIntegerField(_("Attempts"), default=0)
+    last_error = models.TextField(_("Last error"), blank=True)
+    failed_at = models.DateTimeField(_("Failed at"), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _("Outbox Event")
+        verbose_name_plural = _("Outbox Events")
+        indexes = [
+            models.Index(fields=["available_at", "id"], condition=Q(failed_at__isnull=True),
+                         name="outbox_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event} #{self.pk}"
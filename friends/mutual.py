@@ -0,0 +1,95 @@
+"""
+Mutual friends engine.
+
+The intersection of two users' friend sets is computed either as a merge of
+the sorted id tuples held in the adjacency cache (when both users are cached)
+or as a single SQL query over ``Friend``. In both cases only the requested page
+of users is loaded, so the cost follows the size of the result rather than the
+degree of the two users.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.db.models import Count, Exists, OuterRef, Window
+
+from friends.cache import get_friend_id_cache
+from friends.storage import friend_edges
+from users.models import UserModel
+
+MutualFriendsPage = namedtuple("MutualFriendsPage", ["count", "results"])
+
+
+def intersect_sorted(ids1, ids2):
+    """ Intersect two sorted id sequences, probing the larger one by bisection """
+    if len(ids1) > len(ids2):
+        ids1, ids2 = ids2, ids1
+    common = []
+    low = 0
+    for user_id in ids1:
+        low = bisect_left(ids2, user_id, low)
+        if low == len(ids2):
+            break
+        if ids2[low] == user_id:
+            common.append(user_id)
+    return common
+
+
+class MutualFriendsEngine:
+    """ Count and page through the friends two users have in common """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def get_cache(self):
+        return self.cache if self.cache is not None else get_friend_id_cache()
+
+    def cached_ids(self, user1, user2):
+        """ Return the sorted mutual friend ids if both users are cached, else None """
+        cache = self.get_cache()
+        ids1 = cache.peek(user1.pk)
+        if ids1 is None:
+            return None
+        ids2 = cache.peek(user2.pk)
+        if ids2 is None:
+            return None
+        return intersect_sorted(ids1, ids2)
+
+    def queryset(self, user1, user2):
+        """ ``Friend`` (or ``FriendEdge``) rows of user1 whose friend is also a friend of user2 """
+        edges = friend_edges().objects
+        return edges.filter(
+            Exists(edges.filter(to_user=user2, from_user=OuterRef("from_user"))),
+            to_user=user1,
+        )
+
+    def count(self, user1, user2):
+        """ Return the number of mutual friends """
+        ids = self.cached_ids(user1, user2)
+        if ids is not None:
+            return len(ids)
+        return self.queryset(user1, user2).count()
+
+    def page(self, user1, user2, offset=0, limit=20):
+        """ Return the mutual friend count and one page of users ordered by id """
+        ids = self.cached_ids(user1, user2)
+        if ids is not None:
+            return MutualFriendsPage(len(ids), self._users(ids[offset:offset + limit]))
+
+        rows = list(
+            self.queryset(user1, user2)
+            .annotate(total=Window(Count("id")))
+            .order_by("from_user_id")
+            .values_list("from_user_id", "total")[offset:offset + limit]
+        )
+        if not rows:
+            return MutualFriendsPage(self.count(user1, user2) if offset else 0, [])
+        return MutualFriendsPage(rows[0][1], self._users([user_id for user_id, _ in rows]))
+
+    def _users(self, ids):
+        if not ids:
+            return []
+        users = UserModel.objects.select_related("profile").in_bulk(ids)
+        return [users[user_id] for user_id in ids if user_id in users]
+
+
+mutual_friends = MutualFriendsEngine()
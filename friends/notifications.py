@@ -0,0 +1,248 @@
+"""
+Real-time friend request notifications.
+
+The receivers in ``friends.receivers`` turn the friendship signals into
+events once their transaction commits and publish them to a broker, which
+hands them to the event streams of the users concerned (see
+``friends.async_views.FriendEventStreamView``). Events are
+``{"event": name, "data": {...}}`` dicts:
+
+* ``friend_request`` to the recipient of a new request,
+* ``friend_request_accepted`` to the sender of an accepted request,
+* ``unread_count`` to a user whose number of unread requests changed.
+
+An open stream is a queue waiting on the event loop, so idle clients cost no
+queries. The broker is configured through the ``FRIENDS_NOTIFICATIONS``
+setting. ``LocalBroker`` only reaches streams served by the same process;
+``PostgresBroker`` relays events through ``NOTIFY`` so every worker listening on
+the channel receives them:
+
+    FRIENDS_NOTIFICATIONS = {
+        "BACKEND": "friends.notifications.PostgresBroker",
+        "OPTIONS": {"channel": "friends_events"},
+    }
+"""
+import asyncio
+import json
+import select
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from users.models import ProfileModel
+
+DEFAULT_NOTIFICATIONS = {
+    "BACKEND": "friends.notifications.LocalBroker",
+    "OPTIONS": {},
+}
+
+
+class Subscription:
+    """ The events of one user for one stream, queued on the event loop that subscribed """
+
+    def __init__(self, broker, user_id, max_queued):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_queued)
+
+    def put(self, event):
+        # A client that doesn't keep up loses its oldest events rather than holding memory.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """ Wait for the next event; raises `asyncio.TimeoutError` after `timeout` seconds """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """ Delivers events to the streams of the current process """
+
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """ Start receiving the events of a user; must be called from a coroutine """
+        subscription = Subscription(self, user_id, self.max_queued)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def listeners(self, user_ids):
+        """ Return the users among `user_ids` whose events someone may receive """
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._subscriptions}
+
+    def publish(self, events):
+        """ Publish `(user_id, event)` pairs; safe to call from any thread """
+        self.deliver(events)
+
+    def deliver(self, events):
+        for user_id, event in events:
+            with self._lock:
+                subscriptions = list(self._subscriptions.get(user_id, ()))
+            for subscription in subscriptions:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.put, event)
+                except RuntimeError:
+                    # The loop of the stream is closed.
+                    self.unsubscribe(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Relays events between processes with Postgres `NOTIFY`.
+
+    Every process listens on `channel` with a connection of its own, opened in a background thread on the first
+    subscription, and delivers the events it is notified of to its own streams.
+    """
+    # NOTIFY payloads are limited to 8000 bytes.
+    events_per_notify = 50
+
+    def __init__(self, channel="friends_events", alias="default", max_queued=100):
+        super().__init__(max_queued)
+        self.channel = channel
+        self.alias = alias
+        self._listener = None
+        self._stopped = threading.Event()
+        # Set while the listening connection is up
+        self.listening = threading.Event()
+
+    def subscribe(self, user_id):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="friends-notify", daemon=True)
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def listeners(self, user_ids):
+        # Streams of other processes can't be seen from here.
+        return set(user_ids)
+
+    def publish(self, events):
+        with connections[self.alias].cursor() as cursor:
+            for start in range(0, len(events), self.events_per_notify):
+                cursor.execute(
+                    "SELECT pg_notify(%s, %s)", [self.channel, json.dumps(events[start:start + self.events_per_notify])]
+                )
+
+    def stop(self):
+        """ Close the listening connection and wait for its thread to exit """
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join()
+
+    def _listen(self):
+        wrapper = connections[self.alias]
+        while not self._stopped.is_set():
+            try:
+                # Straight from the driver: held for good, it must not take a slot of a pooled backend
+                connection = wrapper.Database.connect(**wrapper.get_connection_params())
+            except Exception:
+                self._stopped.wait(1)
+                continue
+            try:
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {wrapper.ops.quote_name(self.channel)}")
+                self.listening.set()
+                while not self._stopped.is_set():
+                    if not select.select([connection], [], [], 1)[0]:
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.deliver([tuple(item) for item in json.loads(connection.notifies.pop(0).payload)])
+            except Exception:
+                # Reconnect after losing the connection.
+                self._stopped.wait(1)
+            finally:
+                self.listening.clear()
+                connection.close()
+
+
+def event_notifications(items):
+    """
+    Return the `(user_id, event)` pairs of `(event name, outbox payload)` items and the users whose unread count
+    changed
+    """
+    events, recount = [], set()
+    for name, payload in items:
+        if name == "friendship_request_created":
+            data = {"request_id": payload["request_id"], "from_user_id": payload["from_user_id"]}
+            events.append((payload["to_user_id"], {"event": "friend_request", "data": data}))
+        elif name == "friendship_request_accepted":
+            data = {"request_id": payload["request_id"], "user_id": payload["to_user_id"]}
+            events.append((payload["from_user_id"], {"event": "friend_request_accepted", "data": data}))
+        recount.add(payload["to_user_id"])
+    return events, recount
+
+
+def unread_count_events(user_ids):
+    counts = dict(
+        ProfileModel.objects.filter(user_id__in=user_ids).values_list("user_id", "unread_request_count")
+    )
+    return [
+        (user_id, {"event": "unread_count", "data": {"unread_request_count": counts.get(user_id, 0)}})
+        for user_id in sorted(user_ids)
+    ]
+
+
+def notify(items):
+    """ Publish the notifications of `(event name, outbox payload)` items once the transaction commits """
+    events, recount = event_notifications(items)
+
+    def publish():
+        broker = get_broker()
+        users = broker.listeners({user_id for user_id, _ in events} | recount)
+        pending = [(user_id, event) for user_id, event in events if user_id in users]
+        recount_users = recount & users
+        if recount_users:
+            pending += unread_count_events(recount_users)
+        if pending:
+            broker.publish(pending)
+
+    transaction.on_commit(publish, robust=True)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """ Return the process-wide broker built from ``FRIENDS_NOTIFICATIONS`` """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = getattr(settings, "FRIENDS_NOTIFICATIONS", DEFAULT_NOTIFICATIONS)
+            _broker = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+        return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == "FRIENDS_NOTIFICATIONS":
+        with _broker_lock:
+            if isinstance(_broker, PostgresBroker):
+                _broker.stop()
+            _broker = None
@@ -0,0 +1,133 @@
+"""
+Transactional outbox for the friendship signals.
+
+Every friendship signal is recorded as an ``OutboxEvent`` row by a receiver in
+``friends.receivers``, inside the transaction that changes the friendship, so
+an event exists if and only if the change was committed. Side effects that
+don't have to be consistent with the write are registered here with
+``outbox_handler`` instead of as signal receivers; the ``run_outbox_worker``
+management command delivers the recorded events to them in batches, outside
+of the user's request.
+
+Handlers take a list of payload dicts, like the flush functions of
+``friends.batching``. A handler that raises is retried with one event at a
+time, so a single bad event doesn't hold back the rest of its batch; failed
+events are retried later with exponential backoff and are kept with
+``failed_at`` set once ``FRIENDS_OUTBOX_MAX_ATTEMPTS`` is reached. Delivery is
+at least once, so handlers must be idempotent.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from friends.batching import defer
+from friends.models import FriendshipRequest, OutboxEvent
+
+_handlers = defaultdict(list)
+
+# Longest wait between two attempts, in seconds
+MAX_RETRY_DELAY = 3600
+
+
+def outbox_handler(*events):
+    """ Register the decorated function to receive the payloads of the given events """
+    def decorator(function):
+        for event in events:
+            _handlers[event].append(function)
+        return function
+    return decorator
+
+
+def get_handlers(event):
+    return list(_handlers.get(event, ()))
+
+
+def event_payload(sender, from_user=None, to_user=None, **kwargs):
+    """ Return the JSON payload of a friendship signal: both user ids, and the request id if sent by a request """
+    payload = {
+        "from_user_id": from_user.pk if from_user is not None else sender.from_user_id,
+        "to_user_id": to_user.pk if to_user is not None else sender.to_user_id,
+    }
+    if isinstance(sender, FriendshipRequest):
+        payload["request_id"] = sender.pk
+    return payload
+
+
+def record_events(events):
+    """ Insert outbox events; one statement per batch of side effects """
+    OutboxEvent.objects.bulk_create(events)
+
+
+def record(event, payload):
+    """ Add an event to the outbox, in the current transaction """
+    defer(record_events, OutboxEvent(event=event, payload=payload))
+
+
+def retry_delay(attempts):
+    """ Seconds to wait before the next attempt, doubling from `FRIENDS_OUTBOX_RETRY_DELAY` """
+    base = getattr(settings, "FRIENDS_OUTBOX_RETRY_DELAY", 5)
+    return min(base * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def dispatch(events):
+    """ Call the handlers of `events` and return `{event id: exception}` for the ones that failed """
+    grouped = defaultdict(list)
+    for event in events:
+        grouped[event.event].append(event)
+
+    errors = {}
+    for name, group in grouped.items():
+        for handler in get_handlers(name):
+            pending = [event for event in group if event.pk not in errors]
+            try:
+                with transaction.atomic():
+                    handler([event.payload for event in pending])
+            except Exception:
+                for event in pending:
+                    try:
+                        with transaction.atomic():
+                            handler([event.payload])
+                    except Exception as exc:
+                        errors[event.pk] = exc
+    return errors
+
+
+def deliver_pending(batch_size=100, max_attempts=None):
+    """ Deliver one batch of due events and return `(delivered, failed)` counts """
+    if max_attempts is None:
+        max_attempts = getattr(settings, "FRIENDS_OUTBOX_MAX_ATTEMPTS", 8)
+
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(failed_at__isnull=True, available_at__lte=now)
+            .order_by("available_at", "id")[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        errors = dispatch(events)
+
+        failed = [event for event in events if event.pk in errors]
+        for event in failed:
+            event.attempts += 1
+            event.last_error = f"{type(errors[event.pk]).__name__}: {errors[event.pk]}"
+            if event.attempts >= max_attempts:
+                event.failed_at = now
+            else:
+                event.available_at = now + timedelta(seconds=retry_delay(event.attempts))
+        OutboxEvent.objects.bulk_update(failed, ["attempts", "last_error", "available_at", "failed_at"])
+        OutboxEvent.objects.filter(id__in=[event.pk for event in events if event.pk not in errors]).delete()
+
+    return len(events) - len(failed), len(failed)
+
+
+def requeue_failed():
+    """ Make the events that ran out of attempts due again and return how many there were """
+    return OutboxEvent.objects.filter(failed_at__isnull=False).update(
+        failed_at=None, attempts=0, available_at=timezone.now()
+    )
@@ -0,0 +1,109 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a two-column keyset, `(created_at, id)` by default.
+
+    The cursor encodes the ordering values of the last row on the page and the next page is selected with a range
+    condition on them, so with a matching composite index every page costs the same as the first one. Views may set
+    `ordering` to a pair of attribute names (prefixed with "-" for descending) to page over a different key.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.count = None
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, "ordering", None) or self.ordering)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering_fields = self.get_ordering(view)
+        self.page_size_value = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering_fields)
+        cursor = self.decode_cursor(queryset.model, request)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor))
+
+        rows = list(queryset[:self.page_size_value + 1])
+        self.has_next = len(rows) > self.page_size_value
+        self.page = rows[:self.page_size_value]
+        return self.page
+
+    def after(self, cursor):
+        """ Range condition selecting the rows that sort after the cursor """
+        (first, second), (first_value, second_value) = self.field_names(), cursor
+        first_op, second_op = ["lt" if field.startswith("-") else "gt" for field in self.ordering_fields]
+        # The redundant `first <= value` bound lets the planner use it as an index range.
+        return Q(**{f"{first}__{first_op}e": first_value}) & (
+            Q(**{f"{first}__{first_op}": first_value}) | Q(**{first: first_value, f"{second}__{second_op}": second_value})
+        )
+
+    def field_names(self):
+        return [field.lstrip("-") for field in self.ordering_fields]
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name in self.field_names()]
+        return [getattr(row, name) for name in self.field_names()]
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, model, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            fields = [model._meta.get_field(name) for name in self.field_names()]
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError(encoded)
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValueError, ValidationError, LookupError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.get_position(self.page[-1])))
+
+    def get_paginated_response(self, data):
+        fields = [("next", self.get_next_link()), ("results", data)]
+        if self.count is not None:
+            fields.insert(0, ("count", self.count))
+        return Response(OrderedDict(fields))
+
+    def get_paginated_response_schema(self, schema):
+        properties = {
+            "next": {"type": "string", "nullable": True, "format": "uri"},
+            "results": schema,
+        }
+        if self.count is not None:
+            properties["count"] = {"type": "integer"}
+        return {"type": "object", "properties": properties}
@@ -0,0 +1,254 @@
+"""
+Hash partitioning of the friendship tables.
+
+``Friend`` and ``FriendshipRequest`` are partitioned by hash of ``to_user_id``,
+which every per-user read filters on, so these reads and the single-row writes
+of ``PartitionKeyMixin`` touch one partition.
+
+``rebuild_table`` converts a table to hash partitioning (or back, with
+``partitions=0``) while it keeps serving reads and writes:
+
+1. a new table is created with the columns, constraints and indexes of the old
+   one, under temporary names,
+2. a trigger mirrors every write made to the old table into the new one,
+3. the existing rows are copied in batches of ``batch_size``, each committed on
+   its own when running outside of a transaction (non-atomic migrations),
+4. the tables are swapped and the constraints and indexes get their names back
+   in one transaction, holding an ACCESS EXCLUSIVE lock only for the renames.
+   Views over the table are recreated over the new one.
+
+Unique indexes that don't include the partition key can't exist on a
+partitioned table: they must be listed in ``drop_indexes`` and enforced some
+other way (see ``REQUEST_PAIR_TRIGGER``). Indexes can't be built concurrently
+on a partitioned table either, so later index migrations use ``AddIndex``.
+"""
+import re
+
+from django.db import transaction
+
+PARTITION_KEY = "to_user_id"
+
+# `request_user_pair_uniq` (one request per pair of users, whichever direction it was sent in) is an expression
+# index, which a table partitioned by `to_user_id` can't have. The trigger enforces it instead: it serializes the
+# inserts of a pair with an advisory lock, then fails like the index did if the reverse request exists.
+REQUEST_PAIR_TRIGGER = [
+    """
+    CREATE OR REPLACE FUNCTION friends_request_pair_check() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtextextended(
+            'friends_request_pair:' || LEAST(NEW.from_user_id, NEW.to_user_id) || ':'
+            || GREATEST(NEW.from_user_id, NEW.to_user_id), 0
+        ));
+        IF EXISTS (
+            SELECT 1 FROM friends_friendshiprequest
+            WHERE to_user_id = NEW.from_user_id AND from_user_id = NEW.to_user_id
+        ) THEN
+            RAISE EXCEPTION 'Users % and % already have a friendship request', NEW.from_user_id, NEW.to_user_id
+                USING ERRCODE = 'unique_violation', CONSTRAINT = 'request_user_pair_uniq';
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER request_user_pair_check AFTER INSERT ON friends_friendshiprequest
+    FOR EACH ROW EXECUTE FUNCTION friends_request_pair_check()
+    """,
+]
+
+DROP_REQUEST_PAIR_TRIGGER = [
+    "DROP TRIGGER IF EXISTS request_user_pair_check ON friends_friendshiprequest",
+    "DROP FUNCTION IF EXISTS friends_request_pair_check()",
+]
+
+REQUEST_PAIR_INDEX = [
+    "CREATE UNIQUE INDEX request_user_pair_uniq ON friends_friendshiprequest "
+    "(LEAST(from_user_id, to_user_id), GREATEST(from_user_id, to_user_id))",
+]
+
+INDEX_DEFINITION = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ USING (.*)$")
+
+
+class PartitionKeyMixin:
+    """ Includes the partition key in the UPDATE and DELETE of a single row, so they only touch its partition """
+
+    partition_key = PARTITION_KEY
+
+    def _partition_filter(self):
+        return {self.partition_key: getattr(self, self.partition_key)}
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        return super()._do_update(
+            base_qs.filter(**self._partition_filter()), using, pk_val, values, update_fields, forced_update
+        )
+
+    def delete(self, using=None, keep_parents=False):
+        if self.pk is None:
+            raise ValueError(f"{self._meta.object_name} object can't be deleted because its pk is None.")
+        deleted = type(self)._base_manager.db_manager(using).filter(pk=self.pk, **self._partition_filter()).delete()
+        self.pk = None
+        return deleted
+
+
+def temporary_name(name):
+    return f"{name[:58]}__new"
+
+
+def rebuild_table(connection, table, key, partitions, batch_size=5000, drop_indexes=(), swap_sql=()):
+    """
+    Replace `table` by a copy partitioned by hash of `key` in `partitions` partitions, or by a plain table when
+    `partitions` is 0, without blocking writes while the rows are copied.
+
+    `swap_sql` statements run in the transaction that swaps the tables, after the renames.
+    """
+    qn = connection.ops.quote_name
+    new = f"{table}__new"
+    partition_names = [f"{table}_p{remainder}" for remainder in range(partitions)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conrelid::regclass::text FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        referencing = [row[0] for row in cursor.fetchall()]
+        if referencing:
+            raise ValueError(f"{table} can't be rebuilt while foreign keys of {', '.join(referencing)} reference it")
+
+        cursor.execute(
+            "SELECT a.attname, pg_get_serial_sequence(%s, a.attname), a.attidentity <> '' "
+            "FROM pg_attribute a WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped "
+            "ORDER BY a.attnum",
+            [table, table],
+        )
+        sequences = [(column, sequence, identity) for column, sequence, identity in cursor.fetchall() if sequence]
+
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid), "
+            "ARRAY(SELECT attname FROM unnest(conkey) WITH ORDINALITY k(attnum, position) "
+            "JOIN pg_attribute ON attrelid = conrelid AND pg_attribute.attnum = k.attnum ORDER BY position) "
+            "FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') ORDER BY conname",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        [(primary_key_name, _, _, primary_key)] = [row for row in constraints if row[1] == "p"]
+        # Primary keys of partitioned tables must include the partition key; plain tables keep the others only
+        primary_key = [column for column in primary_key if column != key] or primary_key
+        if partitions:
+            primary_key = primary_key + [key]
+
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = %s::regclass AND NOT EXISTS ("
+            "  SELECT 1 FROM pg_constraint c WHERE c.conrelid = x.indrelid AND c.conindid = x.indexrelid"
+            ") ORDER BY i.relname",
+            [table],
+        )
+        indexes = [(name, definition) for name, definition in cursor.fetchall() if name not in drop_indexes]
+
+        cursor.execute(
+            "SELECT DISTINCT v.oid::regclass::text, pg_get_viewdef(v.oid) FROM pg_depend d "
+            "JOIN pg_rewrite r ON r.oid = d.objid JOIN pg_class v ON v.oid = r.ev_class "
+            "WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = %s::regclass AND v.relkind = 'v'",
+            [table],
+        )
+        views = cursor.fetchall()
+
+        # 1. The new table, its partitions, constraints and indexes
+        cursor.execute(
+            f"CREATE TABLE {qn(new)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS "
+            f"INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS)"
+            + (f" PARTITION BY HASH ({qn(key)})" if partitions else "")
+        )
+        for remainder in range(partitions):
+            cursor.execute(
+                f"CREATE TABLE {qn(temporary_name(partition_names[remainder]))} PARTITION OF {qn(new)} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+        cursor.execute(
+            f"ALTER TABLE {qn(new)} ADD CONSTRAINT {qn(temporary_name(primary_key_name))} "
+            f"PRIMARY KEY ({', '.join(qn(column) for column in primary_key)})"
+        )
+        for name, kind, definition, _ in constraints:
+            if kind == "u":
+                cursor.execute(f"ALTER TABLE {qn(new)} ADD CONSTRAINT {qn(temporary_name(name))} {definition}")
+            elif kind == "f":
+                # Foreign key names are per table, so they can keep theirs
+                cursor.execute(f"ALTER TABLE {qn(new)} ADD CONSTRAINT {qn(name)} {definition}")
+        for name, definition in indexes:
+            unique, rest = INDEX_DEFINITION.match(definition).groups()
+            cursor.execute(f"CREATE {unique or ''}INDEX {qn(temporary_name(name))} ON {qn(new)} USING {rest}")
+
+        # 2. Mirror the writes made from now on
+        match = " AND ".join(f"{qn(column)} = OLD.{qn(column)}" for column in dict.fromkeys(primary_key + [key]))
+        cursor.execute(f"""
+            CREATE FUNCTION {qn(new + "_sync")}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {qn(new)} WHERE {match};
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {qn(new)} SELECT (NEW).* ON CONFLICT DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END
+            $$
+        """)
+        cursor.execute(
+            f"CREATE TRIGGER {qn(new + '_sync')} AFTER INSERT OR UPDATE OR DELETE ON {qn(table)} "
+            f"FOR EACH ROW EXECUTE FUNCTION {qn(new + '_sync')}()"
+        )
+
+        # 3. Copy the rows that were there before the trigger. FOR SHARE waits for concurrent updates and deletes,
+        # whose mirrored changes then win over the copy.
+        order = qn(primary_key[0])
+        cursor.execute(f"SELECT min({order}) - 1 FROM {qn(table)}")
+        last = cursor.fetchone()[0]
+        while last is not None:
+            cursor.execute(
+                f"WITH batch AS (SELECT * FROM {qn(table)} WHERE {order} > %s ORDER BY {order} LIMIT %s FOR SHARE), "
+                f"copied AS (INSERT INTO {qn(new)} SELECT * FROM batch ON CONFLICT DO NOTHING) "
+                f"SELECT count(*), max({order}) FROM batch",
+                [last, batch_size],
+            )
+            count, last = cursor.fetchone()
+            if count < batch_size:
+                break
+
+        # 4. Swap the tables
+        with transaction.atomic(using=connection.alias):
+            # Deferred foreign key checks of rows written earlier in the transaction would keep the table from being
+            # dropped
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(f"DROP TRIGGER {qn(new + '_sync')} ON {qn(table)}")
+            cursor.execute(f"DROP FUNCTION {qn(new + '_sync')}()")
+            renamed_sequences = []
+            for column, sequence, identity in sequences:
+                if identity:
+                    # The identity column of the new table has its own sequence, which continues the old one
+                    cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [new, column])
+                    new_sequence = cursor.fetchone()[0]
+                    cursor.execute(f"SELECT last_value, is_called FROM {sequence}")
+                    cursor.execute("SELECT setval(%s, %s, %s)", [new_sequence, *cursor.fetchone()])
+                    renamed_sequences.append((new_sequence, sequence.rsplit(".", 1)[-1]))
+                else:
+                    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {qn(new)}.{qn(column)}")
+            for view, _ in views:
+                cursor.execute(f"DROP VIEW {view}")
+            cursor.execute(f"DROP TABLE {qn(table)}")
+            cursor.execute(f"ALTER TABLE {qn(new)} RENAME TO {qn(table)}")
+            for new_sequence, name in renamed_sequences:
+                cursor.execute(f"ALTER SEQUENCE {new_sequence} RENAME TO {name}")
+            for name in partition_names:
+                cursor.execute(f"ALTER TABLE {qn(temporary_name(name))} RENAME TO {qn(name)}")
+            for name, kind, _, _ in constraints:
+                if kind in ("p", "u"):
+                    cursor.execute(
+                        f"ALTER TABLE {qn(table)} RENAME CONSTRAINT {qn(temporary_name(name))} TO {qn(name)}"
+                    )
+            for name, _ in indexes:
+                cursor.execute(f"ALTER INDEX {qn(temporary_name(name))} RENAME TO {qn(name)}")
+            for view, definition in views:
+                cursor.execute(f"CREATE VIEW {view} AS {definition}")
+            for sql in swap_sql:
+                cursor.execute(sql)
@@ -0,0 +1,89 @@
+"""
+Degrees of separation between two users.
+
+The shortest chain of friendships is found by a bidirectional breadth-first
+search that always expands the smaller of the two frontiers, one whole level
+at a time. The friend ids of a frontier are read with a single
+``FriendIdCache.get_many`` call, so every level costs at most one ``IN`` query
+and nothing when the users are cached.
+
+Searches are bounded by ``FRIENDS_PATH_MAX_DEPTH`` (the longest path looked
+for) and ``FRIENDS_PATH_MAX_FRONTIER`` (the most users expanded in one level).
+A search stopped by either limit reports ``complete=False``, as opposed to two
+users that are not connected at all.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+
+from friends.cache import get_friend_id_cache
+
+PathSearch = namedtuple("PathSearch", ["path", "complete"])
+
+
+class FriendPathFinder:
+    """ Find the shortest chain of friends between two users """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def get_cache(self):
+        return self.cache if self.cache is not None else get_friend_id_cache()
+
+    def limits(self, max_depth=None, max_frontier=None):
+        """ Return `(max_depth, max_frontier)`, each requested limit capped by its setting """
+        depth_limit = getattr(settings, "FRIENDS_PATH_MAX_DEPTH", 6)
+        frontier_limit = getattr(settings, "FRIENDS_PATH_MAX_FRONTIER", 10000)
+        return (
+            depth_limit if max_depth is None else min(max_depth, depth_limit),
+            frontier_limit if max_frontier is None else min(max_frontier, frontier_limit),
+        )
+
+    def search(self, user1_id, user2_id, max_depth=None, max_frontier=None):
+        """
+        Return a `PathSearch` whose path is the list of user ids from user1 to user2, or None if no path was found.
+        """
+        max_depth, max_frontier = self.limits(max_depth, max_frontier)
+        if user1_id == user2_id:
+            return PathSearch([user1_id], True)
+
+        cache = self.get_cache()
+        parents = ({user1_id: None}, {user2_id: None})
+        frontiers = [[user1_id], [user2_id]]
+        for _ in range(max_depth):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            frontier, visited, other = frontiers[side], parents[side], parents[1 - side]
+            if len(frontier) > max_frontier:
+                return PathSearch(None, False)
+
+            adjacency = cache.get_many(frontier)
+            next_frontier = []
+            # Every meeting point of a level gives a path of the same length, so the first one is kept
+            for user_id in frontier:
+                for friend_id in adjacency[user_id]:
+                    if friend_id in visited:
+                        continue
+                    visited[friend_id] = user_id
+                    if friend_id in other:
+                        return PathSearch(self._join(parents, friend_id), True)
+                    next_frontier.append(friend_id)
+            if not next_frontier:
+                return PathSearch(None, True)
+            frontiers[side] = next_frontier
+        return PathSearch(None, False)
+
+    def _join(self, parents, meeting_id):
+        path = []
+        user_id = meeting_id
+        while user_id is not None:
+            path.append(user_id)
+            user_id = parents[0][user_id]
+        path.reverse()
+        user_id = parents[1][meeting_id]
+        while user_id is not None:
+            path.append(user_id)
+            user_id = parents[1][user_id]
+        return path
+
+
+friend_paths = FriendPathFinder()
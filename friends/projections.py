@@ -0,0 +1,110 @@
+"""
+values()-based read paths for the list endpoints.
+
+A projection is the read-only counterpart of a serializer: it fetches exactly
+the columns it outputs with ``values()``, joining related rows in SQL, and
+builds plain dicts from them. No model instances or serializer fields are
+created per row, and the rendered JSON is byte-for-byte the same as the
+serializer it mirrors, so views keep their ``serializer_class`` for the schema.
+"""
+from rest_framework.response import Response
+
+
+class Projection:
+    """
+    Maps output keys to `values()` lookups.
+
+    `fields` is a sequence of `(key, source)` pairs where `source` is a lookup relative to the projected model, or
+    a `(relation, projection class)` pair for a nested object read through a foreign key.
+    """
+    fields = ()
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.plan = [
+            (key, f"{prefix}{source}", None) if isinstance(source, str)
+            else (key, None, source[1](f"{prefix}{source[0]}__"))
+            for key, source in self.fields
+        ]
+
+    def lookups(self):
+        """ The `values()` lookups the projection reads """
+        lookups = []
+        for _, lookup, nested in self.plan:
+            lookups += nested.lookups() if nested else [lookup]
+        return lookups
+
+    def to_representation(self, row):
+        return {
+            key: nested.to_representation(row) if nested else row[lookup]
+            for key, lookup, nested in self.plan
+        }
+
+    def render(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    def project(self, queryset):
+        """ Return the representation of every row of `queryset` """
+        return self.render(queryset.values(*self.lookups()))
+
+
+class UserSummaryProjection(Projection):
+    """
+    Mirrors `UserModelSerializer`. For users without a profile both render the profile keys as null, since DRF reads
+    a missing related object as None.
+    """
+    fields = (
+        ("id", "id"),
+        ("username", "username"),
+        ("email", "email"),
+        ("profile_image", "profile__profile_image"),
+        ("phone", "profile__phone"),
+        ("city", "profile__city"),
+        ("country", "profile__country"),
+    )
+
+
+class FriendProjection(Projection):
+    """ Mirrors `FriendSerializer`, for `Friend` as well as `FriendshipRequest` rows """
+    fields = (
+        ("id", "id"),
+        ("to_user_info", ("to_user", UserSummaryProjection)),
+        ("from_user_info", ("from_user", UserSummaryProjection)),
+    )
+
+
+class FriendSuggestionProjection(Projection):
+    """ Mirrors `FriendSuggestionSerializer` """
+    fields = (
+        ("id", "id"),
+        ("suggested_user_info", ("suggested_user", UserSummaryProjection)),
+        ("mutual_count", "mutual_count"),
+    )
+
+
+class ProjectionListMixin:
+    """
+    List views that render their rows through `projection_class` instead of the serializer.
+
+    The ordering columns of a keyset paginator are read along with the projected ones, so cursors still work.
+    """
+    projection_class = None
+    projection_prefix = ""
+
+    def get_projection(self):
+        return self.projection_class(self.projection_prefix)
+
+    def get_projection_lookups(self, projection):
+        lookups = projection.lookups()
+        paginator = self.paginator
+        if paginator is not None and hasattr(paginator, "get_ordering"):
+            lookups += [field.lstrip("-") for field in paginator.get_ordering(self)]
+        return list(dict.fromkeys(lookups))
+
+    def list(self, request, *args, **kwargs):
+        projection = self.get_projection()
+        queryset = self.filter_queryset(self.get_queryset()).values(*self.get_projection_lookups(projection))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(projection.render(page))
+        return Response(projection.render(queryset))
@@ -0,0 +1,127 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from friends.batching import defer
+from friends.cache import get_friend_id_cache
+from friends.counters import apply_deltas, graph_deltas, request_deltas
+from friends.models import Friend
+from friends.notifications import notify
+from friends.outbox import event_payload, outbox_handler, record
+from friends.signals import friendship_request_accepted, friendship_removed, friendship_request_created, \
+    friendship_request_canceled, friendship_request_rejected, friendship_request_viewed
+from friends.suggestions import discard_pairs, mark_stale, queue_friendship_changes
+
+
+@receiver(friendship_request_accepted)
+@receiver(friendship_removed)
+def invalidate_friend_ids(sender, from_user, to_user, **kwargs):
+    """ Drop the cached adjacency of both users when their friendship changes """
+    get_friend_id_cache().invalidate(from_user.pk, to_user.pk)
+
+
+@receiver(post_save, sender=Friend)
+def invalidate_friend_ids_on_save(sender, instance, created, **kwargs):
+    """ Catch friendships written directly through the ORM """
+    if created:
+        get_friend_id_cache().invalidate(instance.from_user_id, instance.to_user_id)
+        defer(apply_deltas, *graph_deltas(instance.from_user_id, instance.to_user_id))
+
+
+@receiver(post_delete, sender=Friend)
+def invalidate_friend_ids_on_delete(sender, instance, **kwargs):
+    """ Catch friendships deleted directly through the ORM, e.g. along with one of the users """
+    get_friend_id_cache().invalidate(instance.from_user_id, instance.to_user_id)
+
+
+SIGNAL_EVENTS = {
+    friendship_request_created: "friendship_request_created",
+    friendship_request_rejected: "friendship_request_rejected",
+    friendship_request_canceled: "friendship_request_canceled",
+    friendship_request_viewed: "friendship_request_viewed",
+    friendship_request_accepted: "friendship_request_accepted",
+    friendship_removed: "friendship_removed",
+}
+
+
+@receiver(friendship_request_created)
+@receiver(friendship_request_rejected)
+@receiver(friendship_request_canceled)
+@receiver(friendship_request_viewed)
+@receiver(friendship_request_accepted)
+@receiver(friendship_removed)
+def record_outbox_event(sender, signal, **kwargs):
+    """ Record the signal in the outbox, in the transaction of the change that sent it """
+    record(SIGNAL_EVENTS[signal], event_payload(sender, **kwargs))
+
+
+@receiver(friendship_request_created)
+@receiver(friendship_request_rejected)
+@receiver(friendship_request_canceled)
+@receiver(friendship_request_viewed)
+@receiver(friendship_request_accepted)
+@receiver(friendship_removed)
+def bump_related_graph_versions(sender, signal, **kwargs):
+    """ Both users' friends endpoints change; shares the counters' UPDATE """
+    payload = event_payload(sender, **kwargs)
+    defer(apply_deltas, *graph_deltas(payload["from_user_id"], payload["to_user_id"]))
+
+
+@receiver(friendship_request_created)
+@receiver(friendship_request_canceled)
+@receiver(friendship_request_viewed)
+@receiver(friendship_request_accepted)
+def notify_request_change(sender, signal, **kwargs):
+    """ Push the request and unread count events to the users' streams once the change commits """
+    defer(notify, (SIGNAL_EVENTS[signal], event_payload(sender, **kwargs)))
+
+
+@outbox_handler("friendship_request_accepted", "friendship_removed")
+def queue_suggestion_refresh(payloads):
+    """ Both users and all of their friends gain or lose a 2-hop candidate """
+    queue_friendship_changes([(payload["from_user_id"], payload["to_user_id"]) for payload in payloads])
+
+
+@outbox_handler("friendship_request_created")
+def discard_requested_suggestion(payloads):
+    discard_pairs([(payload["from_user_id"], payload["to_user_id"]) for payload in payloads])
+
+
+@outbox_handler("friendship_request_canceled")
+def queue_canceled_pair(payloads):
+    mark_stale([user_id for payload in payloads for user_id in (payload["from_user_id"], payload["to_user_id"])])
+
+
+# Counters and the adjacency cache stay consistent with the write, so they are updated in its transaction.
+@receiver(friendship_request_created)
+def count_created_request(sender, **kwargs):
+    defer(apply_deltas, *request_deltas(sender, 1))
+
+
+@receiver(friendship_request_canceled)
+def count_canceled_request(sender, **kwargs):
+    defer(apply_deltas, *request_deltas(sender, -1))
+
+
+@receiver(friendship_request_accepted)
+def count_accepted_request(sender, from_user, to_user, **kwargs):
+    defer(
+        apply_deltas,
+        (from_user.pk, "friend_count", 1),
+        (to_user.pk, "friend_count", 1),
+        *request_deltas(sender, -1),
+    )
+
+
+@receiver(friendship_removed)
+def count_removed_friendship(sender, from_user, to_user, **kwargs):
+    defer(apply_deltas, (from_user.pk, "friend_count", -1), (to_user.pk, "friend_count", -1))
+
+
+@receiver(friendship_request_rejected)
+def count_rejected_request(sender, **kwargs):
+    defer(apply_deltas, (sender.to_user_id, "pending_request_count", -1))
+
+
+@receiver(friendship_request_viewed)
+def count_viewed_request(sender, **kwargs):
+    defer(apply_deltas, (sender.to_user_id, "unread_request_count", -1))
@@ -1,15 +1,26 @@
 from rest_framework import serializers
-from .models import Friend, FriendshipRequest
+from .models import Friend, FriendshipRequest, FriendSuggestion
 from users.models import UserModel, ProfileModel
 
 
+class EagerLoadingMixin:
+    """ Serializers declare the relations they read, so querysets can join them up front instead of once per row """
+    select_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.select_related(*cls.select_related_fields)
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProfileModel
         fields = ('profile_image', 'phone', 'city', 'country')
 
 
-class UserModelSerializer(serializers.ModelSerializer):
+class UserModelSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('profile',)
+
     profile_image = serializers.CharField(source='profile.profile_image', read_only=True)
     phone = serializers.CharField(source='profile.phone', read_only=True)
     city = serializers.CharField(source='profile.city', read_only=True)
@@ -20,7 +31,9 @@ class UserModelSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'profile_image', 'phone', 'city', 'country')
 
 
-class FriendSerializer(serializers.ModelSerializer):
+class FriendSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('to_user__profile', 'from_user__profile')
+
     to_user_info = UserModelSerializer(source='to_user', read_only=True)
     from_user_info = UserModelSerializer(source='from_user', read_only=True)
 
@@ -29,7 +42,9 @@ class FriendSerializer(serializers.ModelSerializer):
         fields = ('id', 'to_user_info', 'from_user_info')
 
 
-class FriendshipRequestSerializer(serializers.ModelSerializer):
+class FriendshipRequestSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('from_user__profile', 'to_user__profile')
+
     from_user_info = UserModelSerializer(source='from_user', read_only=True)
     to_user_info = UserModelSerializer(source='to_user', read_only=True)
 
@@ -38,9 +53,26 @@ class FriendshipRequestSerializer(serializers.ModelSerializer):
         fields = ('id', 'from_user_info', 'to_user_info', 'message', 'rejected', 'viewed')
 
 
+class FriendSuggestionSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('suggested_user__profile',)
+
+    suggested_user_info = UserModelSerializer(source='suggested_user', read_only=True)
+
+    class Meta:
+        model = FriendSuggestion
+        fields = ('id', 'suggested_user_info', 'mutual_count')
+
+
 class FriendshipStatusSerializer(serializers.Serializer):
     friendship_status = serializers.CharField()
     friends_or_mutual = UserModelSerializer(many=True)
 
     def get_friends_or_mutual(self, obj):
         return obj['friends_or_mutual']
+
+
+class BulkUsernamesSerializer(serializers.Serializer):
+    usernames = serializers.ListField(
+        child=serializers.CharField(max_length=50), allow_empty=False, max_length=500
+    )
+    message = serializers.CharField(required=False, allow_blank=True, default='')
@@ -0,0 +1,212 @@
+"""
+Memory-mapped CSR snapshot of the friend graph.
+
+The ``build_friend_snapshot`` command writes the sorted friend ids of every
+user to one file in compressed sparse row layout: an ``offsets`` array indexed
+by user id followed by a ``neighbors`` array, so the friends of user ``u`` are
+``neighbors[offsets[u]:offsets[u + 1]]``. Worker processes map the file
+read-only, so they share its pages through the OS page cache instead of each
+holding a copy of the graph, and reading a user's friends is an array slice.
+
+``SnapshotBackend`` serves ``FriendIdCache`` from the snapshot when it is set
+as the ``FRIENDS_ADJACENCY_CACHE`` backend, which covers the mutual friends,
+friendship status and degrees of separation reads. The delta overlay is the
+set of users whose ``graph_changed_at`` is later than the export, polled every
+``refresh_interval`` seconds, plus the users created since: they are served by
+a regular fallback backend loaded from the database. A rebuilt file replaces
+the old one atomically and is picked up at the next poll.
+
+Friendships bulk-written past the receivers, e.g. by ``import_graph``, only
+show up once the snapshot is rebuilt. The file uses the byte order of the
+machine that built it.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from friends.storage import friend_edges
+from users.models import ProfileModel, UserModel
+from utils.db.replicas import primary
+
+MAGIC = b"FRNDCSR1"
+# magic, neighbor typecode, user count (highest user id + 1), friend id count, export time in microseconds
+HEADER = struct.Struct("=8sc7xqqq")
+
+DEFAULT_FALLBACK = {
+    "BACKEND": "friends.cache.LocMemLRUBackend",
+    "OPTIONS": {"max_entries": 10000, "timeout": 5},
+}
+
+
+def write_snapshot(path, chunk_size=10000):
+    """ Export the friend graph to `path` and return the number of users and friend ids written """
+    path = os.fspath(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    exported_at = timezone.now()
+    consistent = connection.vendor == "postgresql" and not connection.in_atomic_block
+    try:
+        with transaction.atomic(), open(temporary, "wb") as file:
+            if consistent:
+                # The users and their friendships are read from the same snapshot of the database
+                with connection.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            highest = UserModel.objects.aggregate(highest=Max("id"))["highest"]
+            user_count = 0 if highest is None else highest + 1
+            typecode = "I" if user_count <= 2 ** 32 else "q"
+            counts = array("q", bytes(8 * (user_count + 1)))
+
+            file.seek(HEADER.size + counts.itemsize * len(counts))
+            batch = array(typecode)
+            rows = (
+                friend_edges().objects.order_by("to_user_id", "from_user_id")
+                .values_list("to_user_id", "from_user_id")
+                .iterator(chunk_size=chunk_size)
+            )
+            for to_user_id, from_user_id in rows:
+                if to_user_id >= user_count:
+                    # Created after the users were counted; read through the overlay instead
+                    continue
+                counts[to_user_id + 1] += 1
+                batch.append(from_user_id)
+                if len(batch) >= chunk_size:
+                    batch.tofile(file)
+                    del batch[:]
+            batch.tofile(file)
+
+            offsets = array("q", accumulate(counts))
+            file.seek(0)
+            file.write(HEADER.pack(
+                MAGIC, typecode.encode(), user_count, offsets[-1], int(exported_at.timestamp() * 1_000_000)
+            ))
+            offsets.tofile(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return user_count, offsets[-1]
+
+
+class GraphSnapshot:
+    """ Read-only mapping of a file written by `write_snapshot` """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        if len(self.buffer) < HEADER.size:
+            raise ValueError(f"{path} is not a friend graph snapshot")
+        magic, typecode, self.user_count, self.edge_count, exported_at = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a friend graph snapshot")
+        self.exported_at = datetime.fromtimestamp(exported_at / 1_000_000, tz=dt_timezone.utc)
+
+        view = memoryview(self.buffer)
+        end = HEADER.size + 8 * (self.user_count + 1)
+        self.offsets = view[HEADER.size:end].cast("q")
+        self.neighbors = view[end:].cast(typecode.decode())
+        if len(self.neighbors) != self.edge_count:
+            raise ValueError(f"{path} is truncated")
+
+    def __contains__(self, user_id):
+        return 0 <= user_id < self.user_count
+
+    def friend_ids(self, user_id):
+        """ Return the sorted friend ids of a user as of the export """
+        if user_id not in self:
+            return ()
+        return tuple(self.neighbors[self.offsets[user_id]:self.offsets[user_id + 1]])
+
+
+class SnapshotBackend:
+    """
+    `FriendIdCache` backend reading from the snapshot at `path` (`FRIENDS_SNAPSHOT_PATH` by default).
+
+    Users changed since the export are read from the `fallback` backend, configured like `FRIENDS_ADJACENCY_CACHE`.
+    Without a snapshot file, every user is.
+    """
+
+    def __init__(self, path=None, fallback=None, refresh_interval=1, margin=60):
+        self.path = os.fspath(path or settings.FRIENDS_SNAPSHOT_PATH)
+        fallback = fallback or DEFAULT_FALLBACK
+        self.fallback = import_string(fallback["BACKEND"])(**fallback.get("OPTIONS", {}))
+        self.refresh_interval = refresh_interval
+        # graph_changed_at is the start of the changing transaction, which may commit after a poll or the export
+        self.margin = timedelta(seconds=margin)
+        self.lock = threading.Lock()
+        self.snapshot = None
+        # Users of the overlay, with the graph_version their fallback entry was last invalidated at
+        self.changed = {}
+        self.polled_at = None
+        self.checked_at = None
+
+    def refresh(self):
+        """ Pick up a rebuilt snapshot and add the users changed since the last poll to the overlay """
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.refresh_interval:
+            return
+        with self.lock:
+            if self.checked_at is not None and now - self.checked_at < self.refresh_interval:
+                return
+            self.checked_at = now
+            self._reopen()
+            if self.snapshot is None:
+                return
+            started = timezone.now()
+            since = (self.polled_at or self.snapshot.exported_at) - self.margin
+            with primary():
+                versions = dict(
+                    ProfileModel.objects.filter(graph_changed_at__gte=since).values_list("user_id", "graph_version")
+                )
+            stale = [user_id for user_id, version in versions.items() if self.changed.get(user_id) != version]
+            self.fallback.delete_many(stale)
+            self.changed.update(versions)
+            self.polled_at = started
+
+    def _reopen(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.snapshot = None
+            return
+        if self.snapshot is None or self.snapshot.identity != (stat.st_ino, stat.st_mtime_ns):
+            # The previous mapping is released once no reader holds it anymore
+            self.snapshot = GraphSnapshot(self.path)
+            self.changed = {}
+            self.polled_at = None
+
+    def get_many(self, keys):
+        self.refresh()
+        snapshot, changed = self.snapshot, self.changed
+        if snapshot is None:
+            return self.fallback.get_many(keys)
+        overlay = {key for key in keys if key in changed or key not in snapshot}
+        found = self.fallback.get_many(overlay)
+        found.update((key, snapshot.friend_ids(key)) for key in keys if key not in overlay)
+        return found
+
+    def set_many(self, mapping):
+        self.fallback.set_many(mapping)
+
+    def delete_many(self, keys):
+        # Changes made by this process are read back from the database right away
+        for key in keys:
+            self.changed.setdefault(key, None)
+        self.fallback.delete_many(keys)
+
+    def clear(self):
+        self.fallback.clear()
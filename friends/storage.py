@@ -0,0 +1,117 @@
+"""
+How friendships are stored in the ``Friend`` table.
+
+With the default ``FRIENDS_STORAGE = "directed"`` a friendship is two rows,
+A→B and B→A. With ``"canonical"`` it is a single row whose ``to_user_id`` is
+the lower user id and ``from_user_id`` the higher one, which halves the table
+and its indexes and makes removals single-row. Directed reads then go through
+``FriendEdge``, a view that returns every canonical row from both sides, so
+the ``FriendshipManager`` API and the serializers see the same rows in both
+modes. On the partitioned table (see ``friends.partitioning``), the side of a
+user stored as ``from_user_id`` is looked up in every partition.
+
+``collapse_friendships`` and ``expand_friendships`` convert the stored rows
+between the two modes in batches, for the data migration and the
+``convert_friend_storage`` command.
+"""
+from django.conf import settings
+
+DIRECTED, CANONICAL = "directed", "canonical"
+STORAGE_MODES = (DIRECTED, CANONICAL)
+
+EDGES_VIEW = """
+    CREATE VIEW friends_friend_edges AS
+    SELECT id, created_at, updated_at, to_user_id, from_user_id FROM friends_friend
+    UNION ALL
+    SELECT id, created_at, updated_at, from_user_id, to_user_id FROM friends_friend
+"""
+
+DROP_EDGES_VIEW = "DROP VIEW IF EXISTS friends_friend_edges"
+
+
+def storage_mode():
+    mode = getattr(settings, "FRIENDS_STORAGE", DIRECTED)
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"FRIENDS_STORAGE must be one of {', '.join(STORAGE_MODES)}, not {mode!r}")
+    return mode
+
+
+def canonical_storage():
+    return storage_mode() == CANONICAL
+
+
+def friendship_pairs(user1_id, user2_id):
+    """ The `(to_user_id, from_user_id)` of the `Friend` rows storing the friendship of two users """
+    if canonical_storage():
+        return [(min(user1_id, user2_id), max(user1_id, user2_id))]
+    return [(user1_id, user2_id), (user2_id, user1_id)]
+
+
+def friend_edges():
+    """ The model with one row per friend of each user: `Friend` itself, or `FriendEdge` over canonical rows """
+    from friends.models import Friend, FriendEdge
+
+    return FriendEdge if canonical_storage() else Friend
+
+
+def collapse_friendships(connection, batch_size=5000):
+    """
+    Keep one `(lower id, higher id)` row per friendship: delete the mirrored rows and flip the rows stored the other
+    way round. Returns the number of rows deleted and flipped.
+    """
+    return _convert(connection, batch_size, """
+        deleted AS (
+            DELETE FROM friends_friend f USING batch b
+            WHERE f.id = b.id AND f.to_user_id = b.to_user_id AND b.to_user_id > b.from_user_id
+            AND EXISTS (
+                SELECT 1 FROM friends_friend r WHERE r.to_user_id = b.from_user_id AND r.from_user_id = b.to_user_id
+            )
+            RETURNING f.id
+        ),
+        flipped AS (
+            UPDATE friends_friend f SET to_user_id = b.from_user_id, from_user_id = b.to_user_id FROM batch b
+            WHERE f.id = b.id AND f.to_user_id = b.to_user_id AND b.to_user_id > b.from_user_id
+            AND NOT EXISTS (
+                SELECT 1 FROM friends_friend r WHERE r.to_user_id = b.from_user_id AND r.from_user_id = b.to_user_id
+            )
+            RETURNING f.id
+        )
+        SELECT (SELECT count(*) FROM batch), (SELECT max(id) FROM batch),
+            (SELECT count(*) FROM deleted) + (SELECT count(*) FROM flipped)
+    """)
+
+
+def expand_friendships(connection, batch_size=5000):
+    """ Add the mirrored row of every friendship stored as a single row; returns the number of rows added """
+    return _convert(connection, batch_size, """
+        inserted AS (
+            INSERT INTO friends_friend (to_user_id, from_user_id, created_at, updated_at)
+            SELECT from_user_id, to_user_id, created_at, updated_at FROM batch b
+            WHERE NOT EXISTS (
+                SELECT 1 FROM friends_friend r WHERE r.to_user_id = b.from_user_id AND r.from_user_id = b.to_user_id
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        )
+        SELECT (SELECT count(*) FROM batch), (SELECT max(id) FROM batch), (SELECT count(*) FROM inserted)
+    """)
+
+
+def _convert(connection, batch_size, statements):
+    """ Run `statements` over the `Friend` rows in id order, `batch_size` rows per statement """
+    changed, last = 0, 0
+    with connection.cursor() as cursor:
+        # Rows added along the way are left out
+        cursor.execute("SELECT max(id) FROM friends_friend")
+        maximum = cursor.fetchone()[0]
+        while maximum is not None and last < maximum:
+            cursor.execute(
+                "WITH batch AS (SELECT * FROM friends_friend WHERE id > %s AND id <= %s ORDER BY id LIMIT %s), "
+                + statements,
+                [last, maximum, batch_size],
+            )
+            count, last, batch_changed = cursor.fetchone()
+            changed += batch_changed
+            if count < batch_size:
+                break
+    return changed
@@ -0,0 +1,100 @@
+"""
+"People you may know" recommendations.
+
+Candidates are the friends of a user's friends, scored by the number of
+mutual friends, excluding the user's existing friends and anyone with a
+friendship request (pending or rejected) in either direction. Scores are
+precomputed into ``FriendSuggestion`` by the ``refresh_friend_suggestions``
+management command, which only recomputes the users queued in
+``SuggestionRefresh`` by the receivers in ``friends.receivers``.
+"""
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from friends.counters import bump_graph_versions
+from friends.models import FriendshipRequest, FriendSuggestion, SuggestionRefresh
+from friends.storage import friend_edges
+
+DEFAULT_SUGGESTION_LIMIT = 50
+
+
+def compute_suggestions(user_id, limit=DEFAULT_SUGGESTION_LIMIT):
+    """ Return ``(candidate_id, mutual_count)`` pairs for a user, best first """
+    edges = friend_edges().objects
+    friends = edges.filter(to_user_id=user_id).values("from_user_id")
+    return list(
+        edges.filter(to_user_id__in=friends)
+        .exclude(from_user_id=user_id)
+        .exclude(from_user_id__in=friends)
+        .exclude(from_user_id__in=FriendshipRequest.objects.filter(to_user_id=user_id).values("from_user_id"))
+        .exclude(from_user_id__in=FriendshipRequest.objects.filter(from_user_id=user_id).values("to_user_id"))
+        .values("from_user_id")
+        .annotate(mutual_count=Count("id"))
+        .order_by("-mutual_count", "from_user_id")
+        .values_list("from_user_id", "mutual_count")[:limit]
+    )
+
+
+def mark_stale(user_ids):
+    """ Queue users whose suggestions must be recomputed """
+    now = timezone.now()
+    SuggestionRefresh.objects.bulk_create(
+        [SuggestionRefresh(user_id=user_id, queued_at=now) for user_id in set(user_ids)],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["queued_at"],
+    )
+
+
+def discard_pairs(pairs):
+    """ Drop suggestions between each pair of users, e.g. once a request is sent """
+    condition = Q()
+    for user1_id, user2_id in pairs:
+        condition |= Q(user_id=user1_id, suggested_user_id=user2_id) | Q(user_id=user2_id, suggested_user_id=user1_id)
+    if condition:
+        FriendSuggestion.objects.filter(condition).delete()
+
+
+def queue_friendship_changes(pairs):
+    """ Queue both users of each changed friendship and all of their friends """
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    user_ids.update(
+        friend_edges().objects.filter(to_user_id__in=user_ids).values_list("from_user_id", flat=True)
+    )
+    mark_stale(user_ids)
+
+
+def refresh_suggestions(user_ids, limit=DEFAULT_SUGGESTION_LIMIT):
+    """ Recompute and store the suggestions of the given users """
+    now = timezone.now()
+    suggestions = [
+        FriendSuggestion(
+            user_id=user_id,
+            suggested_user_id=candidate_id,
+            mutual_count=mutual_count,
+            created_at=now,
+            updated_at=now,
+        )
+        for user_id in user_ids
+        for candidate_id, mutual_count in compute_suggestions(user_id, limit)
+    ]
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FriendSuggestion.objects.bulk_create(suggestions)
+        bump_graph_versions(user_ids)
+    return len(suggestions)
+
+
+def refresh_stale(batch_size=500, limit=DEFAULT_SUGGESTION_LIMIT):
+    """ Refresh one batch of queued users and return how many were processed """
+    with transaction.atomic():
+        user_ids = list(
+            SuggestionRefresh.objects.select_for_update(skip_locked=True)
+            .order_by("queued_at")
+            .values_list("user_id", flat=True)[:batch_size]
+        )
+        if user_ids:
+            refresh_suggestions(user_ids, limit)
+            SuggestionRefresh.objects.filter(user_id__in=user_ids).delete()
+    return len(user_ids)
@@ -1,8 +1,45 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from users.models import UserModel
-from friends.models import FriendshipRequest, Friend
+from users.models import ProfileModel, UserModel
+from friends.async_views import _in_query_thread, shutdown_query_executor
+from friends.cache import FriendIdCache, LocMemLRUBackend, get_friend_id_cache
+from friends.counters import actual_counts
+from friends.exceptions import AlreadyExistsError, AlreadyFriendsError
+from friends.graphgen import generate_graph
+from friends.graphio import export_graph, import_graph
+from friends.models import FriendshipRequest, Friend, FriendSuggestion, OutboxEvent, RelationshipStatus, \
+    SuggestionRefresh
+from friends.mutual import MutualFriendsEngine, intersect_sorted, mutual_friends
+from friends.notifications import PostgresBroker, get_broker
+from friends.outbox import _handlers, deliver_pending, outbox_handler, requeue_failed
+from friends.partitioning import rebuild_table
+from friends.paths import PathSearch, friend_paths
+from friends.projections import FriendProjection, FriendSuggestionProjection, UserSummaryProjection
+from friends.serializers import FriendSerializer, FriendshipRequestSerializer, FriendshipStatusSerializer, \
+    FriendSuggestionSerializer, UserModelSerializer
+from friends.snapshot import GraphSnapshot, SnapshotBackend, write_snapshot
+from friends.storage import friendship_pairs
+from friends.views import FriendListView
+from utils.db.backends.postgresql_pool.base import DatabaseWrapper
+from utils.db.pool import close_pools, pool_stats
 
 
 class FriendshipRequestTest(TestCase):
@@ -75,3 +112,1514 @@ class FriendTest(TestCase):
         # Try to create a friendship with oneself
         with self.assertRaises(ValidationError):
             Friend.objects.create(to_user=user, from_user=user)
+
+
+class FriendIdCacheTest(TestCase):
+    def setUp(self):
+        self.user1 = UserModel.objects.create(username="cache1", email="cache1@example.com")
+        self.user2 = UserModel.objects.create(username="cache2", email="cache2@example.com")
+        self.user3 = UserModel.objects.create(username="cache3", email="cache3@example.com")
+        get_friend_id_cache().clear()
+
+    def test_cached_read_skips_database(self):
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2).accept()
+        self.assertEqual(Friend.objects.friend_ids(self.user1), (self.user2.pk,))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(Friend.objects.are_friends(self.user1, self.user2))
+            self.assertFalse(Friend.objects.are_friends(self.user1, self.user3))
+
+    def test_accept_invalidates(self):
+        self.assertEqual(Friend.objects.friend_ids(self.user1), ())
+
+        FriendshipRequest.objects.create(from_user=self.user3, to_user=self.user1).accept()
+
+        self.assertEqual(Friend.objects.friend_ids(self.user1), (self.user3.pk,))
+        self.assertEqual(Friend.objects.friend_ids(self.user3), (self.user1.pk,))
+
+    def test_remove_invalidates(self):
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2).accept()
+        self.assertTrue(Friend.objects.are_friends(self.user1, self.user2))
+
+        Friend.objects.remove_friend(self.user1, self.user2)
+
+        self.assertFalse(Friend.objects.are_friends(self.user1, self.user2))
+        self.assertFalse(Friend.objects.are_friends(self.user2, self.user1))
+
+    def test_cascade_delete_invalidates(self):
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2).accept()
+        self.assertEqual(Friend.objects.friend_ids(self.user1), (self.user2.pk,))
+
+        ProfileModel.objects.filter(user=self.user2).delete()
+        self.user2.delete()
+
+        self.assertEqual(Friend.objects.friend_ids(self.user1), ())
+
+    def test_lru_backend_is_bounded(self):
+        backend = LocMemLRUBackend(max_entries=2)
+        backend.set_many({1: (), 2: ()})
+        backend.get_many([1])
+        backend.set_many({3: ()})
+
+        self.assertEqual(set(backend.get_many([1, 2, 3])), {1, 3})
+
+    def test_lru_backend_entries_expire(self):
+        backend = LocMemLRUBackend(timeout=5)
+        with patch("friends.cache.time.monotonic", return_value=100):
+            backend.set_many({1: (2,)})
+        with patch("friends.cache.time.monotonic", return_value=104):
+            self.assertEqual(backend.get_many([1]), {1: (2,)})
+        with patch("friends.cache.time.monotonic", return_value=105):
+            self.assertEqual(backend.get_many([1]), {})
+
+
+class MutualFriendsTest(TestCase):
+    def setUp(self):
+        self.users = [
+            UserModel.objects.create(username=f"mutual{i}", email=f"mutual{i}@example.com") for i in range(6)
+        ]
+        self.alice, self.bob = self.users[0], self.users[1]
+        for friend in self.users[2:5]:
+            FriendshipRequest.objects.create(from_user=self.alice, to_user=friend).accept()
+        for friend in self.users[3:6]:
+            FriendshipRequest.objects.create(from_user=self.bob, to_user=friend).accept()
+        get_friend_id_cache().clear()
+
+    def test_intersect_sorted(self):
+        self.assertEqual(intersect_sorted((1, 3, 5, 7), (2, 3, 4, 7, 9, 11)), [3, 7])
+        self.assertEqual(intersect_sorted((), (1, 2)), [])
+
+    def test_sql_and_cached_paths_agree(self):
+        expected = [self.users[3], self.users[4]]
+
+        page = mutual_friends.page(self.alice, self.bob)
+        self.assertEqual((page.count, page.results), (2, expected))
+
+        Friend.objects.friend_ids(self.alice)
+        Friend.objects.friend_ids(self.bob)
+        page = mutual_friends.page(self.alice, self.bob)
+        self.assertEqual((page.count, page.results), (2, expected))
+
+    def test_page_is_sliced(self):
+        page = mutual_friends.page(self.alice, self.bob, offset=1, limit=1)
+        self.assertEqual((page.count, page.results), (2, [self.users[4]]))
+
+        page = mutual_friends.page(self.alice, self.bob, offset=5, limit=1)
+        self.assertEqual((page.count, page.results), (2, []))
+
+    def test_mutual_friends_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+
+        response = client.get(f"/api/v1/friends/mutual-friends/{self.bob.username}?page_size=1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual([user["id"] for user in response.data["results"]], [self.users[4].pk])
+
+        response = client.get(response.data["next"])
+        self.assertEqual([user["id"] for user in response.data["results"]], [self.users[3].pk])
+        self.assertIsNone(response.data["next"])
+
+
+class FriendSuggestionTest(TestCase):
+    def setUp(self):
+        self.users = [
+            UserModel.objects.create(username=f"suggest{i}", email=f"suggest{i}@example.com") for i in range(6)
+        ]
+        me, a, b, c, d, e = self.users
+        for friend in (a, b):
+            FriendshipRequest.objects.create(from_user=me, to_user=friend).accept()
+        for friend in (c, d, e):
+            FriendshipRequest.objects.create(from_user=a, to_user=friend).accept()
+        for friend in (c, d):
+            FriendshipRequest.objects.create(from_user=b, to_user=friend).accept()
+        FriendshipRequest.objects.create(from_user=me, to_user=d)
+        # The friendship events queue the users whose suggestions are stale.
+        call_command("run_outbox_worker", stdout=StringIO())
+
+    def suggestions(self, user):
+        return list(
+            FriendSuggestion.objects.filter(user=user)
+            .order_by("-mutual_count", "suggested_user_id")
+            .values_list("suggested_user_id", "mutual_count")
+        )
+
+    def test_refresh_ranks_and_excludes(self):
+        me, a, b, c, d, e = self.users
+
+        call_command("refresh_friend_suggestions", stdout=StringIO())
+
+        self.assertEqual(self.suggestions(me), [(c.pk, 2), (e.pk, 1)])
+        self.assertFalse(SuggestionRefresh.objects.exists())
+
+    def test_friendship_change_queues_refresh(self):
+        me, a, b, c, d, e = self.users
+        call_command("refresh_friend_suggestions", stdout=StringIO())
+
+        FriendshipRequest.objects.create(from_user=me, to_user=c).accept()
+        call_command("run_outbox_worker", stdout=StringIO())
+
+        self.assertTrue(SuggestionRefresh.objects.filter(user=a).exists())
+        call_command("refresh_friend_suggestions", stdout=StringIO())
+        self.assertEqual(self.suggestions(me), [(e.pk, 1)])
+        self.assertEqual(self.suggestions(c), [(d.pk, 2), (e.pk, 1)])
+
+    def test_friends_of_friends_endpoint(self):
+        me, a, b, c, d, e = self.users
+        call_command("refresh_friend_suggestions", stdout=StringIO())
+        client = APIClient()
+        client.force_authenticate(me)
+
+        response = client.get("/api/v1/friends/friends-of-friends")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["suggested_user_info"]["id"], row["mutual_count"]) for row in response.data["results"]],
+            [(c.pk, 2), (e.pk, 1)],
+        )
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create(username="keyset", email="keyset@example.com")
+        self.friends = []
+        created_at = timezone.now()
+        for i in range(5):
+            friend = UserModel.objects.create(username=f"keyset{i}", email=f"keyset{i}@example.com")
+            # Two rows share a timestamp so the id tiebreaker is exercised.
+            Friend.objects.create(to_user=self.user, from_user=friend, created_at=created_at - timezone.timedelta(
+                seconds=i // 2))
+            self.friends.append(friend)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_follow_created_at_and_id(self):
+        seen = []
+        url = "/api/v1/friends/friends-list?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            seen.extend(row["from_user_info"]["id"] for row in response.data["results"])
+            url = response.data["next"]
+
+        expected = list(
+            Friend.objects.friendships(self.user).values_list("from_user_id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 5)
+
+    def test_deep_page_costs_the_same(self):
+        with CaptureQueriesContext(connection) as first_page:
+            first = self.client.get("/api/v1/friends/friends-list?page_size=2")
+        with CaptureQueriesContext(connection) as next_page:
+            self.client.get(first.data["next"])
+
+        self.assertEqual(len(first_page), len(next_page))
+        self.assertNotIn("OFFSET", next_page.captured_queries[0]["sql"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/v1/friends/friends-list", {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_returns_every_row(self):
+        paged = []
+        url = "/api/v1/friends/friends-list?page_size=2"
+        while url:
+            response = self.client.get(url)
+            paged.extend(response.json()["results"])
+            url = response.data["next"]
+
+        # The graph version and a single server-side cursor however many chunks are read
+        with patch.object(FriendListView, "stream_chunk_size", 2), self.assertNumQueries(2):
+            response = self.client.get("/api/v1/friends/friends-list", {"stream": "true"})
+            streamed = json.loads(b"".join(response.streaming_content))
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(streamed, paged)
+
+    def test_stream_requests(self):
+        FriendshipRequest.objects.create(from_user=self.friends[0], to_user=self.friends[1], message="hello")
+        self.client.force_authenticate(self.friends[1])
+        response = self.client.get("/api/v1/friends/friends-requests?stream=1")
+
+        self.assertEqual(
+            [row["from_user_info"]["username"] for row in json.loads(b"".join(response.streaming_content))],
+            ["keyset0"],
+        )
+
+    def test_manager_methods_are_lazy(self):
+        with self.assertNumQueries(0):
+            Friend.objects.friends(self.user)
+            Friend.objects.requests(self.user)
+            Friend.objects.unread_requests(self.user)
+
+
+class BulkFriendshipTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create(username="bulk", email="bulk@example.com")
+        self.others = [
+            UserModel.objects.create(username=f"bulk{i}", email=f"bulk{i}@example.com") for i in range(8)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_send_statuses(self):
+        friend, requested, requester = self.others[:3]
+        FriendshipRequest.objects.create(from_user=self.user, to_user=friend).accept()
+        FriendshipRequest.objects.create(from_user=self.user, to_user=requested)
+        FriendshipRequest.objects.create(from_user=requester, to_user=self.user)
+
+        response = self.client.post("/api/v1/friends/bulk-send-friends-requests", {
+            "usernames": ["bulk0", "bulk1", "bulk2", "bulk3", "bulk3", "bulk", "nobody"],
+        }, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], [
+            {"username": "bulk0", "status": "already_friends"},
+            {"username": "bulk1", "status": "already_requested"},
+            {"username": "bulk2", "status": "request_received"},
+            {"username": "bulk3", "status": "sent"},
+            {"username": "bulk", "status": "self"},
+            {"username": "nobody", "status": "not_found"},
+        ])
+        self.assertTrue(FriendshipRequest.objects.filter(from_user=self.user, to_user=self.others[3]).exists())
+
+    def test_bulk_send_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small:
+            Friend.objects.add_friends(self.user, ["bulk0", "bulk1"])
+        with CaptureQueriesContext(connection) as large:
+            Friend.objects.add_friends(self.user, [other.username for other in self.others[2:]])
+
+        self.assertEqual(len(small), len(large))
+
+    def test_bulk_send_settles_concurrent_requests(self):
+        racer = self.others[1]
+        FriendshipRequest.objects.create(from_user=racer, to_user=self.user)
+        filter_requests = FriendshipRequest.objects.filter
+        calls = []
+
+        def stale_filter(*args, **kwargs):
+            # The pending requests were read before the other user's request was committed
+            calls.append(args)
+            return FriendshipRequest.objects.none() if len(calls) == 1 else filter_requests(*args, **kwargs)
+
+        with patch.object(FriendshipRequest.objects, "filter", side_effect=stale_filter):
+            results = Friend.objects.add_friends(self.user, ["bulk0", "bulk1"])
+
+        self.assertEqual(results, [
+            {"username": "bulk0", "status": "sent"},
+            {"username": "bulk1", "status": "request_received"},
+        ])
+        self.assertTrue(FriendshipRequest.objects.filter(from_user=self.user, to_user=self.others[0]).exists())
+        self.assertFalse(FriendshipRequest.objects.filter(from_user=self.user, to_user=racer).exists())
+
+    def test_bulk_accept_and_reject(self):
+        for other in self.others[:4]:
+            FriendshipRequest.objects.create(from_user=other, to_user=self.user)
+
+        with CaptureQueriesContext(connection) as accept_queries:
+            accepted = Friend.objects.accept_requests(self.user, ["bulk0", "bulk1", "bulk5"])
+        rejected = Friend.objects.reject_requests(self.user, ["bulk2", "bulk2", "nobody"])
+
+        self.assertEqual([item["status"] for item in accepted], ["accepted", "accepted", "no_request"])
+        self.assertEqual([item["status"] for item in rejected], ["rejected", "not_found"])
+        self.assertTrue(Friend.objects.are_friends(self.user, self.others[0]))
+        self.assertTrue(Friend.objects.are_friends(self.others[1], self.user))
+        self.assertFalse(FriendshipRequest.objects.filter(to_user=self.user, from_user__in=self.others[:2]).exists())
+        self.assertIsNotNone(FriendshipRequest.objects.get(to_user=self.user, from_user=self.others[2]).rejected)
+        self.assertEqual(
+            [item["status"] for item in Friend.objects.reject_requests(self.user, ["bulk2"])], ["already_rejected"]
+        )
+
+        with CaptureQueriesContext(connection) as single_queries:
+            Friend.objects.accept_requests(self.user, ["bulk3"])
+        self.assertEqual(len(accept_queries), len(single_queries))
+
+
+class AddFriendTest(TestCase):
+    def setUp(self):
+        self.user1 = UserModel.objects.create(username="add1", email="add1@example.com")
+        self.user2 = UserModel.objects.create(username="add2", email="add2@example.com")
+
+    def test_single_statement(self):
+        # The INSERT itself plus the outbox event and the counters, inside a savepoint.
+        with self.assertNumQueries(5):
+            request = Friend.objects.add_friend(self.user1, self.user2, message="Hello")
+
+        request.refresh_from_db()
+        self.assertEqual(request.message, "Hello")
+        self.assertEqual((request.from_user_id, request.to_user_id), (self.user1.pk, self.user2.pk))
+
+    def test_duplicate_request(self):
+        Friend.objects.add_friend(self.user1, self.user2)
+
+        with self.assertRaisesMessage(AlreadyExistsError, "You already requested friendship from this user."):
+            Friend.objects.add_friend(self.user1, self.user2)
+        with self.assertRaisesMessage(AlreadyExistsError, "This user already requested friendship from you."):
+            Friend.objects.add_friend(self.user2, self.user1)
+
+    def test_already_friends(self):
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2).accept()
+
+        with self.assertRaises(AlreadyFriendsError):
+            Friend.objects.add_friend(self.user2, self.user1)
+
+    def test_reverse_pair_is_unique(self):
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FriendshipRequest.objects.create(from_user=self.user2, to_user=self.user1)
+
+
+class PartitioningTest(TestCase):
+    def setUp(self):
+        self.users = UserModel.objects.bulk_create([
+            UserModel(username=f"part{i}", email=f"part{i}@example.com") for i in range(6)
+        ])
+        for user in self.users[1:]:
+            Friend.objects.bulk_create([
+                Friend(to_user=self.users[0], from_user=user), Friend(to_user=user, from_user=self.users[0]),
+            ])
+        self.request = FriendshipRequest.objects.create(from_user=self.users[1], to_user=self.users[2])
+
+    def partitioned_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT partrelid::regclass::text FROM pg_partitioned_table ORDER BY 1")
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_names(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s ORDER BY 1", [table])
+            return [row[0] for row in cursor.fetchall()]
+
+    def scanned_partitions(self, function, *args):
+        with CaptureQueriesContext(connection) as queries:
+            result = function(*args)
+            if hasattr(result, "query"):
+                list(result)
+        scanned = set()
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query["sql"].startswith(("SELECT", "UPDATE", "DELETE")):
+                    cursor.execute(f"EXPLAIN {query['sql']}")
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                    scanned.update(re.findall(r"friends_(?:friend|friendshiprequest)_p\d+", plan))
+        return scanned
+
+    def test_tables_are_partitioned(self):
+        self.assertEqual(self.partitioned_tables(), ["friends_friend", "friends_friendshiprequest"])
+
+    def test_single_user_statements_touch_one_partition(self):
+        user = self.users[0]
+        for function, args in (
+            (Friend.objects.friends, [user]),
+            (Friend.objects.friendships, [user]),
+            (Friend.objects.requests, [self.users[2]]),
+            (self.request.mark_viewed, []),
+            (self.request.cancel, []),
+        ):
+            with self.subTest(function=function.__name__):
+                self.assertEqual(len(self.scanned_partitions(function, *args)), 1)
+
+    def test_rebuild_keeps_rows_and_names(self):
+        rows = sorted(Friend.objects.values_list("id", "to_user_id", "from_user_id"))
+        indexes = self.index_names("friends_friend")
+
+        rebuild_table(connection, "friends_friend", "to_user_id", 0, batch_size=3)
+        self.assertEqual(self.partitioned_tables(), ["friends_friendshiprequest"])
+        self.assertEqual(sorted(Friend.objects.values_list("id", "to_user_id", "from_user_id")), rows)
+
+        rebuild_table(connection, "friends_friend", "to_user_id", 4, batch_size=3)
+        self.assertEqual(self.partitioned_tables(), ["friends_friend", "friends_friendshiprequest"])
+        self.assertEqual(sorted(Friend.objects.values_list("id", "to_user_id", "from_user_id")), rows)
+        self.assertEqual(self.index_names("friends_friend"), indexes)
+
+        created = Friend.objects.create(to_user=self.users[1], from_user=self.users[2])
+        self.assertGreater(created.pk, rows[-1][0])
+
+
+@override_settings(FRIENDS_STORAGE="canonical")
+class CanonicalStorageTest(TestCase):
+    def setUp(self):
+        get_friend_id_cache().clear()
+        self.addCleanup(get_friend_id_cache().clear)
+        self.alice, self.bob, self.carol = [
+            UserModel.objects.create(username=f"canon_{name}", email=f"canon_{name}@example.com")
+            for name in ("alice", "bob", "carol")
+        ]
+        Friend.objects.add_friend(self.bob, self.alice).accept()
+        Friend.objects.add_friend(self.bob, self.carol)
+        Friend.objects.accept_requests(self.carol, ["canon_bob"])
+
+    def stored_pairs(self):
+        return sorted(Friend.objects.values_list("to_user_id", "from_user_id"))
+
+    def test_one_row_per_friendship(self):
+        self.assertEqual(self.stored_pairs(), [(self.alice.pk, self.bob.pk), (self.bob.pk, self.carol.pk)])
+        with self.assertRaises(AlreadyFriendsError):
+            Friend.objects.add_friend(self.alice, self.bob)
+
+    def test_reads_see_both_sides(self):
+        self.assertEqual(Friend.objects.friend_ids(self.bob), (self.alice.pk, self.carol.pk))
+        self.assertEqual(Friend.objects.friend_ids(self.alice), (self.bob.pk,))
+        self.assertEqual(list(Friend.objects.friends(self.carol)), [self.bob])
+        self.assertEqual(Friend.objects.friend_count(self.bob), 2)
+        self.assertTrue(Friend.objects.are_friends(self.carol, self.bob))
+        self.assertEqual(Friend.objects.relationship_statuses(self.alice, [self.bob.pk, self.carol.pk]), {
+            self.bob.pk: RelationshipStatus.FRIENDS, self.carol.pk: RelationshipStatus.NONE,
+        })
+        self.assertEqual(mutual_friends.count(self.alice, self.carol), 1)
+        self.assertEqual(actual_counts([self.bob.pk])[self.bob.pk]["friend_count"], 2)
+
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.get("/api/v1/friends/friends-list")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["from_user_info"]["username"] for item in response.data["results"]], ["canon_bob"])
+
+    def test_remove_deletes_the_row(self):
+        self.assertTrue(Friend.objects.remove_friend(self.carol, self.bob))
+
+        self.assertEqual(self.stored_pairs(), [(self.alice.pk, self.bob.pk)])
+        self.assertEqual(Friend.objects.friend_ids(self.bob), (self.alice.pk,))
+        self.assertEqual(ProfileModel.objects.get(user=self.carol).friend_count, 0)
+
+    def test_refresh_all_suggestions_queues_both_sides(self):
+        # canon_carol is only ever stored as the higher id of a friendship
+        with patch("friends.management.commands.refresh_friend_suggestions.mark_stale") as mark_stale:
+            call_command("refresh_friend_suggestions", "--all", stdout=StringIO())
+
+        queued = {user_id for call in mark_stale.call_args_list for user_id in call.args[0]}
+        self.assertEqual(queued, {self.alice.pk, self.bob.pk, self.carol.pk})
+
+    def test_import_request_between_friends(self):
+        # From the higher id to the lower one, the other way round from the stored row
+        for use_copy in (connection.vendor == "postgresql", False):
+            data = StringIO(f"from_user_id,to_user_id\n{self.bob.pk},{self.alice.pk}\n")
+            summary = import_graph("requests", data, "csv", use_copy=use_copy)
+
+            self.assertEqual((summary["inserted"], summary["existing"]), (0, 1))
+            self.assertFalse(FriendshipRequest.objects.filter(to_user=self.alice).exists())
+
+    def test_convert_storage(self):
+        call_command("convert_friend_storage", "directed", stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(len(self.stored_pairs()), 4)
+
+        # A single row stored the other way round is flipped rather than dropped
+        Friend.objects.filter(to_user=self.alice, from_user=self.bob).delete()
+        out = StringIO()
+        call_command("convert_friend_storage", "canonical", batch_size=1, stdout=out)
+
+        self.assertEqual(self.stored_pairs(), [(self.alice.pk, self.bob.pk), (self.bob.pk, self.carol.pk)])
+        self.assertIn("2 rows deleted or flipped", out.getvalue())
+
+
+class DegreesOfSeparationTest(TestCase):
+    def setUp(self):
+        get_friend_id_cache().clear()
+        self.addCleanup(get_friend_id_cache().clear)
+        self.users = [
+            UserModel.objects.create(username=f"path{index}", email=f"path{index}@example.com") for index in range(8)
+        ]
+        self.ids = [user.pk for user in self.users]
+        # path0 - path1 - path2 - path3 - path4, path1 - path5 - path3, path6 alone, path7 only knows path4
+        for left, right in ((0, 1), (1, 2), (2, 3), (3, 4), (1, 5), (5, 3), (7, 4)):
+            FriendshipRequest.objects.create(from_user=self.users[left], to_user=self.users[right]).accept()
+
+    def test_shortest_path(self):
+        search = friend_paths.search(self.ids[0], self.ids[4])
+        self.assertTrue(search.complete)
+        self.assertEqual(len(search.path), 5)
+        self.assertEqual(search.path[:2] + search.path[3:], [self.ids[index] for index in (0, 1, 3, 4)])
+        self.assertIn(search.path[2], (self.ids[2], self.ids[5]))
+
+        self.assertEqual(friend_paths.search(self.ids[7], self.ids[7]), PathSearch([self.ids[7]], True))
+        self.assertEqual(friend_paths.search(self.ids[4], self.ids[7]), PathSearch([self.ids[4], self.ids[7]], True))
+
+    def test_not_connected(self):
+        self.assertEqual(friend_paths.search(self.ids[0], self.ids[6]), PathSearch(None, True))
+
+    def test_limits(self):
+        self.assertEqual(friend_paths.search(self.ids[0], self.ids[4], max_depth=3), PathSearch(None, False))
+        self.assertEqual(friend_paths.search(self.ids[0], self.ids[4], max_frontier=1), PathSearch(None, False))
+        with override_settings(FRIENDS_PATH_MAX_DEPTH=2):
+            self.assertEqual(friend_paths.search(self.ids[0], self.ids[4], max_depth=10), PathSearch(None, False))
+
+    def test_one_query_per_level(self):
+        # Five levels for a path of five friendships
+        with self.assertNumQueries(5):
+            friend_paths.search(self.ids[0], self.ids[7])
+        with self.assertNumQueries(0):
+            friend_paths.search(self.ids[0], self.ids[7])
+
+    def test_api(self):
+        response = APIClient().get("/api/v1/friends/degrees-of-separation/path0/path7")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], "connected")
+        self.assertEqual(response.data["degrees"], 5)
+        self.assertEqual(response.data["connected_through"], 4)
+        self.assertEqual([user["username"] for user in response.data["path"]][-2:], ["path4", "path7"])
+
+        response = APIClient().get("/api/v1/friends/degrees-of-separation/path0/path7", {"max_depth": 4})
+        self.assertEqual((response.data["status"], response.data["path"]), ("too_far", []))
+
+        response = APIClient().get("/api/v1/friends/degrees-of-separation/path0/path6")
+        self.assertEqual(response.data["status"], "not_connected")
+
+        response = APIClient().get("/api/v1/friends/degrees-of-separation/path0/nobody")
+        self.assertEqual(response.status_code, 400)
+
+
+class GraphSnapshotTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "friends.csr")
+        self.alice, self.bob, self.carol, self.dave = [
+            UserModel.objects.create(username=f"csr_{name}", email=f"csr_{name}@example.com")
+            for name in ("alice", "bob", "carol", "dave")
+        ]
+        for from_user, to_user in ((self.alice, self.bob), (self.alice, self.carol), (self.bob, self.carol)):
+            FriendshipRequest.objects.create(from_user=from_user, to_user=to_user).accept()
+        # Changed long before the snapshot, so no user starts in the overlay
+        ProfileModel.objects.update(graph_changed_at=timezone.now() - timedelta(days=1))
+
+    def test_write_and_read(self):
+        self.assertEqual(write_snapshot(self.path, chunk_size=2), (self.dave.pk + 1, 6))
+
+        snapshot = GraphSnapshot(self.path)
+        self.assertEqual(snapshot.friend_ids(self.alice.pk), (self.bob.pk, self.carol.pk))
+        self.assertEqual(snapshot.friend_ids(self.carol.pk), (self.alice.pk, self.bob.pk))
+        self.assertEqual(snapshot.friend_ids(self.dave.pk), ())
+        self.assertEqual(snapshot.friend_ids(self.dave.pk + 1), ())
+
+    def test_backend_reads_the_snapshot(self):
+        write_snapshot(self.path)
+        cache = FriendIdCache(SnapshotBackend(self.path, refresh_interval=3600))
+
+        # Only the poll for changed users
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_many([self.alice.pk, self.dave.pk]), {
+                self.alice.pk: (self.bob.pk, self.carol.pk), self.dave.pk: (),
+            })
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(self.bob.pk), (self.alice.pk, self.carol.pk))
+            self.assertEqual(MutualFriendsEngine(cache).count(self.alice, self.bob), 1)
+
+    def test_overlay_reads_changed_users(self):
+        write_snapshot(self.path)
+        # Another worker, which is not told about this process' invalidations
+        cache = FriendIdCache(SnapshotBackend(self.path, refresh_interval=0))
+        self.assertEqual(cache.get(self.carol.pk), (self.alice.pk, self.bob.pk))
+
+        FriendshipRequest.objects.create(from_user=self.dave, to_user=self.carol).accept()
+        erin = UserModel.objects.create(username="csr_erin", email="csr_erin@example.com")
+
+        self.assertEqual(cache.get(self.carol.pk), (self.alice.pk, self.bob.pk, self.dave.pk))
+        self.assertEqual(cache.get(self.dave.pk), (self.carol.pk,))
+        self.assertEqual(cache.get(erin.pk), ())
+
+    def test_rebuilt_snapshot_is_picked_up(self):
+        write_snapshot(self.path)
+        cache = FriendIdCache(SnapshotBackend(self.path, refresh_interval=0))
+        self.assertEqual(cache.get(self.dave.pk), ())
+
+        # Bulk writes bypass the receivers, so only a rebuild shows them
+        Friend.objects.bulk_create([
+            Friend(to_user_id=to_user_id, from_user_id=from_user_id)
+            for to_user_id, from_user_id in friendship_pairs(self.alice.pk, self.dave.pk)
+        ])
+        self.assertEqual(cache.get(self.dave.pk), ())
+
+        out = StringIO()
+        call_command("build_friend_snapshot", path=self.path, stdout=out)
+
+        self.assertIn("Wrote 8 friend ids", out.getvalue())
+        self.assertEqual(cache.get(self.dave.pk), (self.alice.pk,))
+
+    def test_without_snapshot(self):
+        cache = FriendIdCache(SnapshotBackend(self.path))
+
+        self.assertEqual(cache.get(self.alice.pk), (self.bob.pk, self.carol.pk))
+
+
+class RelationshipStatusTest(TestCase):
+    def setUp(self):
+        self.viewer = UserModel.objects.create(username="viewer", email="viewer@example.com")
+        self.friend, self.sent, self.received, self.rejected, self.stranger = [
+            UserModel.objects.create(username=name, email=f"{name}@example.com")
+            for name in ("status_friend", "status_sent", "status_received", "status_rejected", "status_stranger")
+        ]
+        FriendshipRequest.objects.create(from_user=self.viewer, to_user=self.friend).accept()
+        FriendshipRequest.objects.create(from_user=self.viewer, to_user=self.sent)
+        FriendshipRequest.objects.create(from_user=self.received, to_user=self.viewer)
+        FriendshipRequest.objects.create(from_user=self.rejected, to_user=self.viewer).reject()
+
+    def test_batch_statuses_in_three_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        usernames = "status_friend,status_sent,status_received,status_rejected,status_stranger,nobody"
+
+        with self.assertNumQueries(3):
+            response = client.get("/api/v1/friends/friend-ship-statuses", {"usernames": usernames})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["status"] for item in response.data["results"]], [
+            "friends", "request_sent", "request_received", "rejected", "none", "not_found",
+        ])
+
+    def test_requires_usernames(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+
+        response = client.get("/api/v1/friends/friend-ship-statuses")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class FriendCounterTest(TestCase):
+    def setUp(self):
+        self.user1 = UserModel.objects.create(username="counter1", email="counter1@example.com")
+        self.user2 = UserModel.objects.create(username="counter2", email="counter2@example.com")
+        self.user3 = UserModel.objects.create(username="counter3", email="counter3@example.com")
+
+    def counters(self, user):
+        return ProfileModel.objects.values_list(
+            "friend_count", "pending_request_count", "unread_request_count"
+        ).get(user=user)
+
+    def test_request_lifecycle(self):
+        request = Friend.objects.add_friend(self.user1, self.user2)
+        self.assertEqual(self.counters(self.user2), (0, 1, 1))
+
+        request.mark_viewed()
+        request.mark_viewed()
+        self.assertEqual(self.counters(self.user2), (0, 1, 0))
+
+        request.accept()
+        self.assertEqual(self.counters(self.user1), (1, 0, 0))
+        self.assertEqual(self.counters(self.user2), (1, 0, 0))
+        self.assertEqual(Friend.objects.friend_count(self.user1), 1)
+
+        Friend.objects.remove_friend(self.user1, self.user2)
+        self.assertEqual(self.counters(self.user1), (0, 0, 0))
+        self.assertEqual(self.counters(self.user2), (0, 0, 0))
+
+    def test_reject_and_cancel(self):
+        Friend.objects.add_friend(self.user1, self.user3).reject()
+        self.assertEqual(self.counters(self.user3), (0, 0, 1))
+        self.assertEqual(Friend.objects.unread_request_count(self.user3), 1)
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user3), 0)
+
+        Friend.objects.add_friend(self.user2, self.user3).cancel()
+        self.assertEqual(self.counters(self.user3), (0, 0, 1))
+
+    def test_bulk_paths(self):
+        Friend.objects.add_friends(self.user1, ["counter2", "counter3"])
+        self.assertEqual(self.counters(self.user2), (0, 1, 1))
+
+        Friend.objects.accept_requests(self.user2, ["counter1"])
+        Friend.objects.reject_requests(self.user3, ["counter1"])
+
+        self.assertEqual(self.counters(self.user1), (1, 0, 0))
+        self.assertEqual(self.counters(self.user2), (1, 0, 0))
+        self.assertEqual(self.counters(self.user3), (0, 0, 1))
+
+    def test_bulk_accept_between_friends(self):
+        Friend.objects.add_friend(self.user1, self.user2).accept()
+        # Left over from before the users became friends
+        FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2)
+        ProfileModel.objects.filter(user=self.user2).update(pending_request_count=1, unread_request_count=1)
+
+        results = Friend.objects.accept_requests(self.user2, ["counter1"])
+
+        self.assertEqual(results, [{"username": "counter1", "status": "already_friends"}])
+        self.assertFalse(FriendshipRequest.objects.exists())
+        self.assertEqual(self.counters(self.user1), (1, 0, 0))
+        self.assertEqual(self.counters(self.user2), (1, 0, 0))
+
+    @skipUnless(connection.vendor == "postgresql", "Requests in both directions are kept apart by a trigger")
+    def test_accept_drops_reverse_request_counts(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE friends_friendshiprequest DISABLE TRIGGER request_user_pair_check")
+        for accept in (
+            lambda request: request.accept(),
+            lambda request: Friend.objects.accept_requests(request.to_user, [request.from_user.username]),
+        ):
+            with self.subTest():
+                Friend.objects.remove_friend(self.user1, self.user2)
+                request = Friend.objects.add_friend(self.user1, self.user2)
+                # Left over from before the pair was unique
+                FriendshipRequest.objects.create(from_user=self.user2, to_user=self.user1)
+                ProfileModel.objects.filter(user=self.user1).update(pending_request_count=1, unread_request_count=1)
+
+                accept(request)
+
+                self.assertFalse(FriendshipRequest.objects.filter(to_user=self.user1).exists())
+                self.assertEqual(self.counters(self.user1), (1, 0, 0))
+                self.assertEqual(self.counters(self.user2), (1, 0, 0))
+
+    @skipUnless(connection.vendor == "postgresql", "Requests in both directions are kept apart by a trigger")
+    def test_pair_migration_accepts_mutual_requests(self):
+        from django.apps import apps
+        from importlib import import_module
+        migration = import_module("friends.migrations.0006_friendshiprequest_user_pair_uniq")
+
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE friends_friendshiprequest DISABLE TRIGGER request_user_pair_check")
+        request = FriendshipRequest.objects.create(from_user=self.user1, to_user=self.user2)
+        reverse = FriendshipRequest.objects.create(from_user=self.user2, to_user=self.user1, viewed=timezone.now())
+        Friend.objects.add_friend(self.user3, self.user1)
+        ProfileModel.objects.filter(user=self.user1).update(pending_request_count=2, unread_request_count=1)
+        ProfileModel.objects.filter(user=self.user2).update(pending_request_count=1, unread_request_count=1)
+
+        with self.assertLogs(migration.logger) as logs:
+            migration.accept_mutual_requests(apps, connection.schema_editor())
+
+        self.assertTrue(Friend.objects.are_friends(self.user1, self.user2))
+        self.assertEqual(list(FriendshipRequest.objects.values_list("from_user", flat=True)), [self.user3.pk])
+        self.assertEqual(self.counters(self.user1), (1, 1, 1))
+        self.assertEqual(self.counters(self.user2), (1, 0, 0))
+        self.assertIn(f"deleting requests {request.pk}, {reverse.pk}", logs.output[0])
+
+    def test_reconcile_repairs_drift(self):
+        Friend.objects.create(to_user=self.user1, from_user=self.user2)
+        FriendshipRequest.objects.create(from_user=self.user3, to_user=self.user1)
+        ProfileModel.objects.filter(user=self.user2).update(friend_count=7)
+
+        out = StringIO()
+        call_command("reconcile_friend_counters", batch_size=1, stdout=out)
+
+        self.assertEqual(self.counters(self.user1), (1, 1, 1))
+        self.assertEqual(self.counters(self.user2), (0, 0, 0))
+        self.assertIn("repaired 2", out.getvalue())
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are checked against PostgreSQL")
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.users = [
+            UserModel.objects.create(username=f"outbox{i}", email=f"outbox{i}@example.com") for i in range(4)
+        ]
+        self.delivered = []
+        self.addCleanup(_handlers.pop, "test_event", None)
+
+    def events(self):
+        return list(OutboxEvent.objects.order_by("id").values_list("event", "payload"))
+
+    def test_records_events_with_the_change(self):
+        user1, user2, user3, _ = self.users
+        request = Friend.objects.add_friend(user1, user2)
+        accepted = {"from_user_id": user1.pk, "to_user_id": user2.pk, "request_id": request.pk}
+        request.accept()
+        Friend.objects.remove_friend(user1, user2)
+        request = Friend.objects.add_friend(user3, user1)
+        canceled = {"from_user_id": user3.pk, "to_user_id": user1.pk, "request_id": request.pk}
+        request.cancel()
+
+        self.assertEqual(self.events(), [
+            ("friendship_request_created", accepted),
+            ("friendship_request_accepted", accepted),
+            ("friendship_removed", {"from_user_id": user1.pk, "to_user_id": user2.pk}),
+            ("friendship_request_created", canceled),
+            ("friendship_request_canceled", canceled),
+        ])
+
+    def test_rolled_back_change_records_nothing(self):
+        user1, user2, _, _ = self.users
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Friend.objects.add_friend(user1, user2)
+            raise RuntimeError
+        self.assertEqual(self.events(), [])
+
+    def test_bulk_writes_record_events_in_one_statement(self):
+        user1, user2, user3, user4 = self.users
+        with CaptureQueriesContext(connection) as queries:
+            Friend.objects.add_friends(user1, [user2.username, user3.username, user4.username])
+        self.assertEqual(
+            len([query for query in queries if OutboxEvent._meta.db_table in query["sql"]]), 1
+        )
+        self.assertEqual(OutboxEvent.objects.filter(event="friendship_request_created").count(), 3)
+
+    def test_worker_delivers_in_batches(self):
+        outbox_handler("test_event")(self.delivered.append)
+        OutboxEvent.objects.bulk_create([OutboxEvent(event="test_event", payload={"n": n}) for n in range(5)])
+
+        self.assertEqual(deliver_pending(batch_size=3), (3, 0))
+        self.assertEqual(deliver_pending(batch_size=3), (2, 0))
+        self.assertEqual(deliver_pending(batch_size=3), (0, 0))
+        self.assertEqual(self.delivered, [[{"n": 0}, {"n": 1}, {"n": 2}], [{"n": 3}, {"n": 4}]])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(FRIENDS_OUTBOX_RETRY_DELAY=10)
+    def test_failed_event_is_retried_alone(self):
+        @outbox_handler("test_event")
+        def handler(payloads):
+            if any(payload["n"] == 1 for payload in payloads):
+                raise ValueError("bad event")
+            self.delivered.extend(payload["n"] for payload in payloads)
+
+        OutboxEvent.objects.bulk_create([OutboxEvent(event="test_event", payload={"n": n}) for n in range(3)])
+
+        self.assertEqual(deliver_pending(max_attempts=2), (2, 1))
+        self.assertEqual(self.delivered, [0, 2])
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.attempts, event.last_error, event.failed_at), (1, "ValueError: bad event", None))
+        self.assertGreater(event.available_at, timezone.now() + timezone.timedelta(seconds=5))
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(deliver_pending(max_attempts=2), (0, 1))
+        self.assertIsNotNone(OutboxEvent.objects.get().failed_at)
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        self.assertEqual(requeue_failed(), 1)
+        self.assertEqual(OutboxEvent.objects.get().attempts, 0)
+
+    def test_suggestions_are_queued_by_the_worker(self):
+        user1, user2, _, _ = self.users
+        Friend.objects.add_friend(user1, user2).accept()
+        self.assertFalse(SuggestionRefresh.objects.exists())
+
+        out = StringIO()
+        call_command("run_outbox_worker", stdout=out)
+
+        self.assertIn("2 events delivered, 0 failed", out.getvalue())
+        self.assertEqual(
+            set(SuggestionRefresh.objects.values_list("user_id", flat=True)), {user1.pk, user2.pk}
+        )
+
+
+class FriendEventStreamTestMixin:
+    """ Friendship changes are pushed to the event streams of the users concerned """
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="events", email="events@example.com")
+        self.other = UserModel.objects.create(username="events-other", email="events-other@example.com")
+        self.headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def commit(self, function):
+        raise NotImplementedError
+
+    async def next_event(self, stream):
+        return (await asyncio.wait_for(stream.__anext__(), 5)).decode()
+
+    async def test_stream(self):
+        with self.settings(FRIENDS_NOTIFICATIONS=self.notifications):
+            response = await self.async_client.get("/api/v1/friends/async/events", headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            stream = response.streaming_content
+            self.assertEqual(await self.next_event(stream), "retry: 5000\n\n")
+            self.assertEqual(
+                await self.next_event(stream), 'event: unread_count\ndata: {"unread_request_count":0}\n\n'
+            )
+            await self.listening()
+
+            request = await sync_to_async(self.commit)(lambda: Friend.objects.add_friend(self.other, self.user))
+            self.assertEqual(
+                await self.next_event(stream),
+                f'event: friend_request\ndata: {{"request_id":{request.pk},"from_user_id":{self.other.pk}}}\n\n',
+            )
+            self.assertEqual(
+                await self.next_event(stream), 'event: unread_count\ndata: {"unread_request_count":1}\n\n'
+            )
+
+            await sync_to_async(self.commit)(request.mark_viewed)
+            self.assertEqual(
+                await self.next_event(stream), 'event: unread_count\ndata: {"unread_request_count":0}\n\n'
+            )
+
+            await sync_to_async(self.commit)(request.cancel)
+            self.assertEqual(
+                await self.next_event(stream), 'event: unread_count\ndata: {"unread_request_count":0}\n\n'
+            )
+            request = await sync_to_async(self.commit)(lambda: Friend.objects.add_friend(self.user, self.other))
+            request_id = request.pk
+            await sync_to_async(self.commit)(request.accept)
+            self.assertEqual(
+                await self.next_event(stream),
+                f'event: friend_request_accepted\ndata: {{"request_id":{request_id},"user_id":{self.other.pk}}}\n\n',
+            )
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get("/api/v1/friends/async/events")
+        self.assertEqual(response.status_code, 401)
+
+
+class FriendEventStreamTest(FriendEventStreamTestMixin, TestCase):
+    notifications = {"BACKEND": "friends.notifications.LocalBroker"}
+
+    def commit(self, function):
+        with self.captureOnCommitCallbacks(execute=True):
+            return function()
+
+    async def listening(self):
+        pass
+
+    def test_no_listeners_no_queries(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, self.assertNumQueries(5):
+            Friend.objects.add_friend(self.other, self.user)
+        self.assertEqual(len(callbacks), 1)
+
+    async def test_slow_client_keeps_latest_events(self):
+        with self.settings(FRIENDS_NOTIFICATIONS={"BACKEND": "friends.notifications.LocalBroker",
+                                                  "OPTIONS": {"max_queued": 2}}):
+            broker = get_broker()
+            subscription = broker.subscribe(self.user.pk)
+            self.assertEqual(broker.listeners([self.user.pk, self.other.pk]), {self.user.pk})
+            broker.publish([(self.user.pk, {"event": "test", "data": n}) for n in range(3)])
+            self.assertEqual([(await subscription.get(1))["data"] for _ in range(2)], [1, 2])
+            subscription.close()
+            self.assertEqual(broker.listeners([self.user.pk]), set())
+
+
+class PostgresFriendEventStreamTest(FriendEventStreamTestMixin, TransactionTestCase):
+    """ Events go through NOTIFY, so the changes must be committed """
+    notifications = {"BACKEND": "friends.notifications.PostgresBroker", "OPTIONS": {"channel": "friends_test_events"}}
+
+    def commit(self, function):
+        return function()
+
+    async def listening(self):
+        self.assertTrue(await sync_to_async(get_broker().listening.wait, thread_sensitive=False)(5))
+
+
+@skipUnless(connection.vendor == "postgresql", "LISTEN is PostgreSQL only")
+class PostgresBrokerPoolTest(TestCase):
+    def setUp(self):
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            "ENGINE": "utils.db.backends.postgresql_pool",
+            "POOL": {"MIN_SIZE": 0, "MAX_SIZE": 1},
+        }, "pooled")
+        self.addCleanup(close_pools, lambda key: key.startswith("pooled:"))
+        self.addCleanup(self.wrapper.close)
+        self.user = UserModel.objects.create(username="listener", email="listener@example.com")
+
+    async def test_listener_stays_out_of_the_pool(self):
+        broker = PostgresBroker(channel="friends_pool_test", alias="pooled")
+        self.addCleanup(broker.stop)
+        with patch("friends.notifications.connections", {"pooled": self.wrapper}):
+            subscription = broker.subscribe(self.user.pk)
+            self.assertTrue(await sync_to_async(broker.listening.wait, thread_sensitive=False)(5))
+
+            # The only connection of the pool is still free to publish with
+            await sync_to_async(broker.publish)([(self.user.pk, {"event": "ping"})])
+            self.assertEqual(await subscription.get(5), {"event": "ping"})
+
+        [stats] = [stats for key, stats in pool_stats().items() if key.startswith("pooled:")]
+        self.assertEqual((stats["checkouts"], stats["timeouts"]), (1, 0))
+
+
+class GraphVersionTest(TestCase):
+    def setUp(self):
+        self.user, self.other, self.friend, self.stranger = [
+            UserModel.objects.create(username=f"version{i}", email=f"version{i}@example.com") for i in range(4)
+        ]
+        for user in (self.user, self.other):
+            Friend.objects.add_friend(user, self.friend).accept()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response["ETag"]
+
+    def assertNotModified(self, url, etag):
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_not_modified_until_the_graph_changes(self):
+        url = "/api/v1/friends/friends-list"
+        etag = self.etag(url)
+        self.assertNotModified(url, etag)
+
+        Friend.objects.add_friend(self.other, self.stranger).accept()
+        self.assertNotModified(url, etag)
+
+        request = Friend.objects.add_friend(self.stranger, self.user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.etag(url)
+        request.reject()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_other_users_graph(self):
+        url = f"/api/v1/friends/mutual-friends/{self.other.username}"
+        etag = self.etag(url)
+        self.assertNotModified(url, etag)
+        Friend.objects.add_friend(self.other, self.stranger)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.client.force_authenticate(None)
+        url = f"/api/v1/friends/friend-ship-status/{self.user.username}/{self.stranger.username}"
+        etag = self.etag(url)
+        self.assertNotModified(url, etag)
+        Friend.objects.remove_friend(self.user, self.friend)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_suggestions_refresh_changes_version(self):
+        url = "/api/v1/friends/friends-of-friends"
+        call_command("run_outbox_worker", stdout=StringIO())
+        call_command("refresh_friend_suggestions", stdout=StringIO())
+        etag = self.etag(url)
+        self.assertNotModified(url, etag)
+        call_command("refresh_friend_suggestions", "--all", stdout=StringIO())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        url = "/api/v1/friends/friends-requests"
+        last_modified = self.client.get(url)["Last-Modified"]
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_unknown_user_has_no_version(self):
+        response = self.client.get("/api/v1/friends/mutual-friends/missing")
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("ETag", response)
+
+
+class GraphGeneratorTest(TestCase):
+    def test_generated_graph_is_consistent(self):
+        summary = generate_graph(users=50, edges=200, pending_ratio=0.2, seed=1, batch_size=30)
+
+        self.assertEqual(UserModel.objects.filter(username__startswith="graph").count(), 50)
+        self.assertEqual(Friend.objects.count(), summary["friendships"] * 2)
+        self.assertEqual(FriendshipRequest.objects.count(), summary["pending_requests"])
+        counts = actual_counts(summary["user_ids"])
+        for profile in ProfileModel.objects.filter(user_id__in=summary["user_ids"]):
+            self.assertEqual(
+                (profile.friend_count, profile.pending_request_count, profile.unread_request_count),
+                tuple(counts[profile.user_id].values()),
+            )
+
+
+class GraphImportExportTest(TestCase):
+    def setUp(self):
+        self.users = [
+            UserModel.objects.create(username=f"io{i}", email=f"io{i}@example.com") for i in range(4)
+        ]
+        self.ids = [user.pk for user in self.users]
+
+    def counters(self, user_id):
+        return ProfileModel.objects.values_list(
+            "friend_count", "pending_request_count", "unread_request_count"
+        ).get(user_id=user_id)
+
+    def import_friends(self, use_copy):
+        a, b, c, d = self.ids
+        Friend.objects.add_friend(self.users[0], self.users[1])
+        self.users[2].friends.create(from_user=self.users[3])
+        self.users[3].friends.create(from_user=self.users[2])
+        data = StringIO(
+            "to_user_id,from_user_id,created_at\n"
+            f"{a},{b},2023-01-02T03:04:05Z\n"
+            f"{b},{a},\n"
+            f"{a},{a},\n"
+            f"{a},999999,\n"
+            f"{c},{d},\n"
+            f"{a},{c},\n"
+        )
+        summary = import_graph("friends", data, "csv", chunk_size=2, use_copy=use_copy)
+
+        self.assertEqual(summary["records"], 6)
+        self.assertEqual(summary["inserted"], 2)
+        self.assertEqual(summary["self"], 1)
+        self.assertEqual(summary["unknown_users"], 1)
+        self.assertEqual(summary["existing"], 1)
+        self.assertTrue(Friend.objects.are_friends(self.users[0], self.users[1]))
+        self.assertTrue(Friend.objects.are_friends(self.users[2], self.users[0]))
+        self.assertEqual(Friend.objects.get(to_user_id=b, from_user_id=a).created_at.year, 2023)
+        self.assertFalse(FriendshipRequest.objects.exists())
+        self.assertEqual(self.counters(a), (2, 0, 0))
+        self.assertEqual(self.counters(b), (1, 0, 0))
+        self.assertTrue(SuggestionRefresh.objects.filter(user_id=a).exists())
+        return summary
+
+    def test_import_friends_with_copy(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("COPY requires PostgreSQL")
+        # The reverse of the first pair is a duplicate within the file.
+        self.assertEqual(self.import_friends(use_copy=True)["duplicates"], 1)
+
+    def test_import_friends_in_chunks(self):
+        # With chunks of two records, the reverse pair lands in the same chunk as the first one.
+        self.assertEqual(self.import_friends(use_copy=False)["duplicates"], 1)
+
+    def import_requests(self, use_copy):
+        a, b, c, d = self.ids
+        self.users[2].friends.create(from_user=self.users[3])
+        self.users[3].friends.create(from_user=self.users[2])
+        data = StringIO("".join(line + "\n" for line in [
+            f'{{"from_user_id": {a}, "to_user_id": {b}, "message": "hi"}}',
+            f'{{"from_user_id": {b}, "to_user_id": {a}}}',
+            f'{{"from_user_id": {c}, "to_user_id": {d}}}',
+            f'{{"from_user_id": {d}, "to_user_id": {a}, "viewed": "2023-01-02T03:04:05+00:00"}}',
+        ]))
+        summary = import_graph("requests", data, "jsonl", use_copy=use_copy)
+
+        self.assertEqual(summary, {
+            "records": 4, "inserted": 2, "self": 0, "unknown_users": 0, "duplicates": 1, "existing": 1,
+        })
+        self.assertEqual(FriendshipRequest.objects.get(from_user_id=a).message, "hi")
+        self.assertEqual(self.counters(a), (0, 1, 0))
+        self.assertEqual(self.counters(b), (0, 1, 1))
+
+    def test_import_requests_with_copy(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("COPY requires PostgreSQL")
+        self.import_requests(use_copy=True)
+
+    def test_import_requests_in_chunks(self):
+        self.import_requests(use_copy=False)
+
+    def test_invalid_record(self):
+        with self.assertRaisesMessage(ValueError, "Record 2: missing from_user_id"):
+            import_graph("friends", StringIO(f"to_user_id,from_user_id\n{self.ids[0]},{self.ids[1]}\n1,\n"))
+
+    def test_export_round_trip(self):
+        Friend.objects.add_friend(self.users[0], self.users[1]).accept()
+        Friend.objects.add_friend(self.users[2], self.users[1]).accept()
+        for use_copy, fmt in ((False, "csv"), (False, "jsonl"), (connection.vendor == "postgresql", "csv")):
+            stream = StringIO()
+            self.assertEqual(export_graph("friends", stream, fmt, use_copy=use_copy), 2)
+            Friend.objects.all().delete()
+            stream.seek(0)
+            self.assertEqual(import_graph("friends", stream, fmt)["inserted"], 2)
+            self.assertEqual(Friend.objects.count(), 4)
+
+    def test_commands(self):
+        Friend.objects.add_friend(self.users[0], self.users[1]).accept()
+        out = StringIO()
+        call_command("export_graph", "friends", "-", stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0], "to_user_id,from_user_id,created_at")
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class ProjectionTest(TestCase):
+    def setUp(self):
+        self.user = UserModel.objects.create(username="projection", email="projection@example.com")
+        self.friends = []
+        for i in range(3):
+            friend = UserModel.objects.create(username=f"projection{i}", email=f"projection{i}@example.com")
+            ProfileModel.objects.filter(user=friend).update(phone=f"555-{i}", city="Zürich", country="CH")
+            Friend.objects.add_friend(self.user, friend).accept()
+            self.friends.append(friend)
+        ProfileModel.objects.filter(user=self.friends[2]).delete()
+        FriendSuggestion.objects.create(user=self.friends[0], suggested_user=self.friends[1], mutual_count=2)
+
+    def assertSameJSON(self, serialized, projected):
+        self.assertEqual(JSONRenderer().render(serialized), JSONRenderer().render(projected))
+
+    def test_user_summary(self):
+        users = UserModel.objects.order_by("id")
+        self.assertSameJSON(
+            UserModelSerializer(users.select_related("profile"), many=True).data,
+            UserSummaryProjection().project(users),
+        )
+
+    def test_user_without_profile(self):
+        user = UserModel.objects.select_related("profile").get(pk=self.friends[2].pk)
+        expected = {
+            "id": user.pk, "username": "projection2", "email": "projection2@example.com",
+            "profile_image": None, "phone": None, "city": None, "country": None,
+        }
+
+        self.assertEqual(UserModelSerializer(user).data, expected)
+        self.assertEqual(UserSummaryProjection().project(UserModel.objects.filter(pk=user.pk)), [expected])
+
+    def test_friends_and_suggestions(self):
+        friendships = Friend.objects.friendships(self.user)
+        requests = FriendshipRequest.objects.order_by("id")
+        suggestions = FriendSuggestion.objects.all()
+        self.assertSameJSON(FriendSerializer(friendships, many=True).data, FriendProjection().project(friendships))
+        self.assertSameJSON(FriendSerializer(requests, many=True).data, FriendProjection().project(requests))
+        self.assertSameJSON(
+            FriendSuggestionSerializer(suggestions, many=True).data,
+            FriendSuggestionProjection().project(suggestions),
+        )
+
+    def test_friendship_status_view(self):
+        response = APIClient().get("/api/v1/friends/friend-ship-status/projection/projection0")
+        expected = FriendshipStatusSerializer({
+            "friendship_status": "Friends",
+            "friends_or_mutual": Friend.objects.friends(self.user).select_related("profile"),
+        }).data
+
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+
+    @patch("friends.views.FriendshipStatusListView.mutual_friends_limit", 2)
+    def test_friendship_status_view_is_capped(self):
+        response = APIClient().get("/api/v1/friends/friend-ship-status/projection/projection0")
+
+        self.assertEqual(
+            [user["username"] for user in response.json()["friends_or_mutual"]],
+            [friend.username for friend in self.friends[:0:-1]],
+        )
+
+class QueryCountTest(TestCase):
+    """ Every list endpoint costs the same number of queries however long the list is """
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="queries", email="queries@example.com")
+        self.other = UserModel.objects.create(username="queries-other", email="queries-other@example.com")
+        self.rows = 0
+        self.grow(3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def grow(self, count):
+        """ Add `count` mutual friends, incoming requests and suggestions """
+        for _ in range(count):
+            self.rows += 1
+            friend = UserModel.objects.create(username=f"queries{self.rows}", email=f"queries{self.rows}@example.com")
+            for user in (self.user, self.other):
+                user.friends.create(from_user=friend)
+                friend.friends.create(from_user=user)
+            sender = UserModel.objects.create(username=f"sender{self.rows}", email=f"sender{self.rows}@example.com")
+            FriendshipRequest.objects.create(from_user=sender, to_user=self.user)
+            FriendSuggestion.objects.create(user=self.user, suggested_user=sender, mutual_count=self.rows)
+
+    def assertConstantQueries(self, num, url, length):
+        """ `url` takes `num` queries and returns `length(response)` rows, before and after the lists grow """
+        for _ in range(2):
+            get_friend_id_cache().clear()
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+                content = b"".join(response.streaming_content) if response.streaming else response.content
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(length(json.loads(content)), self.rows)
+            self.grow(2)
+
+    # Every GET also reads the graph versions behind its ETag.
+
+    def test_friends_list(self):
+        self.assertConstantQueries(2, "/api/v1/friends/friends-list", lambda data: len(data["results"]))
+        self.assertConstantQueries(2, "/api/v1/friends/friends-list?stream=true", len)
+
+    def test_friend_requests(self):
+        self.assertConstantQueries(2, "/api/v1/friends/friends-requests", lambda data: len(data["results"]))
+        self.assertConstantQueries(2, "/api/v1/friends/friends-requests?stream=true", len)
+
+    def test_friends_of_friends(self):
+        self.assertConstantQueries(2, "/api/v1/friends/friends-of-friends", lambda data: len(data["results"]))
+
+    def test_mutual_friends(self):
+        self.assertConstantQueries(
+            4, "/api/v1/friends/mutual-friends/queries-other", lambda data: len(data["results"])
+        )
+
+    def test_friendship_status_of_strangers(self):
+        # Both users, the adjacency list of the first one, the page of mutual friend ids and their users.
+        self.assertConstantQueries(
+            6, "/api/v1/friends/friend-ship-status/queries/queries-other", lambda data: len(data["friends_or_mutual"])
+        )
+
+    def test_friendship_status_of_friends(self):
+        self.user.friends.create(from_user=self.other)
+        self.other.friends.create(from_user=self.user)
+        # Both users, the adjacency list of the first one and the friend list.
+        self.assertConstantQueries(
+            5, "/api/v1/friends/friend-ship-status/queries/queries-other",
+            lambda data: len(data["friends_or_mutual"]) - 1,
+        )
+
+    def test_send_request(self):
+        # The recipient with their profile, then the INSERT, the outbox event and the counters in one transaction. The
+        # sender's profile is already cached on the authenticated user here.
+        with self.assertNumQueries(6):
+            response = self.client.post("/api/v1/friends/send-friends-requests/queries-other")
+        self.assertEqual(response.json()["friend_request"]["to_user_info"]["username"], "queries-other")
+
+    def test_serializers_over_manager_querysets(self):
+        for serializer_class, queryset in (
+            (FriendSerializer, Friend.objects.friendships(self.user)),
+            (FriendSerializer, Friend.objects.requests(self.user)),
+            (FriendshipRequestSerializer, Friend.objects.got_friend_requests(self.user)),
+            (FriendshipRequestSerializer, Friend.objects.unrejected_requests(self.user)),
+            (UserModelSerializer, Friend.objects.friends(self.user)),
+        ):
+            with self.assertNumQueries(1):
+                self.assertEqual(len(serializer_class(queryset, many=True).data), 3)
+
+
+class AsyncViewTestMixin:
+    """ The async endpoints answer exactly like their sync counterparts """
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="async", email="async@example.com")
+        self.other = UserModel.objects.create(username="async-other", email="async-other@example.com")
+        for i in range(3):
+            friend = UserModel.objects.create(username=f"async{i}", email=f"async{i}@example.com")
+            for user in (self.user, self.other):
+                Friend.objects.add_friend(user, friend).accept()
+        FriendshipRequest.objects.create(from_user=UserModel.objects.get(username="async0"), to_user=self.other)
+        FriendSuggestion.objects.create(user=self.user, suggested_user=self.other, mutual_count=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    async def assertSameResponse(self, path):
+        with self.settings(FRIENDS_ASYNC_PARALLEL_QUERIES=self.parallel):
+            expected = await sync_to_async(self.client.get)(f"/api/v1/friends/{path}")
+            response = await self.async_client.get(f"/api/v1/friends/async/{path}", headers=self.headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content.replace(b"/async/", b"/"), expected.content)
+
+    async def test_lists(self):
+        await self.assertSameResponse("friends-list?page_size=2")
+        await self.assertSameResponse("friends-requests")
+        await self.assertSameResponse("friends-of-friends")
+        await self.assertSameResponse("mutual-friends/async-other?page_size=2")
+        await self.assertSameResponse("mutual-friends/missing")
+
+    async def test_statuses(self):
+        await self.assertSameResponse("friend-ship-status/async/async-other")
+        await self.assertSameResponse("friend-ship-status/async/async1")
+        await self.assertSameResponse("friend-ship-status/async/missing")
+        await self.assertSameResponse("friend-ship-statuses?usernames=async-other,async0,missing")
+        await self.assertSameResponse("friend-ship-statuses")
+
+    async def test_status_lists_are_capped(self):
+        with patch("friends.views.FriendshipStatusListView.mutual_friends_limit", 2), \
+                patch("friends.async_views.FriendshipStatusListView.mutual_friends_limit", 2):
+            for path in ("friend-ship-status/async/async1", "friend-ship-status/async/async-other"):
+                await self.assertSameResponse(path)
+                response = await sync_to_async(self.client.get)(f"/api/v1/friends/{path}")
+                self.assertEqual(len(response.json()["friends_or_mutual"]), 2)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get("/api/v1/friends/async/friends-list")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"detail": "Authentication credentials were not provided."})
+
+
+@skipUnless(connection.vendor == "postgresql", "The pooled backend is PostgreSQL only")
+class QueryThreadPoolTest(TestCase):
+    def test_pooled_connection_is_returned_after_each_query(self):
+        wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            "ENGINE": "utils.db.backends.postgresql_pool",
+            "POOL": {"MIN_SIZE": 0, "MAX_SIZE": 1},
+        }, "pooled")
+        self.addCleanup(close_pools, lambda key: key.startswith("pooled:"))
+        self.addCleanup(wrapper.close)
+
+        def query():
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        with patch("friends.async_views.connections") as handler:
+            handler.all.return_value = [wrapper]
+            _in_query_thread(query)()
+            _in_query_thread(query)()
+
+        [stats] = [stats for key, stats in pool_stats().items() if key.startswith("pooled:")]
+        self.assertEqual((stats["checkouts"], stats["in_use"]), (2, 0))
+
+
+class AsyncViewTest(AsyncViewTestMixin, TestCase):
+    parallel = False
+
+
+class ParallelAsyncViewTest(AsyncViewTestMixin, TransactionTestCase):
+    """ Independent queries run on separate connections, so the data must be committed """
+    parallel = True
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(shutdown_query_executor)
+
+
+class QueryPlanTest(TestCase):
+    """ Fails when a FriendshipManager query can only be answered with a sequential scan """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = UserModel.objects.bulk_create([
+            UserModel(username=f"plan{i}", email=f"plan{i}@example.com") for i in range(200)
+        ])
+        ProfileModel.objects.bulk_create([ProfileModel(user=user) for user in users])
+        friends, requests = [], []
+        for i, user in enumerate(users):
+            for step in (1, 7, 31):
+                other = users[(i + step) % len(users)]
+                friends += [Friend(to_user=user, from_user=other), Friend(to_user=other, from_user=user)]
+            other = users[(i + 97) % len(users)]
+            requests.append(FriendshipRequest(
+                from_user=user, to_user=other,
+                viewed=timezone.now() if i % 2 else None,
+                rejected=timezone.now() if i % 3 == 0 else None,
+            ))
+        Friend.objects.bulk_create(friends, ignore_conflicts=True)
+        FriendshipRequest.objects.bulk_create(requests, ignore_conflicts=True)
+        with connection.cursor() as cursor:
+            for model in (Friend, FriendshipRequest, ProfileModel, UserModel):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        cls.user, cls.other = users[0], users[150]
+
+    def setUp(self):
+        get_friend_id_cache().clear()
+        with connection.cursor() as cursor:
+            # Sequential scans stay possible but are priced out, so one in a plan means no index can serve it.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertNoSeqScan(self, function, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = function(*args, **kwargs)
+            if hasattr(result, "query"):
+                list(result)
+        statements = [
+            query["sql"] for query in queries.captured_queries
+            if not query["sql"].startswith(("SAVEPOINT", "RELEASE", "ROLLBACK"))
+        ]
+        self.assertTrue(statements, f"{function.__name__} ran no queries")
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f"EXPLAIN {sql}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertNotIn("Seq Scan", plan, f"{function.__name__}:\n{sql}\n{plan}")
+
+    def test_read_methods(self):
+        for method in (
+            Friend.objects.friends,
+            Friend.objects.friendships,
+            Friend.objects.friend_ids,
+            Friend.objects.requests,
+            Friend.objects.sent_requests,
+            Friend.objects.got_friend_requests,
+            Friend.objects.unread_requests,
+            Friend.objects.unread_request_count,
+            Friend.objects.read_requests,
+            Friend.objects.rejected_requests,
+            Friend.objects.unrejected_requests,
+            Friend.objects.unrejected_request_count,
+            Friend.objects.friend_count,
+        ):
+            with self.subTest(method=method.__name__):
+                self.assertNoSeqScan(method, self.user)
+
+    def test_pair_methods(self):
+        self.assertNoSeqScan(Friend.objects.relationship_statuses, self.user, [self.other.pk, 1, 2, 3])
+        self.assertNoSeqScan(mutual_friends.page, self.user, self.other)
+        self.assertNoSeqScan(mutual_friends.count, self.user, self.other)
+
+    def test_write_methods(self):
+        stranger = UserModel.objects.get(username="plan50")
+        self.assertNoSeqScan(Friend.objects.add_friend, self.user, stranger)
+        request = FriendshipRequest.objects.get(from_user=self.user, to_user=stranger)
+        self.assertNoSeqScan(request.mark_viewed)
+        self.assertNoSeqScan(request.accept)
+        self.assertNoSeqScan(Friend.objects.remove_friend, self.user, stranger)
+        self.assertNoSeqScan(Friend.objects.add_friends, self.user, ["plan60", "plan61"])
+        self.assertNoSeqScan(Friend.objects.accept_requests, self.other, ["plan53"])
@@ -1,12 +1,25 @@
 from django.urls import include, path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path("friends-list", views.FriendListView.as_view()),
     path("friends-requests", views.FriendRequestsListView.as_view()),
     path("send-friends-requests/<str:username>", views.FriendshipRequestViewSet.as_view()),
     path("accept-friends-requests/<str:username>", views.AcceptFriendRequestViewSet.as_view()),
+    path("bulk-send-friends-requests", views.BulkFriendshipRequestView.as_view()),
+    path("bulk-accept-friends-requests", views.BulkAcceptFriendRequestView.as_view()),
+    path("bulk-reject-friends-requests", views.BulkRejectFriendRequestView.as_view()),
     path("friends-of-friends", views.FriendsOfFriendListView.as_view()),
-    path("mutual-friends", views.MutualFriendListView.as_view()),
+    path("mutual-friends/<str:username>", views.MutualFriendListView.as_view()),
     path("friend-ship-status/<str:username1>/<str:username2>", views.FriendshipStatusListView.as_view()),
+    path("friend-ship-statuses", views.FriendshipStatusBatchView.as_view()),
+    path("degrees-of-separation/<str:username1>/<str:username2>", views.DegreesOfSeparationView.as_view()),
+    # Async versions of the read endpoints, for deployments on the ASGI entry point
+    path("async/friends-list", async_views.FriendListView.as_view()),
+    path("async/friends-requests", async_views.FriendRequestsListView.as_view()),
+    path("async/friends-of-friends", async_views.FriendsOfFriendListView.as_view()),
+    path("async/mutual-friends/<str:username>", async_views.MutualFriendListView.as_view()),
+    path("async/friend-ship-status/<str:username1>/<str:username2>", async_views.FriendshipStatusListView.as_view()),
+    path("async/friend-ship-statuses", async_views.FriendshipStatusBatchView.as_view()),
+    path("async/events", async_views.FriendEventStreamView.as_view()),
 ]
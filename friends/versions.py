@@ -0,0 +1,95 @@
+"""
+Conditional GET for the friends endpoints.
+
+Responses that only depend on the friend graph of a few users carry an ETag
+built from those users' ``graph_version`` and a Last-Modified date from their
+``graph_changed_at`` (see ``friends.counters``). A request whose
+``If-None-Match`` or ``If-Modified-Since`` still matches is answered with 304
+after a single query, before any list is read or serialized.
+
+The versions cover friendships, requests and suggestions, not profile fields
+of the users listed, so a changed avatar or city shows up once the graph
+changes next.
+"""
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from users.models import ProfileModel
+
+
+def graph_version(user_ids=(), usernames=()):
+    """
+    Return the `(etag, last_modified)` of the graph of the given users, or None unless every user exists.
+
+    `last_modified` is a timestamp in seconds, or None if the graphs never changed.
+    """
+    user_ids, usernames = set(user_ids), set(usernames)
+    rows = list(
+        ProfileModel.objects.filter(Q(user_id__in=user_ids) | Q(user__username__in=usernames))
+        .order_by("user_id")
+        .values_list("user_id", "user__username", "graph_version", "graph_changed_at")
+    )
+    if not user_ids.issubset(row[0] for row in rows) or not usernames.issubset(row[1] for row in rows):
+        return None
+
+    etag = 'W/"{}"'.format("-".join(f"{user_id}.{version}" for user_id, _, version, _ in rows))
+    changed = [changed_at for _, _, _, changed_at in rows if changed_at is not None]
+    return etag, int(max(changed).timestamp()) if changed else None
+
+
+class NotModified(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class GraphVersionMixin:
+    """
+    Answers `GET` with 304 while the graph of the users the response depends on is unchanged.
+
+    The response depends on the authenticated user's graph unless `graph_version_viewer` is False, and on the graph
+    of the users named by the URL keyword arguments listed in `graph_version_usernames`. The version is checked once
+    authentication and permissions have passed, before the handler runs.
+    """
+    graph_version_viewer = True
+    graph_version_usernames = ()
+    graph_version = None
+
+    def get_graph_version(self, request, kwargs):
+        user_ids = []
+        if self.graph_version_viewer:
+            if not request.user.is_authenticated:
+                return None
+            user_ids.append(request.user.pk)
+        usernames = [kwargs[name] for name in self.graph_version_usernames if kwargs.get(name)]
+        return graph_version(user_ids, usernames)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ("GET", "HEAD"):
+            return
+        self.graph_version = self.get_graph_version(request, kwargs)
+        if self.graph_version is not None:
+            etag, last_modified = self.graph_version
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                raise NotModified(not_modified)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return self.set_version_headers(exc.response)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code == 200:
+            self.set_version_headers(response)
+        return response
+
+    def set_version_headers(self, response):
+        if self.graph_version is not None:
+            etag, last_modified = self.graph_version
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
@@ -7,12 +7,19 @@ from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 
 from users.models import UserModel
-from .models import Friend, FriendshipRequest
-from .serializers import FriendSerializer, FriendshipRequestSerializer, FriendshipStatusSerializer, \
-    UserModelSerializer
-
-
-class FriendListView(generics.ListAPIView):
+from .models import Friend, FriendshipRequest, FriendSuggestion
+from .mutual import mutual_friends
+from .pagination import KeysetPagination
+from .paths import friend_paths
+from .projections import FriendProjection, FriendSuggestionProjection, ProjectionListMixin, \
+    UserSummaryProjection
+from .streaming import StreamingListMixin
+from .versions import GraphVersionMixin
+from .serializers import BulkUsernamesSerializer, FriendSerializer, FriendshipRequestSerializer, \
+    FriendshipStatusSerializer, FriendSuggestionSerializer, UserModelSerializer
+
+
+class FriendListView(GraphVersionMixin, StreamingListMixin, ProjectionListMixin, generics.ListAPIView):
     """
     List a user's friends.
 
@@ -26,6 +33,9 @@ class FriendListView(generics.ListAPIView):
     - `to_user`: The user to whom the authenticated user is friends with.
     - `from_user`: The authenticated user who is friends with another user.
 
+    Pass `?stream=true` to receive every friend in one streamed JSON array instead of pages.
+    Responses carry an ETag; send it back in `If-None-Match` to get a 304 while the list is unchanged.
+
     Response:
     [
         {
@@ -54,19 +64,21 @@ class FriendListView(generics.ListAPIView):
     """
     queryset = Friend.objects.all()
     serializer_class = FriendSerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
+    projection_class = FriendProjection
 
     def get_queryset(self):
         # Get the authenticated user
         user = self.request.user
 
-        # Utilize the existing `friends` method from the manager
-        friends = Friend.objects.friends(user)
+        # Utilize the existing `friendships` method from the manager
+        friends = Friend.objects.friendships(user)
 
         return friends
 
 
-class FriendRequestsListView(generics.ListAPIView):
+class FriendRequestsListView(GraphVersionMixin, StreamingListMixin, ProjectionListMixin, generics.ListAPIView):
     """
         List a user's friendship requests.
 
@@ -85,6 +97,9 @@ class FriendRequestsListView(generics.ListAPIView):
         - `to_user`: The user to whom the authenticated user is friends with.
         - `from_user`: The authenticated user who is friends with another user.
 
+        Pass `?stream=true` to receive every request in one streamed JSON array instead of pages.
+        Responses carry an ETag; send it back in `If-None-Match` to get a 304 while the list is unchanged.
+
         Example Response:
         [
             {
@@ -112,13 +127,15 @@ class FriendRequestsListView(generics.ListAPIView):
         ]
     """
     serializer_class = FriendSerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
+    projection_class = FriendProjection
 
     def get_queryset(self):
         # Get the authenticated user
         user = self.request.user
 
-        # Utilize the existing `friends` method from the manager
+        # Utilize the existing `requests` method from the manager
         friends = Friend.objects.requests(user)
 
         return friends
@@ -143,7 +160,7 @@ class FriendshipRequestViewSet(generics.CreateAPIView):
 
     def post(self, request, username=None, *args, **kwargs):
         if username is not None:
-            friend_user = UserModel.objects.get(username=username)
+            friend_user = UserModel.objects.select_related('profile').get(username=username)
             try:
                 friend_request = Friend.objects.add_friend(request.user, friend_user,
                                                            message='Hi! I would like to add you')
@@ -198,42 +215,165 @@ class AcceptFriendRequestViewSet(generics.CreateAPIView):
             return JsonResponse({'detail': 'Invalid request.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MutualFriendListView(generics.ListAPIView):
-    serializer_class = FriendSerializer
+class BulkFriendshipRequestView(generics.GenericAPIView):
+    """
+        Send friendship requests to many users in one call.
+
+        Usernames are resolved with a single query, existing friendships and requests are checked in bulk and all new
+        requests are written in one transaction.
+
+        Request Example:
+        {
+            "usernames": ["friend1", "friend2", "missing"],
+            "message": "Hi! I would like to add you"
+        }
+
+        Response Example:
+        {
+            "status": true,
+            "results": [
+                {"username": "friend1", "status": "sent"},
+                {"username": "friend2", "status": "already_friends"},
+                {"username": "missing", "status": "not_found"}
+            ]
+        }
+    """
+    serializer_class = BulkUsernamesSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        user = self.request.user
-        # Get the friends of the user
-        friends = Friend.objects.friends(user)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = Friend.objects.add_friends(
+            request.user, serializer.validated_data['usernames'],
+            message=serializer.validated_data['message'] or 'Hi! I would like to add you',
+        )
+        return Response({'status': True, 'results': results})
 
-        # Get friends of your friends (including your friends)
-        friends_of_friends = Friend.objects.filter(to_user__in=friends)
 
-        return friends_of_friends
+class BulkAcceptFriendRequestView(generics.GenericAPIView):
+    """
+        Accept the friendship requests from many users in one call.
 
+        Request Example:
+        {"usernames": ["friend1", "friend2"]}
 
-class FriendsOfFriendListView(generics.ListAPIView):
-    serializer_class = FriendSerializer
+        Response Example:
+        {
+            "status": true,
+            "results": [
+                {"username": "friend1", "status": "accepted"},
+                {"username": "friend2", "status": "no_request"}
+            ]
+        }
+    """
+    serializer_class = BulkUsernamesSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        user = self.request.user
-        # Get the friends of the user
-        friends = Friend.objects.friends(user)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = Friend.objects.accept_requests(request.user, serializer.validated_data['usernames'])
+        return Response({'status': True, 'results': results})
 
-        # Get friends of your friends (including your friends)
-        friends_of_friends = Friend.objects.filter(to_user__in=friends)
 
-        return friends_of_friends
+class BulkRejectFriendRequestView(generics.GenericAPIView):
+    """
+        Reject the friendship requests from many users in one call.
 
+        Request Example:
+        {"usernames": ["friend1", "friend2"]}
 
-class FriendshipStatusListView(generics.ListAPIView):
+        Response Example:
+        {
+            "status": true,
+            "results": [
+                {"username": "friend1", "status": "rejected"},
+                {"username": "friend2", "status": "already_rejected"}
+            ]
+        }
+    """
+    serializer_class = BulkUsernamesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = Friend.objects.reject_requests(request.user, serializer.validated_data['usernames'])
+        return Response({'status': True, 'results': results})
+
+
+class MutualFriendListView(GraphVersionMixin, generics.GenericAPIView):
+    """
+        List the friends the authenticated user has in common with another user.
+
+        Parameters:
+        - `username` (str): The username of the other user.
+        - `page_size` (int, query): Page size, 20 by default and at most 100.
+        - `cursor` (str, query): The cursor from the `next` link of the previous page.
+
+        Response Example:
+        {
+            "count": 2,
+            "next": null,
+            "results": [
+                {"id": 3, "username": "friend1", ...},
+                {"id": 7, "username": "friend2", ...}
+            ]
+        }
+    """
+    serializer_class = UserModelSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [permissions.IsAuthenticated]
+    graph_version_usernames = ("username",)
+
+    def get(self, request, username=None, *args, **kwargs):
+        try:
+            other_user = UserModel.objects.get(username=username)
+        except UserModel.DoesNotExist:
+            return Response({'detail': 'User not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        projection = UserSummaryProjection("from_user__")
+        queryset = mutual_friends.queryset(request.user, other_user).values(*projection.lookups(), "created_at", "id")
+        rows = self.paginate_queryset(queryset)
+        self.paginator.count = mutual_friends.count(request.user, other_user)
+        return self.get_paginated_response(projection.render(rows))
+
+
+class FriendsOfFriendListView(GraphVersionMixin, ProjectionListMixin, generics.ListAPIView):
+    """
+        List "people you may know" for the authenticated user.
+
+        Suggestions are friends of the user's friends ranked by the number of mutual friends, excluding existing
+        friends and users with a pending or rejected friendship request. They are precomputed by the
+        `refresh_friend_suggestions` management command, so this is a single indexed read.
+
+        Response Example:
+        [
+            {
+                "id": 10,
+                "suggested_user_info": {"id": 5, "username": "friend_of_friend", ...},
+                "mutual_count": 3
+            }
+        ]
+    """
+    serializer_class = FriendSuggestionSerializer
+    projection_class = FriendSuggestionProjection
+    pagination_class = KeysetPagination
+    permission_classes = [permissions.IsAuthenticated]
+    ordering = ("-mutual_count", "suggested_user_id")
+
+    def get_queryset(self):
+        return FriendSuggestion.objects.filter(user=self.request.user)
+
+
+class FriendshipStatusListView(GraphVersionMixin, generics.ListAPIView):
     """
         Provides the friendship status and mutual friends list between two users.
 
         This view allows you to check if two users are friends and, if not, it returns a list of mutual friends if they
-         are connected through other users.
+         are connected through other users. Either list holds at most `mutual_friends_limit` users, the newest friends
+         of the first user or the mutual friends with the lowest ids.
 
         ---
         **parameters**
@@ -256,6 +396,9 @@ class FriendshipStatusListView(generics.ListAPIView):
 
     serializer_class = FriendshipStatusSerializer
     permission_classes = [permissions.AllowAny]
+    mutual_friends_limit = 100
+    graph_version_viewer = False
+    graph_version_usernames = ("username1", "username2")
 
     def get(self, request, *args, **kwargs):
         username1 = self.kwargs.get('username1', None)
@@ -270,18 +413,21 @@ class FriendshipStatusListView(generics.ListAPIView):
 
             # Check if the two users are already friends
             if Friend.objects.are_friends(user1, user2):
-                friends_list = Friend.objects.friends(user1)
+                # Same output as FriendshipStatusSerializer, without building a model instance per friend.
                 response_data = {
                     "friendship_status": "Friends",
-                    "friends_or_mutual": friends_list,
-                }
-            else:
-                # Find mutual friends
-                mutual_friends = self.get_mutual_friends(user1, user2)
-                response_data = {
-                    "friendship_status": "Not Friends",
-                    "friends_or_mutual": mutual_friends,
+                    "friends_or_mutual": UserSummaryProjection().project(
+                        Friend.objects.friends(user1)[:self.mutual_friends_limit]
+                    ),
                 }
+                return Response(response_data, status=status.HTTP_200_OK)
+
+            # Find mutual friends
+            mutual_friends = self.get_mutual_friends(user1, user2)
+            response_data = {
+                "friendship_status": "Not Friends",
+                "friends_or_mutual": mutual_friends,
+            }
 
             serializer = FriendshipStatusSerializer(response_data)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -290,14 +436,136 @@ class FriendshipStatusListView(generics.ListAPIView):
             return Response({'detail': 'User not found'}, status=status.HTTP_400_BAD_REQUEST)
 
     def get_mutual_friends(self, user1, user2):
-        friends_user1 = set(Friend.objects.friends(user1))
-        friends_user2 = set(Friend.objects.friends(user2))
-        mutual_friends = friends_user1.union(friends_user2)
+        return mutual_friends.page(user1, user2, limit=self.mutual_friends_limit).results
+
+
+class DegreesOfSeparationView(generics.GenericAPIView):
+    """
+        The shortest chain of friendships between two users.
+
+        Found by a bidirectional breadth-first search over the adjacency cache (see `friends.paths`), which stops at
+        `FRIENDS_PATH_MAX_DEPTH` degrees or when a level has more than `FRIENDS_PATH_MAX_FRONTIER` users.
+
+        ---
+        **parameters**
+            -- name: username1
+              description: The username of the first user.
+              required: true
+              type: string
+              paramType: path
+            -- name: username2
+              description: The username of the second user.
+              required: true
+              type: string
+              paramType: path
+            -- name: max_depth
+              description: The longest path to look for, at most FRIENDS_PATH_MAX_DEPTH.
+              required: false
+              type: integer
+              paramType: query
+        **responses**
+            200:
+                description: The path, "connected", "not_connected" or "too_far" when a limit stopped the search.
+            400:
+                description: Bad request, e.g., when a user is not found.
+
+        Response Example:
+        {
+            "status": "connected",
+            "degrees": 2,
+            "connected_through": 1,
+            "path": [
+                {"id": 1, "username": "alice", ...},
+                {"id": 4, "username": "bob", ...},
+                {"id": 9, "username": "carol", ...}
+            ]
+        }
+    """
+    permission_classes = [permissions.AllowAny]
 
-        # Iterate through mutual friends to find all mutual connections
-        all_mutual_connections = [user1, user2]
-        for friend in mutual_friends:
-            if friend != user1 and friend != user2:
-                all_mutual_connections.append(friend)
+    def get(self, request, username1=None, username2=None, *args, **kwargs):
+        try:
+            max_depth = int(request.query_params.get('max_depth', 0)) or None
+        except ValueError:
+            return Response({'detail': 'max_depth must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if max_depth is not None and max_depth < 0:
+            return Response({'detail': 'max_depth must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_ids = dict(UserModel.objects.filter(username__in=[username1, username2]).values_list('username', 'id'))
+        if username1 not in user_ids or username2 not in user_ids:
+            return Response({'detail': 'User not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        search = friend_paths.search(user_ids[username1], user_ids[username2], max_depth=max_depth)
+        if search.path is None:
+            return Response({
+                'status': 'not_connected' if search.complete else 'too_far',
+                'degrees': None,
+                'connected_through': None,
+                'path': [],
+            })
+
+        users = {
+            user['id']: user
+            for user in UserSummaryProjection().project(UserModel.objects.filter(pk__in=search.path))
+        }
+        return Response({
+            'status': 'connected',
+            'degrees': len(search.path) - 1,
+            'connected_through': max(len(search.path) - 2, 0),
+            'path': [users[user_id] for user_id in search.path],
+        })
 
-        return all_mutual_connections
+
+class FriendshipStatusBatchView(generics.GenericAPIView):
+    """
+        Relationship between the authenticated user and many other users.
+
+        Intended for search results and profile grids. Every status is computed in a fixed number of queries: one to
+        resolve the usernames, one over friendships and one over friendship requests.
+
+        ---
+        **parameters**
+            -- name: usernames
+              description: Comma separated usernames (or a repeated parameter), at most 100.
+              required: true
+              type: string
+              paramType: query
+        **responses**
+            200:
+                description: One status per username, one of "friends", "request_sent", "request_received",
+                 "rejected", "none" or "not_found".
+            400:
+                description: No usernames or too many usernames were given.
+
+        Response Example:
+        {
+            "results": [
+                {"username": "friend1", "status": "friends"},
+                {"username": "stranger", "status": "none"}
+            ]
+        }
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_usernames = 100
+
+    def get(self, request, *args, **kwargs):
+        usernames = [
+            username.strip()
+            for value in request.query_params.getlist('usernames')
+            for username in value.split(',')
+            if username.strip()
+        ]
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            return Response({'detail': 'Please provide at least one username.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(usernames) > self.max_usernames:
+            return Response({'detail': f'At most {self.max_usernames} usernames are allowed.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        user_ids = dict(UserModel.objects.filter(username__in=usernames).values_list('username', 'id'))
+        statuses = Friend.objects.relationship_statuses(request.user, user_ids.values())
+        results = [
+            {'username': username, 'status': statuses[user_ids[username]] if username in user_ids else 'not_found'}
+            for username in usernames
+        ]
+        return Response({'results': results})
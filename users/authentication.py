@@ -0,0 +1,79 @@
+"""
+JWT authentication with cached users.
+
+``CachedJWTAuthentication`` resolves the user of a verified token from a
+cache instead of reading ``UserModel`` on every request. Entries are keyed by
+user id and live for ``USER_AUTH_CACHE_TIMEOUT`` seconds in the
+``USER_AUTH_CACHE_ALIAS`` cache. They are dropped whenever the user is saved
+or deleted, which covers deactivation and password changes, so only writes
+that bypass ``save()`` (``QuerySet.update``) can be served stale, and for at
+most the timeout.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from utils.db.replicas import primary
+
+from .models import UserModel
+
+KEY_PREFIX = "users:jwt-user:"
+
+
+def get_user_cache():
+    return caches[getattr(settings, "USER_AUTH_CACHE_ALIAS", "default")]
+
+
+def user_cache_key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def invalidate_user(user_id):
+    """ Drop the cached user now and again once the transaction commits """
+    key = user_cache_key(user_id)
+    get_user_cache().delete(key)
+    transaction.on_commit(lambda: get_user_cache().delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ `JWTAuthentication` that reads the user from the cache and only queries on a miss """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cache = get_user_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                # Not from a replica, which could cache a user saved before the last invalidation
+                with primary():
+                    user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, user, getattr(settings, "USER_AUTH_CACHE_TIMEOUT", 60))
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+@receiver(post_save, sender=UserModel)
+@receiver(post_delete, sender=UserModel)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(getattr(instance, api_settings.USER_ID_FIELD))
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profilemodel_created_at_profilemodel_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilemodel',
+            name='friend_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profilemodel',
+            name='pending_request_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profilemodel',
+            name='unread_request_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
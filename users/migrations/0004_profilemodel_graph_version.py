@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_profilemodel_friend_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilemodel',
+            name='graph_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='profilemodel',
+            name='graph_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
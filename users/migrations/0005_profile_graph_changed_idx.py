@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-18 05:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Built concurrently so profile writes aren't blocked during the deploy.
+    atomic = False
+
+    dependencies = [
+        ('users', '0004_profilemodel_graph_version'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='profilemodel',
+            index=models.Index(fields=['graph_changed_at'], name='profile_graph_changed_idx'),
+        ),
+    ]
@@ -47,6 +47,20 @@ class ProfileModel(BaseModel):
     city = models.CharField(max_length=20, blank=True)
     country = models.CharField(max_length=20, blank=True)
 
+    # Maintained by friends.counters, repaired by the reconcile_friend_counters command
+    friend_count = models.IntegerField(default=0)
+    pending_request_count = models.IntegerField(default=0)
+    unread_request_count = models.IntegerField(default=0)
+    # Bumped by friends.counters whenever the user's friendships, requests or suggestions change
+    graph_version = models.BigIntegerField(default=0)
+    graph_changed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Polled by friends.snapshot for the users whose graph changed since the snapshot was built
+            models.Index(fields=["graph_changed_at"], name="profile_graph_changed_idx"),
+        ]
+
     def get_profile_image(self):
         if self.profile_image:
             return self.profile_image.url
@@ -1,4 +1,9 @@
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication, get_user_cache
 from .models import ProfileModel, UserModel
 
 
@@ -56,3 +61,40 @@ class ProfileModelTest(TestCase):
 
     def test_get_cover_image(self):
         self.assertEqual(self.profile.get_cover_image(), "avatars/test_cover.jpg")
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        get_user_cache().clear()
+        self.user = UserModel.objects.create_user(
+            username="jwtuser", email="jwt@example.com", password="testpassword", gender="male",
+        )
+        self.request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def authenticate(self):
+        return CachedJWTAuthentication().authenticate(self.request)[0]
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+    def test_save_invalidates(self):
+        self.authenticate()
+        self.user.set_password("changed")
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate().check_password("changed"))
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, "User is inactive"):
+            self.authenticate()
+
+    def test_delete_invalidates(self):
+        self.authenticate()
+        ProfileModel.objects.filter(user=self.user).delete()
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, "User not found"):
+            self.authenticate()
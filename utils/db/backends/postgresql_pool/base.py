@@ -0,0 +1,84 @@
+"""
+PostgreSQL backend drawing its connections from a ``utils.db.pool`` pool.
+
+Closing a connection, at the end of every request with the default
+``CONN_MAX_AGE = 0``, returns it to the pool instead of ending the session, so
+requests skip the TCP and authentication handshake. The pool is configured
+with a ``POOL`` entry in the database settings:
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "utils.db.backends.postgresql_pool",
+            ...
+            "POOL": {"MIN_SIZE": 2, "MAX_SIZE": 20, "TIMEOUT": 5, "MAX_AGE": 1800, "CHECK_AFTER": 30},
+        }
+    }
+"""
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from utils.db.pool import close_pools, get_pool
+
+DEFAULT_POOL = {"MIN_SIZE": 0, "MAX_SIZE": 10, "TIMEOUT": 5.0, "MAX_AGE": None, "CHECK_AFTER": 30.0}
+
+
+def pool_key(alias, conn_params):
+    """ `alias:user@host:port/dbname`, which identifies a pool in `pool_stats()` """
+    return (
+        f"{alias}:{conn_params.get('user') or ''}@{conn_params.get('host') or ''}:{conn_params.get('port') or ''}"
+        f"/{conn_params.get('dbname') or ''}"
+    )
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # The pooled sessions would keep the test database from being dropped.
+        close_pools(lambda key: key.endswith(f"/{test_database_name}"))
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_pool(self, conn_params):
+        options = {**DEFAULT_POOL, **self.settings_dict.get("POOL", {})}
+        return get_pool(
+            pool_key(self.alias, conn_params),
+            min_size=options["MIN_SIZE"],
+            max_size=options["MAX_SIZE"],
+            timeout=options["TIMEOUT"],
+            max_age=options["MAX_AGE"],
+            check_after=options["CHECK_AFTER"],
+        )
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+
+        pool = self.get_pool(conn_params)
+        opened = []
+
+        def connect():
+            opened.append(super(DatabaseWrapper, self).get_new_connection(conn_params))
+            return opened[-1]
+
+        connection = pool.checkout(connect)
+        if connection not in opened:
+            # Set by get_new_connection() for the connections it opens
+            self.isolation_level = IsolationLevel(
+                self.settings_dict["OPTIONS"].get("isolation_level", IsolationLevel.READ_COMMITTED)
+            )
+        self.pool = pool
+        return connection
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        pool, self.pool = self.pool, None
+        with self.wrap_database_errors:
+            pool.checkin(self.connection)
@@ -0,0 +1,209 @@
+"""
+A thread-safe pool of database connections.
+
+``ConnectionPool`` keeps up to ``max_size`` connections of one database open
+between requests. Checkouts reuse the most recently returned idle connection
+and wait up to ``timeout`` seconds once all of them are in use. A connection
+idle for longer than ``check_after`` seconds is pinged before being handed
+out, connections returned inside a transaction are rolled back and
+connections older than ``max_age`` seconds are closed when they come back.
+
+Pools are per process, so ``pool_stats()`` reports the pools of the current
+worker.
+"""
+import threading
+import time
+from collections import deque
+
+# libpq's PQtransactionStatus values, shared by psycopg2 and psycopg
+TRANSACTION_IDLE, TRANSACTION_INTRANS, TRANSACTION_INERROR = 0, 2, 3
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """ Connections handed out by `checkout` and returned with `checkin` """
+
+    def __init__(self, min_size=0, max_size=10, timeout=5.0, max_age=None, check_after=30.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_after = check_after
+        self._idle = deque()
+        self._opened_at = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = dict.fromkeys((
+            "checkouts", "waits", "timeouts", "opened", "closed", "rollbacks", "failed_checks", "expired",
+        ), 0)
+        self._wait_total = self._wait_max = 0.0
+
+    def checkout(self, connect):
+        """
+        Return an open connection, waiting up to `timeout` seconds for one to be returned.
+
+        `connect` opens a new connection when the pool has room for one.
+        """
+        start = time.monotonic()
+        self.fill(connect)
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = start + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No connection available in the pool after {self.timeout} seconds")
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection = None
+                    self._size += 1
+
+            if connection is None:
+                connection = self._open(connect)
+            elif not self._healthy(connection, returned_at):
+                self._count("failed_checks")
+                self._close(connection)
+                continue
+
+            waited_for = time.monotonic() - start if waited else 0.0
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                    self._wait_total += waited_for
+                    self._wait_max = max(self._wait_max, waited_for)
+            return connection
+
+    def checkin(self, connection):
+        """ Return a connection to the pool, rolling back what it left open """
+        if not connection.closed and connection.info.transaction_status in (TRANSACTION_INTRANS, TRANSACTION_INERROR):
+            self._count("rollbacks")
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+
+        if self._closed or connection.closed or connection.info.transaction_status != TRANSACTION_IDLE:
+            self._close(connection)
+        elif self.max_age is not None and time.monotonic() - self._opened_at[id(connection)] > self.max_age:
+            self._count("expired")
+            self._close(connection)
+        else:
+            with self._cond:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def fill(self, connect):
+        """ Open connections with `connect` until the pool holds `min_size` of them """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            connection = self._open(connect)
+            with self._cond:
+                self._idle.appendleft((connection, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        """ Close the idle connections; connections in use are closed when they are returned """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            ages = [now - opened_at for opened_at in self._opened_at.values()]
+            return {
+                **self._stats,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "wait_ms_total": round(self._wait_total * 1000, 3),
+                "wait_ms_max": round(self._wait_max * 1000, 3),
+                "connection_age_s_max": round(max(ages), 3) if ages else 0,
+                "connection_age_s_mean": round(sum(ages) / len(ages), 3) if ages else 0,
+            }
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opened_at[id(connection)] = time.monotonic()
+            self._stats["opened"] += 1
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened_at.pop(id(connection), None)
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+
+    def _healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if connection.info.transaction_status != TRANSACTION_IDLE:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, **options):
+    """ Return the pool registered under `key`, creating it with `options` """
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**options)
+        return _pools[key]
+
+
+def close_pools(predicate=None):
+    """ Close and forget the pools whose key matches `predicate`, all of them by default """
+    with _pools_lock:
+        keys = [key for key in _pools if predicate is None or predicate(key)]
+        closing = [_pools.pop(key) for key in keys]
+    for pool in closing:
+        pool.close()
+
+
+def pool_stats():
+    """ Return the statistics of every pool of this process, by pool key """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {key: pool.stats() for key, pool in pools.items()}
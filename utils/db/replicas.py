@@ -0,0 +1,216 @@
+"""
+Read replicas for HTTP requests.
+
+``ReplicaMiddleware`` lets the reads of a request go to one of the replicas
+listed in ``DATABASE_REPLICAS``, picked once per request among those whose
+replication lag is under ``REPLICA_MAX_LAG`` seconds (see
+``utils.db.routers.ReplicaRouter``). Reads stay on the primary:
+
+* outside of requests, so management commands and workers see their writes,
+* inside transactions and for the rest of a request once it has written,
+* for ``REPLICA_STICKY_SECONDS`` after a user's last write, so users read their
+  own writes on their next requests. The pin is kept in the default cache by
+  user id, and in a cookie for clients that aren't authenticated,
+* inside ``with primary():`` blocks.
+
+The user pin only holds across worker processes when the default cache is
+shared between them, e.g. Redis or Memcached. With the local memory cache
+Django falls back to, a request served by another process than the one that
+wrote only reads from the primary if the client sent the cookie back.
+
+The middleware runs in both sync and async stacks, so the async views aren't
+switched to a thread for every request.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+STICKY_COOKIE = "primary_until"
+
+_request_state = ContextVar("replica_request_state", default=None)
+_primary_only = ContextVar("replica_primary_only", default=False)
+
+
+def sticky_seconds():
+    return getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+
+
+def sticky_key(user_id):
+    return f"replicas:primary:{user_id}"
+
+
+@contextmanager
+def primary():
+    """ Send every read of the block to the primary """
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+class RequestState:
+    """ Where the reads of the current request go """
+
+    def __init__(self, request, pinned=False):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self.user_checked = False
+        self.replica = None
+
+    def user_id(self):
+        """ The id of the authenticated user, once something else has authenticated the request """
+        user = self.request.__dict__.get("user")
+        if type(user) is SimpleLazyObject:
+            user = user._wrapped
+            if user is empty:
+                return None
+        return user.pk if getattr(user, "is_authenticated", False) else None
+
+    def read_alias(self):
+        """ The alias reads should use, or None for the primary """
+        if self.pinned:
+            return None
+        if not self.user_checked:
+            user_id = self.user_id()
+            if user_id is not None:
+                self.user_checked = True
+                if cache.get(sticky_key(user_id)):
+                    self.pinned = True
+                    return None
+        if self.replica is None:
+            self.replica = choose_replica() or DEFAULT_DB_ALIAS
+        return None if self.replica == DEFAULT_DB_ALIAS else self.replica
+
+
+def read_alias():
+    """ The replica the current read should use, or None for the primary """
+    if _primary_only.get() or not getattr(settings, "DATABASE_REPLICAS", ()):
+        return None
+    state = _request_state.get()
+    if state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    return state.read_alias()
+
+
+def record_write():
+    state = _request_state.get()
+    if state is not None:
+        state.wrote = state.pinned = True
+
+
+# Replication lag, measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per replica and process
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_lags = {}
+_lags_lock = threading.Lock()
+
+
+def measure_lag(alias):
+    """ Seconds the replica is behind the primary, or None if it can't be reached """
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except Exception:
+        connections[alias].close()
+        return None
+
+
+def replica_lag(alias):
+    """ The last measured lag of a replica, measuring again once it is older than the check interval """
+    now = time.monotonic()
+    with _lags_lock:
+        measured = _lags.get(alias)
+    if measured is None or now - measured[0] >= getattr(settings, "REPLICA_LAG_CHECK_INTERVAL", 1):
+        measured = (now, measure_lag(alias))
+        with _lags_lock:
+            _lags[alias] = measured
+    return measured[1]
+
+
+def reset_lags():
+    with _lags_lock:
+        _lags.clear()
+
+
+def choose_replica():
+    """ A random replica that is reachable and within `REPLICA_MAX_LAG`, or None """
+    max_lag = getattr(settings, "REPLICA_MAX_LAG", 2)
+    candidates = list(getattr(settings, "DATABASE_REPLICAS", ()))
+    random.shuffle(candidates)
+    for alias in candidates:
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            return alias
+    return None
+
+
+class ReplicaMiddleware:
+    """ Lets the reads of each request use a replica, with the stickiness described above """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.request_state(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state.wrote:
+            user_id = state.user_id()
+            if user_id is not None:
+                cache.set(sticky_key(user_id), True, sticky_seconds())
+            self.set_cookie(response)
+        return response
+
+    async def __acall__(self, request):
+        state = self.request_state(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state.wrote:
+            user_id = state.user_id()
+            if user_id is not None:
+                await cache.aset(sticky_key(user_id), True, sticky_seconds())
+            self.set_cookie(response)
+        return response
+
+    def request_state(self, request):
+        try:
+            pinned = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return RequestState(request, pinned=pinned)
+
+    def set_cookie(self, response):
+        seconds = sticky_seconds()
+        response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from utils.db.replicas import read_alias, record_write
+
+
+class ReplicaRouter:
+    """
+    Writes go to the primary, reads to a replica when `utils.db.replicas` allows it.
+
+    Related objects are read from the database their instance came from.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_alias() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        record_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "DATABASE_REPLICAS", ())}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
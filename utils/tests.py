@@ -0,0 +1,279 @@
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from friends.models import Friend
+from users.models import ProfileModel, UserModel
+from utils.db import replicas
+from utils.db.backends.postgresql_pool.base import DatabaseWrapper
+from utils.db.pool import ConnectionPool, PoolTimeout, TRANSACTION_IDLE, close_pools, pool_stats
+from utils.db.routers import ReplicaRouter
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        params = connection.get_connection_params()
+        self.connect = lambda: connection.Database.connect(**params)
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+
+    def pool(self, **options):
+        pool = ConnectionPool(**options)
+        self.pools.append(pool)
+        return pool
+
+    def test_reuses_connections(self):
+        pool = self.pool(min_size=1, max_size=2)
+        first = pool.checkout(self.connect)
+        pool.checkin(first)
+        self.assertIs(pool.checkout(self.connect), first)
+        second = pool.checkout(self.connect)
+        self.assertIsNot(second, first)
+        stats = pool.stats()
+        self.assertEqual((stats["opened"], stats["checkouts"], stats["in_use"], stats["idle"]), (2, 3, 2, 0))
+
+    def test_waits_then_times_out(self):
+        pool = self.pool(max_size=1, timeout=0.05)
+        pool.checkout(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(self.connect)
+        stats = pool.stats()
+        self.assertEqual((stats["waits"], stats["timeouts"]), (0, 1))
+
+    def test_rolls_back_open_transactions(self):
+        pool = self.pool()
+        conn = pool.checkout(self.connect)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertNotEqual(conn.info.transaction_status, TRANSACTION_IDLE)
+        pool.checkin(conn)
+        self.assertEqual(conn.info.transaction_status, TRANSACTION_IDLE)
+        self.assertIs(pool.checkout(self.connect), conn)
+        self.assertEqual(pool.stats()["rollbacks"], 1)
+
+    def test_drops_broken_and_expired_connections(self):
+        pool = self.pool(check_after=0)
+        conn = pool.checkout(self.connect)
+        pool.checkin(conn)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [conn.info.backend_pid])
+        replacement = pool.checkout(self.connect)
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(pool.stats()["failed_checks"], 1)
+
+        replacement.close()
+        pool.checkin(replacement)
+        self.assertEqual(pool.stats()["size"], 0)
+
+        pool = self.pool(max_age=0)
+        pool.checkin(pool.checkout(self.connect))
+        self.assertEqual((pool.stats()["expired"], pool.stats()["size"]), (1, 0))
+
+
+class PooledBackendTest(TestCase):
+    def setUp(self):
+        # Own pool options, so the counts don't depend on the POOL of the settings under test
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            "ENGINE": "utils.db.backends.postgresql_pool",
+            "POOL": {"MIN_SIZE": 0, "MAX_SIZE": 2},
+        }, "pooled")
+        self.addCleanup(close_pools, lambda key: key.startswith("pooled:"))
+        self.addCleanup(self.wrapper.close)
+
+    def query(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_close_returns_the_connection(self):
+        pid = self.query()
+        self.wrapper.close()
+        self.assertEqual(self.query(), pid)
+        [stats] = [stats for key, stats in pool_stats().items() if key.startswith("pooled:")]
+        self.assertEqual((stats["opened"], stats["checkouts"]), (1, 2))
+
+    def test_transaction_left_open(self):
+        self.wrapper.set_autocommit(False)
+        self.query()
+        self.wrapper.close()
+        self.query()
+        self.assertTrue(self.wrapper.get_autocommit())
+        [stats] = [stats for key, stats in pool_stats().items() if key.startswith("pooled:")]
+        self.assertEqual(stats["rollbacks"], 1)
+
+    def test_stats_endpoint(self):
+        self.query()
+        client = APIClient()
+        user = UserModel.objects.create(username="pool-admin", email="pool-admin@example.com")
+        client.force_authenticate(user)
+        self.assertEqual(client.get("/api/v1/db-pool-stats/").status_code, 403)
+
+        user.is_staff = True
+        client.force_authenticate(user)
+        response = client.get("/api/v1/db-pool-stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(key.startswith("pooled:") for key in response.json()))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_MAX_LAG=2, REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        replicas.reset_lags()
+        self.addCleanup(replicas.reset_lags)
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(replicas, "measure_lag", return_value=0.1)
+        self.measure_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, view, cookies=None, user=None):
+        """ Run `view` behind ReplicaMiddleware and return (response, what the view returned) """
+        request = RequestFactory().get("/")
+        request.COOKIES.update(cookies or {})
+        if user is not None:
+            request.user = user
+        seen = []
+
+        def get_response(request):
+            seen.append(view())
+            return HttpResponse()
+
+        response = replicas.ReplicaMiddleware(get_response)(request)
+        return response, seen[0]
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Friend), "default")
+        self.assertEqual(self.serve(lambda: self.router.db_for_read(Friend))[1], "replica")
+
+    def test_lagging_or_unreachable_replicas_are_skipped(self):
+        self.measure_lag.return_value = 10
+        self.assertEqual(self.serve(lambda: self.router.db_for_read(Friend))[1], "default")
+
+        replicas.reset_lags()
+        self.measure_lag.return_value = None
+        self.assertEqual(self.serve(lambda: self.router.db_for_read(Friend))[1], "default")
+
+    def test_lag_is_measured_once_per_interval(self):
+        with override_settings(REPLICA_LAG_CHECK_INTERVAL=60):
+            for _ in range(3):
+                self.serve(lambda: self.router.db_for_read(Friend))
+        self.assertEqual(self.measure_lag.call_count, 1)
+
+    def test_writes_pin_the_request_and_the_client(self):
+        def view():
+            before = self.router.db_for_read(Friend)
+            self.router.db_for_write(Friend)
+            return before, self.router.db_for_read(Friend)
+
+        response, seen = self.serve(view)
+        self.assertEqual(seen, ("replica", "default"))
+        cookie = response.cookies[replicas.STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], 5)
+
+        read = lambda: self.router.db_for_read(Friend)  # noqa: E731
+        self.assertEqual(self.serve(read, cookies={replicas.STICKY_COOKIE: cookie.value})[1], "default")
+        self.assertEqual(self.serve(read, cookies={replicas.STICKY_COOKIE: "0"})[1], "replica")
+
+    def test_writes_pin_the_user(self):
+        alice, bob = UserModel(pk=1, username="alice"), UserModel(pk=2, username="bob")
+        self.serve(lambda: self.router.db_for_write(Friend), user=alice)
+
+        read = lambda: self.router.db_for_read(Friend)  # noqa: E731
+        self.assertEqual(self.serve(read, user=alice)[1], "default")
+        self.assertEqual(self.serve(read, user=bob)[1], "replica")
+        cache.delete(replicas.sticky_key(alice.pk))
+        self.assertEqual(self.serve(read, user=alice)[1], "replica")
+
+    async def test_async_stack(self):
+        alice = UserModel(pk=1, username="alice")
+
+        def view():
+            before = self.router.db_for_read(Friend)
+            self.router.db_for_write(Friend)
+            return before, self.router.db_for_read(Friend)
+
+        seen = []
+
+        async def get_response(request):
+            seen.append(view())
+            return HttpResponse()
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().get("/")
+        request.user = alice
+        response = await middleware(request)
+
+        self.assertEqual(seen, [("replica", "default")])
+        self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+        self.assertTrue(await cache.aget(replicas.sticky_key(alice.pk)))
+        self.assertIsNone(replicas._request_state.get())
+
+    def test_primary_block_and_instance_hints(self):
+        def view():
+            with replicas.primary():
+                pinned = self.router.db_for_read(Friend)
+            instance = Friend()
+            instance._state.db = "default"
+            return pinned, self.router.db_for_read(Friend, instance=instance), self.router.db_for_read(Friend)
+
+        self.assertEqual(self.serve(view)[1], ("default", "default", "replica"))
+
+
+@skipUnless("replica" in settings.DATABASES, "needs a `replica` database alias")
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_MAX_LAG=2)
+class ReplicaDatabaseTest(TransactionTestCase):
+    """
+    Run against two local databases, with a `replica` alias next to `default`, e.g.
+
+        DATABASES["replica"] = {**DATABASES["default"], "TEST": {"NAME": "test_social_replica"}}
+
+    Nothing replicates between them, so a read shows which one served it.
+    """
+    databases = {"default", "replica"}.intersection(settings.DATABASES)
+
+    def setUp(self):
+        replicas.reset_lags()
+        self.addCleanup(replicas.reset_lags)
+        self.addCleanup(cache.clear)
+        self.alice, self.bob, self.carol = (
+            UserModel.objects.create(username=name, email=f"{name}@example.com") for name in ("alice", "bob", "carol")
+        )
+        # What the replica has received so far: the users, but not their friendship
+        UserModel.objects.using("replica").bulk_create(UserModel.objects.all())
+        ProfileModel.objects.using("replica").bulk_create(ProfileModel.objects.all())
+        Friend.objects.add_friend(self.bob, self.alice).accept()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def friend_usernames(self):
+        response = self.client.get("/api/v1/friends/friends-list")
+        self.assertEqual(response.status_code, 200)
+        return [row["from_user_info"]["username"] for row in response.json()["results"]]
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        self.assertEqual(self.friend_usernames(), [])
+
+        response = self.client.post(f"/api/v1/friends/send-friends-requests/{self.carol.username}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.friend_usernames(), ["bob"])
+
+        self.client.cookies.clear()
+        self.assertEqual(self.friend_usernames(), ["bob"])
+        cache.delete(replicas.sticky_key(self.alice.pk))
+        self.assertEqual(self.friend_usernames(), [])
+
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.assertEqual(replicas.measure_lag("replica"), 0)
+        with override_settings(REPLICA_MAX_LAG=-1):
+            self.assertEqual(self.friend_usernames(), ["bob"])
@@ -0,0 +1,18 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from utils.db.pool import pool_stats
+
+
+class DatabasePoolStatsView(APIView):
+    """
+        Statistics of the database connection pools of the worker that answers.
+
+        Counters (`checkouts`, `waits`, `timeouts`, `opened`, `closed`, `rollbacks`, `failed_checks`, `expired`) run
+        since the worker started; `size`, `idle`, `in_use` and the connection ages describe the pool right now.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(pool_stats())